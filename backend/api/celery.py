@@ -4,4 +4,5 @@ from celery import Celery
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 app = Celery("api")
 app.config_from_object("django.conf:settings", namespace="CELERY")
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+app.autodiscover_tasks(["api.services.reco_service"])  # reco_service/tasks.py
\ No newline at end of file
@@ -60,6 +60,8 @@ class Command(BaseCommand):
             self.stdout.write(f'   - Số courses: {stats["n_courses"]}')
             self.stdout.write(f'   - Non-zero elements: {stats["nnz"]:,}')
             self.stdout.write(f'   - Density: {stats["density"]*100:.4f}%')
+            if stats.get("ann"):
+                self.stdout.write(f'   - ANN index: {stats["ann"]["nlist"]} clusters, max list {stats["ann"]["max_list"]}')
             
             # Ước tính dung lượng
             from api.services.reco_service.cb.similarity import COURSE_SIM_MATRIX_PATH
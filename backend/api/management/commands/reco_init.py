@@ -6,11 +6,14 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--force", action="store_true", help="Force rebuild")
+        parser.add_argument("--verify", action="store_true", help="Verify TF-IDF artifact checksums (manifest sha1)")
 
     def handle(self, *args, **options):
         # TF-IDF
         self.stdout.write(self.style.MIGRATE_HEADING("Ensuring TF-IDF artifacts..."))
-        info_cb = ensure_tfidf_artifacts(force=options.get("force", False))
+        info_cb = ensure_tfidf_artifacts(
+            force=options.get("force", False), verify_checksums=options.get("verify", False)
+        )
         if info_cb:
             self.stdout.write(self.style.SUCCESS(f"TF-IDF built: {info_cb}"))
         else:
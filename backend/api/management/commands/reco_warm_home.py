@@ -0,0 +1,50 @@
+"""
+Django management command để tính trước gợi ý Home theo lô và ghi vào cache
+(vd. sau khi rebuild TF-IDF / CF, trước giờ cao điểm).
+
+Sử dụng:
+    python manage.py reco_warm_home
+    python manage.py reco_warm_home --users <uuid> <uuid> --alpha 0.7 --chunk-size 256
+
+Chạy mỗi HOME_WARM_INTERVAL_MINUTES phút (cron); cache ghi sẵn sống TTL_USER_HOME_WARM giây (--ttl để đổi).
+"""
+from django.core.management.base import BaseCommand
+from api.services.reco_service.hybrid.batch import warm_home_cache
+from api.services.reco_service.config import ALPHA_HOME, HOME_BATCH_CHUNK_USERS, TTL_USER_HOME_WARM
+
+
+class Command(BaseCommand):
+    help = 'Warm the home recommendation cache for many users at once'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            nargs='*',
+            default=None,
+            help='User IDs to warm (default: every user with an enrollment or favorite)',
+        )
+        parser.add_argument('--alpha', type=float, default=ALPHA_HOME, help='CB weight in the blend')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=HOME_BATCH_CHUNK_USERS,
+            help='Users scored per batch',
+        )
+        parser.add_argument(
+            '--ttl',
+            type=int,
+            default=TTL_USER_HOME_WARM,
+            help='Seconds warmed entries stay cached (default: until the next scheduled warm run)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING('Warming home recommendation cache...'))
+        stats = warm_home_cache(
+            user_ids=options.get('users') or None,
+            alpha=options['alpha'],
+            chunk_size=options['chunk_size'],
+            ttl=options['ttl'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Warmed {stats['users']} users in {stats['chunks']} chunks ({stats['seconds']}s)"
+        ))
@@ -0,0 +1,189 @@
+from __future__ import annotations
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+from api.services.reco_service.io.misc_store import save_npy_atomic
+from api.services.reco_service.io.registry import get_artifact
+from api.services.reco_service.config import (
+    COURSE_ANN_NLIST, COURSE_ANN_NPROBE, COURSE_ANN_KMEANS_ITER, COURSE_ANN_TRAIN_SAMPLE
+)
+
+"""
+ANN index (IVF) cho course similarity khi catalog lớn, thuần NumPy / scipy.
+
+- Spherical k-means trên vector course V (TF-IDF X hoặc embedding E, hàng đã L2):
+  nlist centroid (L2) -> mỗi course thuộc 1 danh sách (cluster gần nhất theo cosine).
+- Query q: cosine với nlist centroid -> dò nprobe cluster gần nhất, chỉ chấm điểm chính xác
+  các course trong các cluster đó (~ N * nprobe / nlist hàng thay vì N).
+  nprobe lớn -> recall cao hơn, chậm hơn; nprobe >= nlist -> quét toàn bộ (chính xác).
+- Artifacts (cạnh course_similarity_matrix.npz), nạp memmap qua registry "cb":
+    course_ann_centroids.npy : float32 (nlist × dim)
+    course_ann_assign.npy    : int32 (N,), cluster của từng hàng
+  Inverted lists (order / offsets) dựng lại từ assign khi nạp.
+- Thêm / sửa 1 course: gán vào centroid gần nhất, chỉ ghi lại assign (không train lại).
+"""
+
+ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
+CENTROIDS_PATH = os.path.join(ARTIFACT_DIR, "course_ann_centroids.npy")
+ASSIGN_PATH = os.path.join(ARTIFACT_DIR, "course_ann_assign.npy")
+
+# Tích vô hướng q (1 × dim, sparse hoặc dense) với từng hàng của M -> ndarray (m,)
+def _dots(M, q) -> np.ndarray:
+    if sparse.issparse(q) and not sparse.issparse(M):
+        # M dense (vd. centroids nlist × D): chỉ đọc các cột khác 0 của q, không copy M.T
+        q = q.tocsr()
+        return np.asarray(M[:, q.indices] @ q.data)
+    s = q @ M.T
+    return (s.toarray() if sparse.issparse(s) else np.asarray(s)).ravel()
+
+class CourseIVFIndex:
+    """
+    IVF: centroids (nlist × dim) + assign (N,) -> inverted lists dạng CSR
+    (order: hàng course sort theo cluster, offsets: biên của từng cluster trong order).
+    """
+
+    def __init__(self, centroids: np.ndarray, assign: np.ndarray):
+        self.centroids = centroids
+        self.assign = assign
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.order], np.arange(centroids.shape[0] + 1))
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def __len__(self) -> int:
+        return int(self.assign.shape[0])
+
+    # Index có dùng được cho ma trận vector V không (cùng số hàng và số chiều)
+    def matches(self, V) -> bool:
+        return V.shape[0] == len(self) and V.shape[1] == self.centroids.shape[1]
+
+    # Các hàng course trong nprobe cluster gần q nhất
+    def probe(self, q, nprobe: int = COURSE_ANN_NPROBE) -> np.ndarray:
+        nprobe = max(1, min(int(nprobe), self.nlist))
+        cs = _dots(self.centroids, q)
+        lists = np.argpartition(-cs, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists.tolist()])
+
+    # top-k (row, score > 0) của q trên các cluster được dò, điểm tính chính xác trên V
+    def search(
+        self,
+        V,
+        q,
+        k: int,
+        nprobe: int = COURSE_ANN_NPROBE,
+        exclude_rows: Optional[Iterable[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        rows = self.probe(q, nprobe)
+        if exclude_rows:
+            rows = rows[~np.isin(rows, np.fromiter(exclude_rows, dtype=np.int64))]
+        if rows.size == 0:
+            return []
+        sims = _dots(V[rows], q)
+        k = min(int(k), sims.size)
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(int(rows[j]), float(sims[j])) for j in top if sims[j] > 0.0]
+
+# Spherical k-means: centroid L2 (nlist × dim) từ V (hàng đã L2)
+def _train_centroids(V, nlist: int, n_iter: int, sample: int, seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n = V.shape[0]
+    T = V[np.sort(rng.choice(n, size=min(n, sample), replace=False))] if sample and n > sample else V
+    C = T[rng.choice(T.shape[0], size=nlist, replace=False)]
+    C = np.asarray(C.toarray() if sparse.issparse(C) else C, dtype=np.float32)
+    for _ in range(max(1, int(n_iter))):
+        assign = _assign(T, C)
+        onehot = sparse.csr_matrix(
+            (np.ones(assign.size, dtype=np.float32), (assign, np.arange(assign.size))),
+            shape=(nlist, T.shape[0]),
+        )
+        S = onehot @ T
+        S = np.asarray(S.toarray() if sparse.issparse(S) else S, dtype=np.float32)
+        # cluster rỗng -> lấy lại 1 hàng ngẫu nhiên làm centroid
+        empty = np.flatnonzero(np.diff(onehot.indptr) == 0)
+        if empty.size:
+            R = T[rng.choice(T.shape[0], size=empty.size, replace=False)]
+            S[empty] = R.toarray() if sparse.issparse(R) else R
+        C = normalize(S, norm="l2", axis=1, copy=False)
+    return np.ascontiguousarray(C, dtype=np.float32)
+
+# Cluster gần nhất (cosine) của từng hàng V, theo block để giới hạn RAM (block × nlist)
+def _assign(V, C: np.ndarray, block_rows: int = 8192) -> np.ndarray:
+    CT = np.ascontiguousarray(C.T, dtype=np.float32)  # (dim × nlist), dựng 1 lần cho mọi block
+    out = np.empty(V.shape[0], dtype=np.int32)
+    for start in range(0, V.shape[0], block_rows):
+        Vb = V[start:start + block_rows]
+        if sparse.issparse(Vb):
+            Vb = Vb.astype(np.float32)
+        out[start:start + block_rows] = np.asarray(Vb @ CT).argmax(axis=1)
+    return out
+
+# Số cluster mặc định ~ sqrt(N)
+def _default_nlist(n: int) -> int:
+    return max(1, int(round(np.sqrt(n))))
+
+def build_course_ann_index(
+    V,
+    nlist: Optional[int] = COURSE_ANN_NLIST,
+    n_iter: int = COURSE_ANN_KMEANS_ITER,
+    sample: int = COURSE_ANN_TRAIN_SAMPLE,
+) -> Dict:
+    """
+    Train IVF trên V (N × dim, hàng L2: TF-IDF hoặc embedding) và lưu artifacts.
+    nlist None/0 -> ~sqrt(N).
+    """
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    n = V.shape[0]
+    nlist = min(int(nlist or _default_nlist(n)), n)
+    C = _train_centroids(V, nlist, n_iter, sample)
+    assign = _assign(V, C)
+    save_npy_atomic(CENTROIDS_PATH, C)
+    save_npy_atomic(ASSIGN_PATH, assign)
+    sizes = np.bincount(assign, minlength=nlist)
+    return {"n_courses": n, "nlist": nlist, "dim": int(C.shape[1]), "max_list": int(sizes.max())}
+
+# Gán / gán lại các hàng `rows` vào cluster gần nhất, 1 lần ghi assign.
+# V: vector (len(rows) × dim) của các course đó; hàng mới phải nối tiếp cuối assign.
+# Trả False nếu chưa có index hoặc index không khớp (cần build lại).
+def insert_course_ann_rows(rows: np.ndarray, V) -> bool:
+    loaded = _load_course_ann_arrays()
+    if loaded is None:
+        return False
+    C, assign = loaded
+    rows = np.asarray(rows, dtype=np.int64)
+    n = max(assign.shape[0], int(rows.max()) + 1 if rows.size else 0)
+    if V.shape[1] != C.shape[1] or np.setdiff1d(np.arange(assign.shape[0], n), rows).size:
+        return False
+    out = np.empty(n, dtype=np.int32)  # bản copy: không ghi vào file đang được mmap
+    out[:assign.shape[0]] = assign
+    out[rows] = _assign(V, C)
+    save_npy_atomic(ASSIGN_PATH, out)
+    return True
+
+def insert_course_ann_row(row_idx: int, v) -> bool:
+    return insert_course_ann_rows(np.array([row_idx]), v)
+
+def remove_course_ann_index() -> None:
+    for path in (CENTROIDS_PATH, ASSIGN_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _load_course_ann_arrays() -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    if not (os.path.exists(CENTROIDS_PATH) and os.path.exists(ASSIGN_PATH)):
+        return None
+    try:
+        return np.load(CENTROIDS_PATH, mmap_mode="r"), np.load(ASSIGN_PATH, mmap_mode="r")
+    except Exception:
+        return None
+
+def _load_course_ann_index() -> Optional[CourseIVFIndex]:
+    loaded = _load_course_ann_arrays()
+    return None if loaded is None else CourseIVFIndex(*loaded)
+
+# Index IVF (giữ trong registry theo generation "cb"). None nếu chưa build.
+def load_course_ann_index() -> Optional[CourseIVFIndex]:
+    return get_artifact("cb", "ann_ivf", _load_course_ann_index, ARTIFACT_DIR)
@@ -0,0 +1,92 @@
+"""
+Benchmark ANN index (IVF, cb/ann_index.py) vs quét chính xác cho course -> course top-k.
+
+- Dữ liệu: vector course hiện tại (TF-IDF hoặc embedding theo CB_ENGINE), hoặc dữ liệu tổng hợp
+  (n_courses vector dense có cấu trúc cụm) để đo ở quy mô catalog lớn.
+- Index được dựng trong RAM (không ghi artifacts).
+- Với từng nprobe: latency trung bình và recall@k so với quét chính xác.
+
+Chạy test:
+    python manage.py shell -c "from api.services.reco_service.cb.ann_performance_test import test_ann_index; test_ann_index()"
+    python manage.py shell -c "from api.services.reco_service.cb.ann_performance_test import test_ann_index; test_ann_index(n_courses=50000)"
+"""
+import time
+from typing import Optional, Sequence
+import numpy as np
+from sklearn.preprocessing import normalize
+from api.services.reco_service.cb.ann_index import CourseIVFIndex, _assign, _dots, _train_centroids, _default_nlist
+from api.services.reco_service.cb.similarity import _argpartition_topk, _course_vectors
+from api.services.reco_service.cb.tfidf_builder import load_tfidf
+from api.services.reco_service.config import COURSE_ANN_KMEANS_ITER, COURSE_ANN_TRAIN_SAMPLE
+
+# Vector tổng hợp: n điểm quanh n_clusters tâm ngẫu nhiên, hàng L2
+def _synthetic_vectors(n: int, dim: int = 128, n_clusters: int = 500, seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    V = centers[rng.integers(0, n_clusters, size=n)] + 1.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return normalize(V, norm="l2", axis=1)
+
+def test_ann_index(
+    n_courses: Optional[int] = None,
+    k: int = 10,
+    n_queries: int = 200,
+    nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32),
+    nlist: Optional[int] = None,
+):
+    """Recall@k / latency của IVF theo nprobe."""
+    print("=" * 70)
+    print("BENCHMARK: ANN index (IVF) cho course similarity")
+    print("=" * 70)
+
+    if n_courses:
+        V = _synthetic_vectors(int(n_courses))
+        print(f"\n📊 Dữ liệu tổng hợp: {V.shape[0]} x {V.shape[1]}")
+    else:
+        _, X, _ = load_tfidf()
+        if X.shape[0] == 0:
+            print("❌ Không có dữ liệu TF-IDF. Chạy fit_tfidf_and_save() trước.")
+            return
+        V = _course_vectors(X.tocsr())
+        print(f"\n📊 Vector course hiện tại: {V.shape[0]} x {V.shape[1]}")
+
+    n = V.shape[0]
+    nlist = min(int(nlist or _default_nlist(n)), n)
+    start = time.time()
+    C = _train_centroids(V, nlist, COURSE_ANN_KMEANS_ITER, COURSE_ANN_TRAIN_SAMPLE)
+    index = CourseIVFIndex(C, _assign(V, C))
+    print(f"✅ Train {nlist} clusters trong {time.time() - start:.2f}s")
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(n, size=min(n_queries, n), replace=False).tolist()
+    queries = [V[i:i + 1] for i in rows]
+
+    # quét chính xác
+    start = time.perf_counter()
+    exact = []
+    for i, q in zip(rows, queries):
+        sims = _dots(V, q)
+        sims[i] = -1.0
+        top = _argpartition_topk(sims, k)
+        exact.append(set(top[sims[top] > 0].tolist()))
+    t_exact = (time.perf_counter() - start) / len(rows) * 1000
+    print(f"\n🎯 Quét chính xác: {t_exact:.3f}ms/query")
+
+    print(f"\n🚀 IVF top-{k}, {len(rows)} query:")
+    for nprobe in nprobes:
+        if nprobe > nlist:
+            break
+        start = time.perf_counter()
+        results = [index.search(V, q, k, nprobe, [i]) for i, q in zip(rows, queries)]
+        t_ann = (time.perf_counter() - start) / len(rows) * 1000
+        recall = np.mean([
+            len(truth & {r for r, _ in res}) / len(truth) for truth, res in zip(exact, results) if truth
+        ])
+        print(f"   - nprobe={nprobe:>3}: {t_ann:.3f}ms/query (x{t_exact / max(t_ann, 1e-9):.1f}), recall@{k}={recall:.3f}")
+
+    print("\n💡 Chỉnh COURSE_ANN_NPROBE trong config.py theo recall / latency mong muốn.")
+    print("\n" + "=" * 70)
+    print("✅ Test hoàn tất!")
+    print("=" * 70)
+
+if __name__ == "__main__":
+    test_ann_index()
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import io
+import os
+from typing import Dict, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from api.services.reco_service.io.misc_store import save_npy_atomic
+from api.services.reco_service.io.registry import get_artifact
+from api.services.reco_service.config import CB_EMBED_DIM, CB_EMBED_N_ITER
+
+"""
+Embedding dense cho CB (LSA): TruncatedSVD trên ma trận TF-IDF X (N × D, D ~ 50k)
+-> E (N × d) float32 C-contiguous, mỗi hàng L2-normalize, d ~ 128-256.
+
+- cosine(course i, course j) ~ E[i] @ E[j]       -> 1 GEMV (N × d) / query
+- user vector u (1 × D): e = normalize(u @ P), điểm = E @ e; chunk user -> 1 GEMM
+  P (D × d) là ma trận chiếu (components_.T của SVD), lưu sẵn dạng C-contiguous.
+- E và P lưu .npy, nạp bằng mmap (np.load(mmap_mode="r")) qua registry "cb":
+  các tiến trình dùng chung page cache thay vì mỗi worker giữ 1 bản.
+- Fit: ghi file tạm rồi os.replace -> tiến trình đang mmap file cũ vẫn đọc được bản cũ.
+- Cập nhật vài course (update_course_embedding_rows): ghi tại chỗ, không ghi lại N × d:
+  hàng đã có -> ghi qua memmap r+; hàng mới -> nối vào cuối file rồi sửa shape trong header
+  (numpy chừa sẵn chỗ cho trục 0 tăng). Reader đang mmap thấy hàng mới ghi ngay; số hàng mới
+  chỉ thấy sau khi nạp lại (publish "cb").
+
+Chỉ được dùng khi CB_ENGINE = "dense" (xem cb/similarity.py), ngược lại giữ TF-IDF sparse.
+"""
+
+ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
+EMBED_NAME = "course_embedding.npy"
+PROJ_NAME = "course_embedding_proj.npy"
+EMBED_PATH = os.path.join(ARTIFACT_DIR, EMBED_NAME)
+PROJ_PATH = os.path.join(ARTIFACT_DIR, PROJ_NAME)
+
+def _paths(artifact_dir: str) -> Tuple[str, str]:
+    return os.path.join(artifact_dir, EMBED_NAME), os.path.join(artifact_dir, PROJ_NAME)
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    save_npy_atomic(path, np.ascontiguousarray(arr, dtype=np.float32))
+
+# Chiếu các hàng TF-IDF (m × D) sang không gian embedding (m × d), đã L2-normalize
+def project_rows(V: sparse.spmatrix, P: np.ndarray) -> np.ndarray:
+    # float32 cả 2 phía -> scipy không upcast (copy) P sang float64
+    E = sparse.csr_matrix(V, dtype=np.float32) @ P
+    return normalize(E, norm="l2", axis=1, copy=False)
+
+# Fit SVD trên X và lưu E, P vào artifact_dir. Trả thống kê (d = 0 nếu X quá nhỏ để giảm chiều)
+def fit_course_embedding(
+    X: sparse.csr_matrix,
+    dim: int = CB_EMBED_DIM,
+    n_iter: int = CB_EMBED_N_ITER,
+    artifact_dir: str = ARTIFACT_DIR,
+) -> Dict:
+    os.makedirs(artifact_dir, exist_ok=True)
+    embed_path, proj_path = _paths(artifact_dir)
+    n, n_features = X.shape
+    d = min(int(dim), n_features - 1, n - 1)
+    if d < 1:
+        remove_course_embedding(artifact_dir)
+        return {"n_courses": n, "dim": 0}
+
+    svd = TruncatedSVD(n_components=d, algorithm="randomized", n_iter=n_iter, random_state=42)
+    svd.fit(X)
+    P = np.ascontiguousarray(svd.components_.T, dtype=np.float32)  # (D × d)
+    E = project_rows(X, P)
+    _save_npy(proj_path, P)
+    _save_npy(embed_path, E)
+    return {
+        "n_courses": n,
+        "dim": d,
+        "explained_variance": round(float(svd.explained_variance_ratio_.sum()), 4),
+    }
+
+# Ghi các hàng `rows` (vals: len(rows) × d float32) vào file .npy tại chỗ. Hàng >= n_old phải nối
+# tiếp cuối file. False nếu không ghi tại chỗ được (header không đủ chỗ cho shape mới, dtype / thứ tự
+# khác) -> người gọi ghi lại toàn bộ file.
+def _write_rows_inplace(path: str, rows: np.ndarray, vals: np.ndarray) -> bool:
+    fmt = np.lib.format
+    with open(path, "r+b") as f:
+        version = fmt.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = fmt.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = fmt.read_array_header_2_0(f)
+        else:
+            return False
+        header_len = f.tell()
+        if fortran_order or dtype != np.float32 or len(shape) != 2 or shape[1] != vals.shape[1]:
+            return False
+        n_old, dim = int(shape[0]), int(shape[1])
+        n = max(n_old, int(rows.max()) + 1)
+
+        header = io.BytesIO()
+        write_header = fmt.write_array_header_1_0 if version == (1, 0) else fmt.write_array_header_2_0
+        write_header(header, {"descr": fmt.dtype_to_descr(dtype), "fortran_order": False, "shape": (n, dim)})
+        if len(header.getvalue()) != header_len:
+            return False
+
+        old = rows < n_old
+        if old.any():
+            mm = np.memmap(f, dtype=np.float32, mode="r+", offset=header_len, shape=(n_old, dim))
+            mm[rows[old]] = vals[old]
+            mm.flush()
+            del mm
+        if n > n_old:
+            # hàng mới: ghi dữ liệu trước, header (shape) sau cùng
+            new = np.empty((n - n_old, dim), dtype=np.float32)
+            new[rows[~old] - n_old] = vals[~old]
+            f.seek(header_len + n_old * dim * 4)
+            f.write(new.tobytes())
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+    return True
+
+# Ghi đè / thêm các hàng embedding `rows` từ vector TF-IDF V (len(rows) × D), ghi tại chỗ trong file
+# (chỉ các hàng đổi, không ghi lại N × d). Hàng mới phải nối tiếp cuối E (không để trống hàng).
+# Trả False nếu chưa có embedding hoặc số hàng không khớp (engine dense tự lùi về sparse cho tới lần fit lại).
+def update_course_embedding_rows(rows: np.ndarray, V: sparse.spmatrix) -> bool:
+    loaded = read_course_embedding()
+    if loaded is None:
+        return False
+    E, P = loaded
+    rows = np.asarray(rows, dtype=np.int64)
+    if rows.size == 0:
+        return True
+    n = max(E.shape[0], int(rows.max()) + 1)
+    if np.setdiff1d(np.arange(E.shape[0], n), rows).size:
+        return False
+    vals = np.ascontiguousarray(project_rows(V, P), dtype=np.float32)
+    if _write_rows_inplace(EMBED_PATH, rows, vals):
+        return True
+    # file cũ không ghi tại chỗ được -> ghi lại toàn bộ (bản copy: không ghi vào file đang được mmap)
+    out = np.empty((n, E.shape[1]), dtype=np.float32)
+    out[:E.shape[0]] = E
+    out[rows] = vals
+    _save_npy(EMBED_PATH, out)
+    return True
+
+def update_course_embedding_row(row_idx: int, v: sparse.spmatrix) -> bool:
+    return update_course_embedding_rows(np.array([row_idx]), v)
+
+def remove_course_embedding(artifact_dir: str = ARTIFACT_DIR) -> None:
+    for path in _paths(artifact_dir):
+        if os.path.exists(path):
+            os.remove(path)
+
+# (E, P) đọc thẳng từ artifact_dir (memmap, không qua registry). None nếu chưa có / đọc lỗi.
+def read_course_embedding(artifact_dir: str = ARTIFACT_DIR) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    embed_path, proj_path = _paths(artifact_dir)
+    if not (os.path.exists(embed_path) and os.path.exists(proj_path)):
+        return None
+    try:
+        return np.load(embed_path, mmap_mode="r"), np.load(proj_path, mmap_mode="r")
+    except Exception:
+        return None
+
+# (E, P) memory-mapped, giữ trong registry theo generation "cb". None nếu chưa build.
+def load_course_embedding() -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    return get_artifact("cb", "embedding", read_course_embedding, ARTIFACT_DIR)
@@ -0,0 +1,119 @@
+"""
+Benchmark engine CB: TF-IDF sparse (chính xác) vs embedding dense SVD/LSA (cb/embedding.py).
+
+- course -> course: v @ X.T (sparse) vs E @ E[i] (GEMV)
+- user -> course: u @ X.T vs normalize(u @ P) @ E.T, và cả lô user bằng 1 GEMM
+- recall@k: tỉ lệ top-k của engine dense trùng với top-k chính xác của TF-IDF
+
+Cần artifacts TF-IDF (fit_tfidf_and_save). Embedding chưa có / không khớp X -> được fit vào thư mục
+tạm (không ghi vào artifact_dir, không đổi generation "cb").
+
+Chạy test:
+    python manage.py shell -c "from api.services.reco_service.cb.embedding_performance_test import test_embedding_engine; test_embedding_engine()"
+"""
+import time
+import tempfile
+import numpy as np
+from api.services.reco_service.cb.tfidf_builder import load_tfidf
+from api.services.reco_service.cb.embedding import (
+    fit_course_embedding, load_course_embedding, project_rows, read_course_embedding
+)
+from api.services.reco_service.cb.similarity import _argpartition_topk
+from api.services.reco_service.cb.user_profile import build_user_matrix
+from api.services.reco_service.data_access.interactions import fetch_active_user_ids
+from api.services.reco_service.config import CB_EMBED_DIM
+
+# recall@k của top-k dense so với top-k chính xác (bỏ các hàng chỉ có điểm <= 0)
+def _recall_at_k(exact: np.ndarray, approx: np.ndarray, k: int) -> float:
+    top = _argpartition_topk(exact, k)
+    top = top[exact[top] > 0]
+    if top.size == 0:
+        return float("nan")
+    return np.intersect1d(top, _argpartition_topk(approx, k)).size / top.size
+
+# Thời gian trung bình (ms) của fn(x) trên các phần tử của xs
+def _timed(fn, xs) -> float:
+    start = time.perf_counter()
+    for x in xs:
+        fn(x)
+    return (time.perf_counter() - start) / max(1, len(xs)) * 1000
+
+def test_embedding_engine(k: int = 10, n_queries: int = 200, n_users: int = 200, dim: int = CB_EMBED_DIM):
+    """So sánh latency và recall@k giữa engine sparse và dense."""
+    print("=" * 70)
+    print("BENCHMARK: CB engine sparse (TF-IDF) vs dense (SVD embedding)")
+    print("=" * 70)
+
+    _, X, _ = load_tfidf()
+    if X.shape[0] == 0:
+        print("❌ Không có dữ liệu TF-IDF. Chạy fit_tfidf_and_save() trước.")
+        return
+    X = X.tocsr()
+    XT = X.T.tocsr()
+    n = X.shape[0]
+    print(f"\n📊 Số khóa học: {n}, số features: {X.shape[1]}")
+
+    with tempfile.TemporaryDirectory(prefix="reco_embed_") as tmp_dir:
+        emb = load_course_embedding()
+        if emb is None or emb[0].shape[0] != n:
+            print(f"\n⏳ Chưa có embedding khớp TF-IDF -> fit SVD (d={dim}) vào thư mục tạm...")
+            start = time.time()
+            stats = fit_course_embedding(X, dim=dim, artifact_dir=tmp_dir)
+            print(f"✅ Fit xong trong {time.time() - start:.2f}s: {stats}")
+            if not stats["dim"]:
+                print("❌ Quá ít dữ liệu để giảm chiều.")
+                return
+            emb = read_course_embedding(tmp_dir)
+        _run_benchmark(X, XT, emb, k, n_queries, n_users)
+
+def _run_benchmark(X, XT, emb, k: int, n_queries: int, n_users: int) -> None:
+    n = X.shape[0]
+    E, P = emb
+    print(f"📊 Embedding: {E.shape[0]} x {E.shape[1]} float32 ({E.nbytes / 1024 / 1024:.1f} MB)")
+
+    rng = np.random.default_rng(42)
+    rows = rng.choice(n, size=min(n_queries, n), replace=False)
+
+    # 1) course -> course
+    print(f"\n🚀 course -> course, top-{k}, {rows.size} query:")
+    t_sparse = _timed(lambda i: _argpartition_topk(np.asarray((X[i] @ XT).todense()).ravel(), k), rows.tolist())
+    t_dense = _timed(lambda i: _argpartition_topk(E @ E[i], k), rows.tolist())
+
+    recalls = []
+    for i in rows.tolist():
+        exact = np.asarray((X[i] @ XT).todense()).ravel()
+        approx = np.asarray(E @ E[i], dtype=np.float64)
+        exact[i] = approx[i] = -1.0
+        recalls.append(_recall_at_k(exact, approx, k))
+    print(f"   - sparse: {t_sparse:.3f}ms/query")
+    print(f"   - dense : {t_dense:.3f}ms/query (x{t_sparse / max(t_dense, 1e-9):.1f})")
+    print(f"   - recall@{k}: {np.nanmean(recalls):.3f}")
+
+    # 2) user -> course
+    user_ids = fetch_active_user_ids()[:n_users]
+    U = build_user_matrix(user_ids) if user_ids else None
+    if U is None or U.nnz == 0:
+        print("\n⚠️  Không có user nào có tương tác -> bỏ qua benchmark user -> course.")
+    else:
+        U = U[np.flatnonzero(np.diff(U.indptr))]
+        m = U.shape[0]
+        print(f"\n🚀 user -> course, {m} user:")
+        t_sparse = _timed(lambda j: (U[j] @ XT).toarray(), range(m))
+        t_dense = _timed(lambda j: project_rows(U[j], P) @ E.T, range(m))
+        t_sparse_batch = _timed(lambda _: (U @ XT).toarray(), [0])
+        t_dense_batch = _timed(lambda _: project_rows(U, P) @ E.T, [0])
+
+        S_exact = (U @ XT).toarray()
+        S_dense = project_rows(U, P) @ E.T
+        recalls = [_recall_at_k(S_exact[j], S_dense[j], k) for j in range(m)]
+        print(f"   - sparse: {t_sparse:.3f}ms/user, cả lô {t_sparse_batch:.1f}ms")
+        print(f"   - dense : {t_dense:.3f}ms/user, cả lô {t_dense_batch:.1f}ms (GEMM)")
+        print(f"   - recall@{k}: {np.nanmean(recalls):.3f}")
+
+    print("\n💡 Bật engine dense: CB_ENGINE = \"dense\" trong config.py rồi fit lại TF-IDF.")
+    print("\n" + "=" * 70)
+    print("✅ Test hoàn tất!")
+    print("=" * 70)
+
+if __name__ == "__main__":
+    test_embedding_engine()
@@ -3,7 +3,20 @@ from typing import Dict, List, Tuple, Iterable, Optional
 import os
 import numpy as np
 from scipy import sparse
-from api.services.reco_service.cb.tfidf_builder import load_tfidf
+from api.services.reco_service.cb.tfidf_builder import load_tfidf, load_tfidf_inv_row_map
+from api.services.reco_service.io.registry import get_artifact, publish_generation
+from api.services.reco_service.io.misc_store import save_npz_atomic
+from api.services.reco_service.io.delta_store import (
+    append_row_delta, compact_row_delta, load_npz_with_delta, remove_row_delta
+)
+from api.services.reco_service.cb.embedding import load_course_embedding, project_rows
+from api.services.reco_service.cb.ann_index import (
+    CourseIVFIndex, build_course_ann_index, insert_course_ann_rows, load_course_ann_index, remove_course_ann_index
+)
+from api.services.reco_service.config import (
+    COURSE_SIM_TOP_M, COURSE_SIM_MIN_SIM, COURSE_SIM_BLOCK_ROWS, CB_ENGINE,
+    COURSE_ANN_ENABLED, COURSE_ANN_MIN_COURSES, COURSE_ANN_NPROBE
+)
 
 ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
 COURSE_SIM_MATRIX_PATH = os.path.join(ARTIFACT_DIR, "course_similarity_matrix.npz")
@@ -22,48 +35,137 @@ def _argpartition_topk(values: np.ndarray, k: int) -> np.ndarray:
     return part[np.argsort(-values[part])]
 
 
-def build_course_similarity_matrix() -> sparse.csr_matrix:
+def _topm_block(
+    S: np.ndarray,
+    top_m: Optional[int],
+    min_sim: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rút top-M theo từng hàng của block similarity dense S (b x N).
+    Loại phần tử < min_sim (và <= 0).
+
+    Trả (rows, cols, vals) dạng COO, rows là chỉ số hàng trong block.
+    """
+    b, n = S.shape
+    if top_m is not None and 0 < top_m < n:
+        cols = np.argpartition(-S, top_m - 1, axis=1)[:, :top_m]
+        vals = np.take_along_axis(S, cols, axis=1)
+    else:
+        cols = np.broadcast_to(np.arange(n), (b, n))
+        vals = S
+
+    keep = (vals > 0.0) & (vals >= min_sim)
+    rows = np.broadcast_to(np.arange(b)[:, None], cols.shape)[keep]
+    return rows, cols[keep], vals[keep].astype(np.float32, copy=False)
+
+
+def _similarity_rows(
+    X: sparse.csr_matrix,
+    row_ids: np.ndarray,
+    top_m: Optional[int],
+    min_sim: float,
+    block_rows: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Tính các hàng row_ids của ma trận X @ X.T theo từng block (block_rows hàng / lần),
+    mỗi block chỉ giữ top-M / hàng -> RAM đỉnh ~ block_rows x N float32.
+    """
+    all_rows, all_cols, all_vals = [], [], []
+    block_rows = max(1, int(block_rows))
+    XT = X.T.tocsc()
+    for start in range(0, row_ids.size, block_rows):
+        ids = row_ids[start:start + block_rows]
+        S = np.asarray((X[ids] @ XT).todense(), dtype=np.float32)  # (b x N)
+        # self-similarity của từng hàng nằm ở cột ids[r]
+        S[np.arange(ids.size), ids] = 0.0
+        r, c, v = _topm_block(S, top_m, min_sim)
+        all_rows.append(ids[r])
+        all_cols.append(c)
+        all_vals.append(v)
+    if not all_rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+    return np.concatenate(all_rows), np.concatenate(all_cols), np.concatenate(all_vals)
+
+
+def build_course_similarity_matrix(
+    top_m: Optional[int] = COURSE_SIM_TOP_M,
+    min_sim: float = COURSE_SIM_MIN_SIM,
+    block_rows: int = COURSE_SIM_BLOCK_ROWS,
+) -> sparse.csr_matrix:
     """
     Xây dựng ma trận course-course similarity (N x N) từ ma trận TF-IDF.
     Mỗi phần tử [i, j] là cosine similarity giữa course i và course j.
-    
+
+    - top_m: chỉ giữ M láng giềng tốt nhất mỗi hàng (None/0 -> giữ đủ N, như cũ)
+    - min_sim: ngưỡng similarity tối thiểu được lưu
+    - block_rows: số hàng tính mỗi lần -> giới hạn RAM đỉnh, không dựng X @ X.T đầy đủ
+
+    Lưu ý: khi prune top-M, ma trận không còn đối xứng (j thuộc top-M của i
+    không kéo theo i thuộc top-M của j).
+
     Returns:
-        Ma trận sparse CSR (N x N) với giá trị cosine similarity.
+        Ma trận sparse CSR (N x N) float32 với giá trị cosine similarity.
     """
     _, X, _ = load_tfidf()
-    if X.shape[0] == 0:
+    n = X.shape[0]
+    if n == 0:
         return sparse.csr_matrix((0, 0))
-    
+
     # Vì X đã L2-normalized, cosine similarity = X @ X.T
-    sim_matrix = X @ X.T
-    
-    # Đặt diagonal = 0 (không so sánh course với chính nó)
-    sim_matrix.setdiag(0)
-    
-    return sim_matrix.tocsr()
+    rows, cols, vals = _similarity_rows(
+        X.tocsr(), np.arange(n), top_m or None, float(min_sim), block_rows
+    )
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(n, n), dtype=np.float32)
 
 
 def save_course_similarity_matrix(sim_matrix: sparse.csr_matrix) -> None:
     """
-    Lưu ma trận course-course similarity vào file.
+    Lưu ma trận course-course similarity vào file (chưa publish generation, người gọi publish).
+
+    Xoá delta cũ trước rồi mới đổi ma trận gốc (file tạm + os.replace): reader không bao giờ
+    thấy npz ghi dở, hay ma trận mới đi với các hàng delta cũ đè lên.
     """
     os.makedirs(ARTIFACT_DIR, exist_ok=True)
-    sparse.save_npz(COURSE_SIM_MATRIX_PATH, sim_matrix)
+    remove_row_delta(COURSE_SIM_MATRIX_PATH)
+    save_npz_atomic(COURSE_SIM_MATRIX_PATH, sim_matrix)
 
 
-def load_course_similarity_matrix() -> Optional[sparse.csr_matrix]:
+def remove_course_similarity_matrix() -> None:
     """
-    Load ma trận course-course similarity từ file.
-    Trả về None nếu file không tồn tại.
+    Xoá ma trận course-course similarity (kèm delta); reader chấm điểm trực tiếp trên X.
+    """
+    remove_row_delta(COURSE_SIM_MATRIX_PATH)
+    if os.path.exists(COURSE_SIM_MATRIX_PATH):
+        os.remove(COURSE_SIM_MATRIX_PATH)
+
+
+def compact_course_similarity_delta() -> bool:
+    """
+    Gộp delta segment vào course_similarity_matrix.npz (gọi theo lịch hoặc khi delta lớn).
     """
+    if not os.path.exists(COURSE_SIM_MATRIX_PATH):
+        return False
+    return compact_row_delta(COURSE_SIM_MATRIX_PATH)
+
+
+def _load_course_similarity_matrix_from_disk() -> Optional[sparse.csr_matrix]:
     if not os.path.exists(COURSE_SIM_MATRIX_PATH):
         return None
     try:
-        return sparse.load_npz(COURSE_SIM_MATRIX_PATH)
+        return load_npz_with_delta(COURSE_SIM_MATRIX_PATH)
     except Exception:
         return None
 
 
+def load_course_similarity_matrix() -> Optional[sparse.csr_matrix]:
+    """
+    Load ma trận course-course similarity (giữ trong registry theo generation "cb").
+    Trả về None nếu file không tồn tại.
+    """
+    return get_artifact("cb", "course_sim", _load_course_similarity_matrix_from_disk, ARTIFACT_DIR)
+
+
 def build_and_save_course_similarity_matrix() -> Dict[str, int]:
     """
     Xây dựng và lưu ma trận course-course similarity.
@@ -74,54 +176,140 @@ def build_and_save_course_similarity_matrix() -> Dict[str, int]:
     """
     sim_matrix = build_course_similarity_matrix()
     save_course_similarity_matrix(sim_matrix)
+    ann_stats = build_and_save_course_ann_index()
+    publish_generation("cb", ARTIFACT_DIR)
     return {
         "n_courses": sim_matrix.shape[0],
         "nnz": sim_matrix.nnz,
-        "density": sim_matrix.nnz / (sim_matrix.shape[0] ** 2) if sim_matrix.shape[0] > 0 else 0
+        "density": sim_matrix.nnz / (sim_matrix.shape[0] ** 2) if sim_matrix.shape[0] > 0 else 0,
+        "top_m": COURSE_SIM_TOP_M,
+        "min_sim": COURSE_SIM_MIN_SIM,
+        "ann": ann_stats,
     }
 
 
-def update_course_similarity_for_single(course_id: int) -> None:
+# Vector course dùng để chấm điểm: embedding E nếu engine dense, ngược lại TF-IDF X
+def _course_vectors(X: sparse.spmatrix):
+    emb = dense_course_embedding(X)
+    return X if emb is None else emb[0]
+
+
+def _ann_enabled(n_courses: int) -> bool:
+    return bool(COURSE_ANN_ENABLED) and n_courses >= COURSE_ANN_MIN_COURSES
+
+
+def build_and_save_course_ann_index() -> Optional[Dict]:
+    """
+    Train lại ANN index (IVF) trên vector course hiện tại; catalog nhỏ hơn
+    COURSE_ANN_MIN_COURSES (hoặc ANN tắt) -> xoá index cũ, dùng quét chính xác.
+    Chưa publish generation (người gọi publish).
+    """
+    _, X, _ = load_tfidf()
+    if not _ann_enabled(X.shape[0]):
+        remove_course_ann_index()
+        return None
+    return build_course_ann_index(_course_vectors(X))
+
+
+def update_course_ann_for_courses(course_ids: Iterable[int]) -> None:
+    """
+    Thêm / gán lại các khóa học vào ANN index (gọi sau khi X / embedding đã có hàng mới),
+    1 lần ghi assign. Chưa có index hoặc index không khớp mà catalog đủ lớn -> train lại.
+    """
+    _, X, row_map = load_tfidf(fresh=True)
+    rows = np.array(sorted({row_map[c] for c in course_ids if c in row_map}), dtype=np.int64)
+    if rows.size == 0 or not _ann_enabled(X.shape[0]):
+        return
+    V = _course_vectors(X)
+    if not insert_course_ann_rows(rows, V[rows]):
+        build_course_ann_index(V)
+    publish_generation("cb", ARTIFACT_DIR)
+
+def update_course_ann_for_single(course_id: int) -> None:
+    update_course_ann_for_courses([course_id])
+
+
+# ANN index khớp với V (cùng số hàng / số chiều), ngược lại None -> quét chính xác
+def _course_ann_index(V) -> Optional[CourseIVFIndex]:
+    if not _ann_enabled(V.shape[0]):
+        return None
+    index = load_course_ann_index()
+    if index is None or not index.matches(V):
+        return None
+    return index
+
+
+def update_course_similarity_for_courses(
+    course_ids: Iterable[int],
+    top_m: Optional[int] = COURSE_SIM_TOP_M,
+    min_sim: float = COURSE_SIM_MIN_SIM,
+    block_rows: int = COURSE_SIM_BLOCK_ROWS,
+) -> None:
     """
-    Cập nhật ma trận similarity khi thêm/sửa 1 khóa học.
+    Cập nhật ma trận similarity khi thêm/sửa 1 hoặc nhiều khóa học (1 lần ghi delta).
     - Load ma trận hiện tại
-    - Tính similarity của course mới với tất cả courses
-    - Cập nhật hàng và cột tương ứng trong ma trận
+    - Tính similarity của các course thay đổi với tất cả courses
+    - Tính lại hàng của các course đó và các hàng bị ảnh hưởng, giữ bất biến top-M / min_sim:
+        + hàng đang chứa 1 trong các course (giá trị cũ có thể rơi khỏi top-M)
+        + hàng mà similarity mới với 1 trong các course đủ để lọt vào top-M
+    - Chỉ ghi các hàng bị ảnh hưởng vào delta segment -> chi phí O(nnz các hàng đó),
+      không chuyển LIL / ghi lại toàn bộ ma trận
     """
-    _, X, row_map = load_tfidf()
-    if course_id not in row_map:
+    _, X, row_map = load_tfidf(fresh=True)
+    changed = np.array(sorted({row_map[c] for c in course_ids if c in row_map}), dtype=np.int64)
+    if changed.size == 0:
         return
     
-    row_idx = row_map[course_id]
+    n = X.shape[0]
     
     # Load ma trận similarity hiện tại
     sim_matrix = load_course_similarity_matrix()
     
-    # Nếu chưa có ma trận hoặc kích thước không khớp -> rebuild toàn bộ
-    if sim_matrix is None or sim_matrix.shape[0] != X.shape[0]:
+    # Nếu chưa có ma trận hoặc số hàng lệch nhiều hơn số course vừa đổi -> rebuild toàn bộ
+    if sim_matrix is None or not (0 <= n - sim_matrix.shape[0] <= changed.size):
         build_and_save_course_similarity_matrix()
         return
+    if sim_matrix.shape[0] < n:
+        # course mới ở cuối: mở rộng shape (thêm hàng/cột rỗng), không copy dữ liệu
+        indptr = np.append(sim_matrix.indptr, np.full(n - sim_matrix.shape[0], sim_matrix.indptr[-1]))
+        sim_matrix = sparse.csr_matrix(
+            (sim_matrix.data, sim_matrix.indices, indptr), shape=(n, n)
+        )
     
-    # Tính similarity của course này với tất cả courses
-    v = X.getrow(row_idx)
-    new_sims = v @ X.T  # (1 x N)
-    new_sims = new_sims.tocsr()
-    
-    # Đặt similarity với chính nó = 0
-    new_sims[0, row_idx] = 0
-    
-    # Cập nhật hàng và cột trong ma trận
-    sim_matrix_lil = sim_matrix.tolil()
-    
-    # Cập nhật hàng row_idx
-    sim_matrix_lil[row_idx, :] = new_sims
-    
-    # Cập nhật cột row_idx (ma trận đối xứng)
-    sim_matrix_lil[:, row_idx] = new_sims.T
-    
-    # Chuyển về CSR và lưu
-    sim_matrix = sim_matrix_lil.tocsr()
-    save_course_similarity_matrix(sim_matrix)
+    X = X.tocsr()
+    top_m = top_m or None
+
+    # Similarity của các course thay đổi với tất cả courses (đối xứng: cột = hàng) -> (N × b)
+    cols = np.asarray((X @ X[changed].T).todense(), dtype=np.float32)
+    cols[changed, np.arange(changed.size)] = 0.0
+
+    # Hàng đang chứa 1 trong các course thay đổi
+    had = np.unique(np.searchsorted(
+        sim_matrix.indptr, np.flatnonzero(np.isin(sim_matrix.indices, changed)), side="right"
+    ) - 1)
+
+    # Hàng mà similarity mới đủ điều kiện lọt vào danh sách
+    qualifies = (cols > 0.0) & (cols >= min_sim)
+    if top_m is not None:
+        row_nnz = np.diff(sim_matrix.indptr)
+        row_min = np.full(n, np.inf, dtype=np.float32)
+        nz_rows = np.flatnonzero(row_nnz)
+        if nz_rows.size:
+            row_min[nz_rows] = np.minimum.reduceat(sim_matrix.data, sim_matrix.indptr[nz_rows])
+        qualifies &= (row_nnz < top_m)[:, None] | (cols > row_min[:, None])
+    affected = np.union1d(np.union1d(had, np.flatnonzero(qualifies.any(axis=1))), changed).astype(np.int64)
+
+    # Tính lại top-M của các hàng affected -> patch (len(affected) x N)
+    rows, cols, vals = _similarity_rows(X, affected, top_m, float(min_sim), block_rows)
+    local = np.searchsorted(affected, rows)
+    patch = sparse.csr_matrix((vals, (local, cols)), shape=(affected.size, n), dtype=np.float32)
+
+    # Ghi delta và publish
+    append_row_delta(COURSE_SIM_MATRIX_PATH, affected, patch, (n, n))
+    publish_generation("cb", ARTIFACT_DIR)
+
+def update_course_similarity_for_single(course_id: int) -> None:
+    update_course_similarity_for_courses([course_id])
 
 def _cosine_topk_from_precomputed(
     sim_matrix: sparse.csr_matrix,
@@ -145,16 +333,67 @@ def _cosine_topk_from_precomputed(
     if sim_matrix is None or row_idx >= sim_matrix.shape[0]:
         return []
     
-    # Lấy hàng similarity
-    sims = sim_matrix.getrow(row_idx).toarray().ravel()
+    # Lấy hàng similarity: chỉ các phần tử đã lưu (<= top-M), không dựng hàng dense N phần tử
+    start, end = sim_matrix.indptr[row_idx], sim_matrix.indptr[row_idx + 1]
+    cols = sim_matrix.indices[start:end]
+    sims = sim_matrix.data[start:end]
     
     # Loại các exclude_rows
+    if exclude_rows:
+        keep = ~np.isin(cols, np.fromiter(exclude_rows, dtype=np.int64))
+        cols, sims = cols[keep], sims[keep]
+    
+    # Lọc top-k
+    idx = _argpartition_topk(sims, k)
+    out: List[Tuple[int, float]] = []
+    for j in idx:
+        s = float(sims[j])
+        if s <= 0.0:
+            continue
+        out.append((int(cols[j]), s))
+    return out
+
+
+# Engine dense: (E, P) nếu CB_ENGINE = "dense" và embedding đã build khớp số hàng X,
+# ngược lại None -> chấm điểm trên TF-IDF sparse
+def dense_course_embedding(X: sparse.spmatrix) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    if CB_ENGINE != "dense":
+        return None
+    emb = load_course_embedding()
+    if emb is None or emb[0].shape[0] != X.shape[0]:
+        return None
+    return emb
+
+# Điểm cosine của các user vector U (m × D, đã L2) với mọi course -> ndarray (m × N)
+# sparse: U @ X.T; dense: normalize(U @ P) @ E.T (1 GEMM)
+def user_course_scores(
+    U: sparse.spmatrix,
+    X: sparse.spmatrix,
+    XT: Optional[sparse.spmatrix] = None,
+) -> np.ndarray:
+    emb = dense_course_embedding(X)
+    if emb is not None:
+        E, P = emb
+        return project_rows(U, P) @ E.T
+    return (U @ (X.T if XT is None else XT)).toarray()
+
+# top-k từ vector điểm sims (N,): loại row_idx và exclude_rows, bỏ điểm <= 0
+def _topk_from_sims(
+    sims: np.ndarray,
+    row_idx: int,
+    k: int,
+    exclude_rows: Optional[Iterable[int]] = None,
+) -> List[Tuple[int, float]]:
+    # loại chính nó
+    sims[row_idx] = -1.0
+
+    # loại các exclude_rows nếu có
     if exclude_rows:
         for r in exclude_rows:
             if 0 <= r < sims.size:
                 sims[r] = -1.0
-    
-    # Lọc top-k
+
+    # lọc top-k
     idx = _argpartition_topk(sims, k)
     out: List[Tuple[int, float]] = []
     for j in idx:
@@ -164,7 +403,6 @@ def _cosine_topk_from_precomputed(
         out.append((int(j), s))
     return out
 
-
 # Tính cosine similarity của một hàng (row_idx) với toàn bộ các hàng khác trong ma trận X (bao gồm cả chính nó)
 # CHÚ Ý: Hàm này giờ sử dụng ma trận đã tính trước nếu có
 def _cosine_topk_from_row(
@@ -181,38 +419,44 @@ def _cosine_topk_from_row(
 
     Return: danh sách (other_row_idx, score) cho top-k.
     
-    NOTE: Hàm này giờ ưu tiên sử dụng ma trận similarity đã tính trước.
+    Thứ tự tra cứu (dừng ở bước đầu tiên trả đủ k kết quả):
+    1. Ma trận similarity top-M đã tính trước (chỉ engine sparse): đọc 1 hàng, O(M), không quét.
+    2. ANN index (catalog lớn): chỉ chấm điểm các cluster được dò. Là đường chính của engine dense
+       (không có ma trận precomputed), còn với engine sparse chỉ là fallback khi thiếu / lệch ma trận
+       hoặc hàng bị prune top-M mà exclude làm thiếu kết quả.
+    3. Quét chính xác toàn bộ N hàng: GEMV E @ E[row_idx] (dense) hoặc v @ X.T (sparse).
     """
+    exclude_rows = list(exclude_rows) if exclude_rows else None
+    emb = dense_course_embedding(X)
+    V = X if emb is None else emb[0]
+
     # Thử load ma trận similarity đã tính trước
-    sim_matrix = load_course_similarity_matrix()
+    sim_matrix = load_course_similarity_matrix() if emb is None else None
     
     if sim_matrix is not None and sim_matrix.shape[0] == X.shape[0]:
         # Sử dụng ma trận đã tính trước (nhanh hơn)
-        return _cosine_topk_from_precomputed(sim_matrix, row_idx, k, exclude_rows)
+        out = _cosine_topk_from_precomputed(sim_matrix, row_idx, k, exclude_rows)
+        # Hàng đã bị prune top-M mà exclude làm thiếu kết quả -> tính trực tiếp
+        row_nnz = int(sim_matrix.indptr[row_idx + 1] - sim_matrix.indptr[row_idx])
+        truncated = bool(COURSE_SIM_TOP_M) and row_nnz >= COURSE_SIM_TOP_M
+        if len(out) >= int(k) or not truncated:
+            return out
+
+    # ANN (trước mọi đường quét toàn bộ): chỉ dò COURSE_ANN_NPROBE cluster gần nhất
+    index = _course_ann_index(V)
+    if index is not None:
+        out = index.search(V, V[row_idx:row_idx + 1], k, COURSE_ANN_NPROBE, [row_idx] + (exclude_rows or []))
+        if len(out) >= int(k):
+            return out
+
+    if emb is not None:
+        return _topk_from_sims(V @ V[row_idx], row_idx, k, exclude_rows)
     
     # Fallback: tính toán trực tiếp (nếu chưa có ma trận hoặc không khớp)
     v = X.getrow(row_idx)
     sims = v @ X.T                # (1 x N) sparse
     sims = np.asarray(sims.todense()).ravel()  # về ndarray 1-D
-
-    # loại chính nó
-    sims[row_idx] = -1.0
-
-    # loại các exclude_rows nếu có
-    if exclude_rows:
-        for r in exclude_rows:
-            if 0 <= r < sims.size:
-                sims[r] = -1.0
-
-    # lọc top-k
-    idx = _argpartition_topk(sims, k)
-    out: List[Tuple[int, float]] = []
-    for j in idx:
-        s = float(sims[j])
-        if s <= 0.0:
-            continue
-        out.append((int(j), s))
-    return out
+    return _topk_from_sims(sims, row_idx, k, exclude_rows)
 
 # Tìm top-k khoá học tương tự với course_id
 def top_k_similar_from_course(
@@ -237,8 +481,8 @@ def top_k_similar_from_course(
     top = _cosine_topk_from_row(X, i, k, exclude_rows=exclude_rows)
 
     # row_index -> course_id
-    inv = {v: k for k, v in row_map.items()}
-    return [(inv[j], score) for (j, score) in top if j in inv]
+    inv = load_tfidf_inv_row_map()
+    return [(int(inv[j]), score) for (j, score) in top if 0 <= j < inv.size and inv[j] >= 0]
 
 # Tính điểm content-based giữa user vector và ma trận khoá học
 def content_scores_from_user_vector(
@@ -258,14 +502,14 @@ def content_scores_from_user_vector(
     if X.shape[0] == 0:
         return {}
 
-    # cosine(u, X) = u @ X.T
-    sims = u_vec @ X.T  # (1 x N)
-    sims = np.asarray(sims.todense()).ravel()
+    # cosine(u, X) = u @ X.T (hoặc trên embedding nếu CB_ENGINE = "dense")
+    sims = user_course_scores(u_vec, X).ravel()  # (N,)
 
     if candidate_ids is None:
         # map tất cả
-        inv = {v: k for k, v in row_map.items()}
-        return {inv[j]: float(sims[j]) for j in range(X.shape[0]) if sims[j] > 0 and j in inv}
+        inv = load_tfidf_inv_row_map()
+        rows = np.flatnonzero((sims > 0) & (inv >= 0))
+        return {int(inv[j]): float(sims[j]) for j in rows}
 
     # chỉ các ứng viên
     out: Dict[int, float] = {}
@@ -1,17 +1,25 @@
 from __future__ import annotations
 import os
-from typing import List, Tuple, Dict
-from scipy import sparse
+from typing import Iterable, List, Tuple, Dict
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import normalize
-from api.services.reco_service.text.tokenizer import vn_tokenize
+from api.services.reco_service.text.token_cache import tokenize_corpus, tokenize_many
 from api.services.reco_service.text.helpers import build_document_text
-from api.services.reco_service.io.vector_store import save_artifacts, load_artifacts
+from api.services.reco_service.io.vector_store import (
+    save_artifacts, load_artifacts, load_manifest, save_course_rows, matrix_delta_rows,
+    compact_matrix
+)
+from api.services.reco_service.io.registry import get_artifact, publish_generation
+from api.services.reco_service.cb.embedding import (
+    fit_course_embedding, update_course_embedding_rows, remove_course_embedding
+)
+from api.services.reco_service.cb.ann_index import remove_course_ann_index
 from api.services.reco_service.data_access.courses import (
-    fetch_courses_with_categories, fetch_course_by_id
+    fetch_courses_with_categories, fetch_courses_by_ids
 )
 from api.services.reco_service.config import (
-    TFIDF_MIN_DF, TFIDF_MAX_FEATURES, WORD_NGRAM
+    TFIDF_MIN_DF, TFIDF_MAX_FEATURES, WORD_NGRAM, DELTA_COMPACT_RATIO, DELTA_COMPACT_MIN_ROWS, CB_ENGINE
 )
 
 # Đường dẫn artifacts
@@ -20,25 +28,21 @@ VECT_NAME = "tfidf_vectorizer.joblib"
 MATRIX_NAME = "tfidf_matrix.npz"
 MAP_NAME = "course_row_map.json"
 
-# Chuyển dữ liệu khóa học thành đoạn văn bản với token đã tiền xử lý
-def _course_to_text(row: Dict) -> str:
-    text = build_document_text(row["title"], row["description"], row["categories"])
-    tokens = vn_tokenize(text)
-    return " ".join(tokens)
-
-# Xậy dựng corpus từ toàn bộ khóa học - trả về (ids, docs)
-def _build_corpus() -> Tuple[List[int], List[str]]:
+# Xậy dựng corpus từ toàn bộ khóa học - trả về (ids, docs, stats tokenize)
+def _build_corpus() -> Tuple[List[int], List[str], Dict]:
     """
     Trả:
     - ids: [course_id, ...]
     - docs: ["token1 token2 ...", ...]
+    - stats: {"docs", "cache_hits", "tokenized"}
+
+    Chỉ course mới / đã đổi nội dung mới được tokenize lại (cache trên đĩa, song song theo process).
     """
     rows = fetch_courses_with_categories()
-    ids, docs = [], []
-    for r in rows:
-        ids.append(int(r["id"]))
-        docs.append(_course_to_text(r))
-    return ids, docs
+    ids = [int(r["id"]) for r in rows]
+    texts = [build_document_text(r["title"], r["description"], r["categories"]) for r in rows]
+    docs, stats = tokenize_corpus(texts, ARTIFACT_DIR)
+    return ids, docs, stats
 
 
 # Xậy dụng vectorizer TF-IDF (word tf-idf với ngram)
@@ -59,12 +63,13 @@ def _build_vectorizer() -> TfidfVectorizer:
 def fit_tfidf_and_save() -> Dict:
     """
     Fit TF-IDF toàn bộ course corpus:
-    - vectorizer, matrix, row_map
+    - vectorizer, matrix, row_map: ghi vào generation mới (kèm manifest.json) rồi đổi CURRENT
     - L2-normalize theo hàng
     - Xây dựng ma trận course-course similarity
+    - CB_ENGINE = "dense": fit embedding SVD (cb/embedding.py)
     """
     os.makedirs(ARTIFACT_DIR, exist_ok=True)
-    ids, docs = _build_corpus()
+    ids, docs, tok_stats = _build_corpus()
     if not ids:
         raise RuntimeError("Không có course nào để fit TF-IDF.")
 
@@ -73,59 +78,155 @@ def fit_tfidf_and_save() -> Dict:
     X = normalize(X, norm="l2", axis=1) # L2-normalize theo hàng - chuẩn hóa về độ dài 1 (để tính cosine similarity dễ dàng)
 
     row_map = {cid: i for i, cid in enumerate(ids)} # Tạo map course_id → row index trong ma trận
-    save_artifacts(ARTIFACT_DIR, vec, X, row_map, VECT_NAME, MATRIX_NAME, MAP_NAME)
+    params = {
+        "ngram_range": list(vec.ngram_range),
+        "min_df": vec.min_df,
+        "max_df": vec.max_df,
+        "max_features": vec.max_features,
+        "n_features": int(X.shape[1]),
+    }
+    # Similarity / ANN / embedding (file phẳng, theo thứ tự hàng của X cũ) bị xoá trước khi đổi CURRENT:
+    # X mới có thể cùng số hàng nhưng khác thứ tự course -> reader chấm điểm trực tiếp trên X tới khi dựng lại
+    from api.services.reco_service.cb.similarity import (
+        build_and_save_course_similarity_matrix, remove_course_similarity_matrix
+    )
+    remove_course_similarity_matrix()
+    remove_course_ann_index()
+    remove_course_embedding()
+
+    manifest = save_artifacts(
+        ARTIFACT_DIR, vec, X, row_map, VECT_NAME, MATRIX_NAME, MAP_NAME, source_rows=len(ids), params=params
+    )
+
+    # Embedding dense chỉ build khi được bật
+    embed_stats = None
+    if CB_ENGINE == "dense":
+        embed_stats = fit_course_embedding(X)
+    publish_generation("cb", ARTIFACT_DIR)
     
-    # Xây dựng và lưu ma trận course-course similarity
-    from api.services.reco_service.cb.similarity import build_and_save_course_similarity_matrix
+    # Xây dựng và lưu ma trận course-course similarity (+ ANN), publish lại khi xong
     sim_stats = build_and_save_course_similarity_matrix()
     
     return {
         "n_courses": len(ids),
         "n_features": int(X.shape[1]),
         "artifact_dir": ARTIFACT_DIR,
+        "generation": manifest["generation"],
+        "tokenize": tok_stats,
         "similarity_matrix": sim_stats,
+        "embedding": embed_stats,
     }
 
-# Transform 1 khóa học mới hoặc cập nhật khóa học (KHÔNG refit) - thêm hoặc cập nhật vào ma trận
-def transform_single_course(course_id: int) -> None:
+# Transform các khóa học mới / đã cập nhật (KHÔNG refit) - thêm hoặc cập nhật vào ma trận
+def transform_courses(course_ids: Iterable[int]) -> Dict:
     """
-    Cập nhật TF-IDF và similarity matrix cho 1 khóa học.
-    - Load các artifacts
-    - Transform khóa học mới/cập nhật
-    - Cập nhật ma trận TF-IDF
-    - Cập nhật ma trận course-course similarity
+    Cập nhật TF-IDF và similarity matrix cho 1 lô khóa học, mỗi artifact chỉ ghi 1 lần cho cả lô
+    (dùng bởi consumer của hàng đợi cập nhật cb/update_queue.py).
+    - Lấy artifacts hiện tại từ registry (không đọc lại vectorizer/matrix nếu generation không đổi)
+    - Transform các khóa học (1 query DB, tokenize theo lô)
+    - Ghi các hàng vào delta segment của ma trận TF-IDF (không ghi lại toàn bộ ma trận)
+    - Cập nhật các hàng tương ứng của embedding dense (nếu đã build)
+    - Cập nhật ma trận course-course similarity và ANN index (nếu có)
+    - Gộp delta vào ma trận gốc khi delta đủ lớn
+    Course không còn trong DB bị bỏ qua.
     """
-    # Load các artifacts
-    vec, X, row_map = load_artifacts(ARTIFACT_DIR, VECT_NAME, MATRIX_NAME, MAP_NAME)
-
-    # Lấy dữ liệu khóa học từ DB theo course_id
-    r = fetch_course_by_id(course_id)
-    if not r:
-        return
-
-    doc = _course_to_text(r)
-    v = vec.transform([doc])  # v là vector sparse 1 x D - có được bằng cách transform văn bản với matrix đã fit
-    v = normalize(v, norm="l2", axis=1)
-
-    # Cập nhật vào ma trận X và row_map
-    # Nếu course_id đã có thì cập nhật lại, nếu chưa có thì thêm mới vào cuối
-    if course_id in row_map:
-        i = row_map[course_id]
-        X_lil = X.tolil(copy=True)
-        X_lil[i, :] = v
-        X = X_lil.tocsr()
-    else:
-        X = sparse.vstack([X, v], format="csr")
-        row_map[course_id] = X.shape[0] - 1
-
-    # Lưu lại artifacts
-    save_artifacts(ARTIFACT_DIR, vec, X, row_map, VECT_NAME, MATRIX_NAME, MAP_NAME)
+    # Load các artifacts (fresh: thấy ngay thay đổi của tiến trình khác)
+    vec, X, row_map = load_tfidf(fresh=True)
+
+    # Lấy dữ liệu các khóa học từ DB (1 query)
+    rows = fetch_courses_by_ids(sorted({int(c) for c in course_ids}))
+    if not rows:
+        return {"n_courses": 0, "added": 0}
+
+    texts = [build_document_text(r["title"], r["description"], r["categories"]) for r in rows]
+    V = vec.transform(tokenize_many(texts))  # V là ma trận sparse b x D - transform văn bản với vectorizer đã fit
+    V = normalize(V, norm="l2", axis=1).tocsr()
+
+    # course_id đã có thì ghi đè hàng cũ, chưa có thì thêm mới vào cuối
+    # (row_map được dùng chung trong registry -> sửa trên bản copy)
+    new_map = dict(row_map)
+    n_rows = X.shape[0]
+    for r in rows:
+        if r["id"] not in new_map:
+            new_map[r["id"]] = n_rows
+            n_rows += 1
+    idx = np.array([new_map[r["id"]] for r in rows], dtype=np.int64)
+    added = n_rows - X.shape[0]
+
+    # delta + row_map vào generation TF-IDF mới (copy-on-write), CURRENT cũ không bị sửa
+    save_course_rows(
+        ARTIFACT_DIR, idx, V, (n_rows, X.shape[1]), new_map if added else None,
+        VECT_NAME, MATRIX_NAME, MAP_NAME,
+    )
+    # Embedding dense (nếu có): chiếu V qua ma trận SVD đã fit, ghi các hàng idx
+    update_course_embedding_rows(idx, V)
+    publish_generation("cb", ARTIFACT_DIR)  # để similarity đọc được X mới
     
     # Cập nhật ma trận course-course similarity
-    from api.services.reco_service.cb.similarity import update_course_similarity_for_single
-    update_course_similarity_for_single(course_id)
+    from api.services.reco_service.cb.similarity import (
+        update_course_similarity_for_courses, update_course_ann_for_courses, compact_course_similarity_delta
+    )
+    ids = [r["id"] for r in rows]
+    update_course_similarity_for_courses(ids)
+    update_course_ann_for_courses(ids)  # ANN index (catalog lớn): gán course vào cluster gần nhất
+
+    # Delta quá lớn -> gộp vào ma trận gốc (nội dung không đổi nên không cần publish)
+    if matrix_delta_rows(ARTIFACT_DIR, MATRIX_NAME) > _delta_limit(n_rows):
+        compact_tfidf_delta()
+        compact_course_similarity_delta()
+    return {"n_courses": len(rows), "added": added}
+
+# Transform 1 khóa học mới hoặc cập nhật khóa học (KHÔNG refit)
+def transform_single_course(course_id: int) -> None:
+    transform_courses([course_id])
+
+
+# Số hàng tối đa trong delta trước khi tự compact
+def _delta_limit(n_rows: int) -> int:
+    return max(DELTA_COMPACT_MIN_ROWS, int(DELTA_COMPACT_RATIO * n_rows))
 
+# Gộp delta của ma trận TF-IDF vào tfidf_matrix.npz (gọi theo lịch hoặc khi delta lớn)
+def compact_tfidf_delta() -> bool:
+    return compact_matrix(ARTIFACT_DIR, VECT_NAME, MATRIX_NAME, MAP_NAME)
 
-# Load TF-IDF artifacts
-def load_tfidf():
-    return load_artifacts(ARTIFACT_DIR, VECT_NAME, MATRIX_NAME, MAP_NAME)
+
+# Manifest của generation TF-IDF hiện tại (chỉ đọc manifest + stat file, không nạp artifacts).
+# checksums=True: băm lại từng file để so sha1. None nếu chưa có / thiếu / hỏng.
+def load_tfidf_manifest(checksums: bool = False):
+    return load_manifest(ARTIFACT_DIR, checksums=checksums)
+
+# Nạp bundle TF-IDF từ đĩa: (vectorizer, X, row_map, inv_row_map)
+# inv_row_map[row_idx] = course_id (-1 nếu hàng không có course)
+def _load_tfidf_bundle():
+    vec, X, row_map = load_artifacts(ARTIFACT_DIR, VECT_NAME, MATRIX_NAME, MAP_NAME)
+    inv = np.full(X.shape[0], -1, dtype=np.int64)
+    for cid, r in row_map.items():
+        if 0 <= r < inv.size:
+            inv[r] = cid
+    return vec, X, row_map, inv
+
+# Load TF-IDF artifacts (giữ trong registry theo generation "cb", không đọc đĩa mỗi lần gọi)
+# CHÚ Ý: các object trả về được dùng chung giữa các request -> không sửa in-place.
+def load_tfidf(fresh: bool = False):
+    vec, X, row_map, _ = get_artifact("cb", "tfidf", _load_tfidf_bundle, ARTIFACT_DIR, fresh=fresh)
+    return vec, X, row_map
+
+# Map ngược row_idx -> course_id (np.ndarray, -1 nếu trống)
+def load_tfidf_inv_row_map() -> np.ndarray:
+    return get_artifact("cb", "tfidf", _load_tfidf_bundle, ARTIFACT_DIR)[3]
+
+# Bảng tra course_id -> row_idx dạng mảng: (course_ids đã sort, rows tương ứng), dùng cho searchsorted
+def _build_row_lookup():
+    inv = load_tfidf_inv_row_map()
+    rows = np.flatnonzero(inv >= 0)
+    order = np.argsort(inv[rows], kind="stable")
+    return inv[rows][order], rows[order]
+
+# row_idx của từng course_id trong TF-IDF (vectorized), -1 nếu course chưa có trong ma trận
+def course_rows(course_ids) -> np.ndarray:
+    cids_sorted, rows = get_artifact("cb", "tfidf_row_lookup", _build_row_lookup, ARTIFACT_DIR)
+    course_ids = np.asarray(course_ids, dtype=np.int64)
+    if cids_sorted.size == 0:
+        return np.full(course_ids.shape, -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(cids_sorted, course_ids), cids_sorted.size - 1)
+    return np.where(cids_sorted[pos] == course_ids, rows[pos], -1)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from django.core.cache import cache
+from api.services.reco_service.config import (
+    CB_UPDATE_DEBOUNCE_SECONDS, CB_UPDATE_MAX_WAIT_SECONDS, CB_UPDATE_MAX_BATCH
+)
+
+"""
+Hàng đợi cập nhật TF-IDF / course similarity khi course thay đổi (thay cho việc chạy
+transform_single_course ngay trong request lưu course):
+
+- Signal (on_commit) chỉ gọi enqueue_course_update(course_id): ghi course vào tập pending trong
+  Django cache (Redis) kèm (thời điểm sửa đầu tiên, thời điểm sửa gần nhất) và hẹn
+  apply_pending_course_updates_task sau CB_UPDATE_DEBOUNCE_SECONDS -> request trả về ngay.
+- Debounce / gộp: mỗi course chỉ có 1 entry; 10 lần sửa liên tiếp = 1 lần cập nhật.
+  Course được xử lý khi đã "yên" CB_UPDATE_DEBOUNCE_SECONDS, hoặc đã chờ quá
+  CB_UPDATE_MAX_WAIT_SECONDS (bị sửa liên tục).
+- Consumer (Celery) lấy tối đa CB_UPDATE_MAX_BATCH course đã sẵn sàng và áp cả lô bằng
+  tfidf_builder.transform_courses (mỗi artifact ghi 1 lần); còn course chưa sẵn sàng -> hẹn lần sau.
+- Chỉ 1 consumer chạy tại 1 thời điểm (lock trong cache); lỗi -> trả course về pending.
+  Compact delta theo lịch (compact_course_deltas) giữ cùng lock đó -> không gộp delta trong lúc
+  consumer đang ghi thêm hàng (đọc-sửa-ghi chồng nhau làm mất hàng vừa ghi).
+"""
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "reco:cb_updates:pending"  # {course_id: (first_ts, last_ts)}
+PENDING_LOCK_KEY = "reco:cb_updates:pending:lock"
+SCHEDULED_KEY = "reco:cb_updates:scheduled"  # đã có task được hẹn
+RUNNING_KEY = "reco:cb_updates:running"  # consumer / compact đang ghi artifacts CB
+PENDING_TTL = 24 * 3600
+LOCK_TIMEOUT = 10  # giây; lock tự hết hạn nếu tiến trình giữ lock bị chết
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.02
+RUN_TIMEOUT = 30 * 60
+
+# Lock ngắn quanh thao tác đọc-sửa-ghi tập pending (cache.add = set-if-absent)
+@contextmanager
+def _pending_lock():
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(PENDING_LOCK_KEY, token, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise TimeoutError("cb update queue lock busy")
+        time.sleep(LOCK_POLL)
+    try:
+        yield
+    finally:
+        if cache.get(PENDING_LOCK_KEY) == token:
+            cache.delete(PENDING_LOCK_KEY)
+
+def _merge_pending(entries: Dict[int, Tuple[float, float]]) -> None:
+    with _pending_lock():
+        pending = cache.get(PENDING_KEY) or {}
+        for cid, (first, last) in entries.items():
+            old = pending.get(cid)
+            pending[cid] = (min(first, old[0]), max(last, old[1])) if old else (first, last)
+        cache.set(PENDING_KEY, pending, PENDING_TTL)
+
+# Lock ghi artifacts CB (delta TF-IDF / similarity) giữa consumer và compact; yield True nếu lấy được.
+# Không chờ: người gọi tự quyết định hẹn lại hay bỏ qua.
+@contextmanager
+def cb_writer_lock() -> Iterator[bool]:
+    token = uuid.uuid4().hex
+    acquired = bool(cache.add(RUNNING_KEY, token, RUN_TIMEOUT))
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(RUNNING_KEY) == token:
+            cache.delete(RUNNING_KEY)
+
+# Hẹn consumer sau `countdown` giây nếu chưa có lần hẹn nào đang chờ
+def _schedule(countdown: float) -> bool:
+    countdown = max(1, int(round(countdown)))
+    if not cache.add(SCHEDULED_KEY, 1, countdown + 60):
+        return False
+    from api.services.reco_service.tasks import apply_pending_course_updates_task
+    try:
+        apply_pending_course_updates_task.apply_async(countdown=countdown)
+    except Exception:
+        cache.delete(SCHEDULED_KEY)
+        raise
+    return True
+
+# Bỏ các course khỏi pending (vd. người gọi sẽ tự cập nhật trực tiếp)
+def _discard_pending(course_ids: Iterable[int]) -> None:
+    with _pending_lock():
+        pending = cache.get(PENDING_KEY) or {}
+        for cid in course_ids:
+            pending.pop(int(cid), None)
+        if pending:
+            cache.set(PENDING_KEY, pending, PENDING_TTL)
+        else:
+            cache.delete(PENDING_KEY)
+
+def enqueue_course_update(course_id: int) -> None:
+    """
+    Đưa 1 course vào hàng đợi cập nhật (gọi từ signal sau commit). Lỗi Redis / broker được
+    ném ra để người gọi tự xử lý (vd. cập nhật trực tiếp); khi không hẹn được consumer,
+    course được bỏ khỏi pending để không bị xử lý lại lần nữa.
+    """
+    cid = int(course_id)
+    now = time.time()
+    _merge_pending({cid: (now, now)})
+    try:
+        _schedule(CB_UPDATE_DEBOUNCE_SECONDS)
+    except Exception:
+        try:
+            _discard_pending([cid])
+        except Exception as ex:
+            logger.warning(f"cb update queue: could not discard course {cid}: {ex}")
+        raise
+
+def pending_course_updates() -> Dict[int, Tuple[float, float]]:
+    return dict(cache.get(PENDING_KEY) or {})
+
+# Course sẵn sàng xử lý tại thời điểm now
+def _is_ready(entry: Tuple[float, float], now: float, debounce: float, max_wait: float) -> bool:
+    first, last = entry
+    return now - last >= debounce or now - first >= max_wait
+
+# Số giây tới khi course sớm nhất trong pending sẵn sàng
+def _next_ready_in(pending: Dict[int, Tuple[float, float]], now: float, debounce: float, max_wait: float) -> float:
+    return min(min(debounce - (now - last), max_wait - (now - first)) for first, last in pending.values())
+
+# Lấy (và bỏ khỏi pending) tối đa max_batch course đã sẵn sàng; trả (course_ids, phần còn lại)
+def _take_ready(
+    now: float, debounce: float, max_wait: float, max_batch: int
+) -> Tuple[Dict[int, Tuple[float, float]], Dict[int, Tuple[float, float]]]:
+    with _pending_lock():
+        pending = cache.get(PENDING_KEY) or {}
+        ready = sorted(
+            (cid for cid, entry in pending.items() if _is_ready(entry, now, debounce, max_wait)),
+            key=lambda cid: pending[cid][0],  # course chờ lâu nhất trước
+        )[:max(1, int(max_batch))]
+        taken = {cid: pending.pop(cid) for cid in ready}
+        if pending:
+            cache.set(PENDING_KEY, pending, PENDING_TTL)
+        else:
+            cache.delete(PENDING_KEY)
+    return taken, pending
+
+def process_pending_course_updates(
+    debounce: float = CB_UPDATE_DEBOUNCE_SECONDS,
+    max_wait: float = CB_UPDATE_MAX_WAIT_SECONDS,
+    max_batch: int = CB_UPDATE_MAX_BATCH,
+) -> Dict:
+    """
+    Consumer: áp 1 lô course đã sẵn sàng vào TF-IDF / similarity, huỷ cache similar của chúng,
+    rồi hẹn lần chạy tiếp nếu pending còn course.
+    """
+    from api.services.reco_service.cb.tfidf_builder import transform_courses
+    from api.services.reco_service.io.cache import invalidate_similar
+
+    cache.delete(SCHEDULED_KEY)  # từ đây enqueue mới sẽ hẹn lần chạy khác
+    stats: Optional[Dict] = None
+    with cb_writer_lock() as acquired:
+        if not acquired:
+            # consumer khác / compact đang ghi artifacts -> thử lại sau
+            _schedule(debounce)
+            return {"status": "busy"}
+
+        now = time.time()
+        taken, rest = _take_ready(now, debounce, max_wait, max_batch)
+        if taken:
+            try:
+                stats = transform_courses(list(taken.keys()))
+            except Exception:
+                _merge_pending(taken)  # trả lại pending và hẹn chạy lại
+                _schedule(debounce)
+                raise
+            for cid in taken:
+                invalidate_similar(cid)
+            logger.info(f"TF-IDF updated for {len(taken)} course(s): {sorted(taken)}")
+
+    if rest:
+        _schedule(_next_ready_in(rest, time.time(), debounce, max_wait))
+    return {"status": "ok", "processed": len(taken), "pending": len(rest), "transform": stats}
+
+# Gộp delta TF-IDF / course similarity vào ma trận gốc (compact_cb_deltas_task, theo lịch).
+# Consumer đang chạy -> bỏ qua lần này (consumer tự compact khi delta vượt ngưỡng).
+def compact_course_deltas() -> Dict:
+    from api.services.reco_service.cb.tfidf_builder import compact_tfidf_delta
+    from api.services.reco_service.cb.similarity import compact_course_similarity_delta
+
+    with cb_writer_lock() as acquired:
+        if not acquired:
+            return {"status": "busy"}
+        return {
+            "status": "ok",
+            "tfidf": compact_tfidf_delta(),
+            "course_similarity": compact_course_similarity_delta(),
+        }
+
+# Áp ngay (không qua hàng đợi) - dùng khi Redis / broker không khả dụng hoặc trong script
+def apply_course_updates_now(course_ids: Iterable[int]) -> Dict:
+    from api.services.reco_service.cb.tfidf_builder import transform_courses
+    from api.services.reco_service.io.cache import invalidate_similar
+
+    ids: List[int] = sorted({int(c) for c in course_ids})
+    stats = transform_courses(ids)
+    for cid in ids:
+        invalidate_similar(cid)
+    return stats
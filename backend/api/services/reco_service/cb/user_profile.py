@@ -1,47 +1,67 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Sequence
+import numpy as np
 from scipy import sparse
 from sklearn.preprocessing import normalize
-from api.services.reco_service.data_access.interactions import fetch_user_events
-from api.services.reco_service.cb.tfidf_builder import load_tfidf
-from api.services.reco_service.cf.weighting import event_weight
-from api.services.reco_service.config import WEIGHT_ENROLL, WEIGHT_FAVORITE, TAU_DAYS
+from api.services.reco_service.data_access.interactions import fetch_events_for_users
+from api.services.reco_service.cb.tfidf_builder import load_tfidf, course_rows
+from api.services.reco_service.cf.weighting import event_weights
+from api.services.reco_service.config import WEIGHT_ENROLL, WEIGHT_FAVORITE, TAU_DAYS, CB_PROFILE_MAX_EVENTS
 
 # Xây dựng vector người dùng từ các sự kiện tương tác
-# Trả về dạng csr_matrix (1 × d) đã L2-normalize
+# profile = normalize(w @ X): w (1 × N) là trọng số event theo hàng TF-IDF -> 1 phép nhân sparse
+# Trả về dạng csr_matrix (1 × d) đã L2-normalize, None nếu user chưa có sự kiện hợp lệ
 def build_user_vector(user_id: str,
-                      max_events: int = 50,
+                      max_events: int = CB_PROFILE_MAX_EVENTS,
                       w_enroll: float = WEIGHT_ENROLL,
                       w_favorite: float = WEIGHT_FAVORITE,
                       tau_days: int = TAU_DAYS):
-    
-    vec, X, row_map = load_tfidf()
-    events = fetch_user_events(user_id, limit=max_events) # Lấy các sự kiện mới nhất
-
-    if not events or X.shape[0] == 0:
+    P = build_user_matrix([user_id], max_events=max_events,
+                          w_enroll=w_enroll, w_favorite=w_favorite, tau_days=tau_days)
+    if P.shape[0] == 0 or P.nnz == 0:
         return None
+    return P
 
-    acc: Optional[sparse.csr_matrix] = None
-    for ev in events:
-        cid = ev.get("course_id")
-        if cid not in row_map:
-            continue
-
-        # tính trọng số event
-        w = event_weight(ev.get("type", ""), ev.get("days_ago", 0.0),
-                         w_enroll=w_enroll, w_favorite=w_favorite, tau_days=tau_days)
-        
-        if w <= 0.0:
-            continue
-
-        # lấy hàng TF-IDF của course này và nhân trọng số vừa tính được
-        row_idx = row_map[cid]
-        v = X.getrow(row_idx).multiply(w)  # 1 x D
-
-        acc = v if acc is None else (acc + v) # cộng dồn các vector
+# Ma trận trọng số W (n_users × N course) từ mảng sự kiện: W[u, row(course)] = Σ trọng số event
+# (event trùng course được cộng dồn; course chưa có trong TF-IDF / trọng số <= 0 bị bỏ)
+def event_weight_matrix(n_users: int,
+                        user_pos: np.ndarray,
+                        course_ids: np.ndarray,
+                        codes: np.ndarray,
+                        days_ago: np.ndarray,
+                        n_rows: int,
+                        w_enroll: float = WEIGHT_ENROLL,
+                        w_favorite: float = WEIGHT_FAVORITE,
+                        tau_days: int = TAU_DAYS) -> sparse.csr_matrix:
+    w = event_weights(codes, days_ago, w_enroll=w_enroll, w_favorite=w_favorite, tau_days=tau_days)
+    rows = course_rows(course_ids)
+    keep = (rows >= 0) & (w > 0.0)
+    return sparse.csr_matrix(
+        (w[keep], (np.asarray(user_pos)[keep], rows[keep])), shape=(n_users, n_rows)
+    )
 
-    if acc is None or acc.nnz == 0:
-        return None
+# Profile của nhiều user từ mảng sự kiện (xem fetch_events_for_users): P = normalize(W @ X)
+# 1 phép nhân sparse cho cả lô, trả CSR (n_users × d) đã L2-normalize (hàng rỗng = user không có profile)
+def user_profiles_from_events(n_users: int,
+                              user_pos: np.ndarray,
+                              course_ids: np.ndarray,
+                              codes: np.ndarray,
+                              days_ago: np.ndarray,
+                              w_enroll: float = WEIGHT_ENROLL,
+                              w_favorite: float = WEIGHT_FAVORITE,
+                              tau_days: int = TAU_DAYS) -> sparse.csr_matrix:
+    vec, X, row_map = load_tfidf()
+    W = event_weight_matrix(n_users, user_pos, course_ids, codes, days_ago, X.shape[0],
+                            w_enroll=w_enroll, w_favorite=w_favorite, tau_days=tau_days)
+    return normalize((W @ X).tocsr(), norm="l2", axis=1)
 
-    acc = normalize(acc, norm="l2", axis=1) # L2-normalize
-    return acc
+# Profile của nhiều user (U × d): 1 query sự kiện (max_events mới nhất mỗi user) + 1 phép nhân sparse
+def build_user_matrix(user_ids: Sequence[str],
+                      max_events: int = CB_PROFILE_MAX_EVENTS,
+                      w_enroll: float = WEIGHT_ENROLL,
+                      w_favorite: float = WEIGHT_FAVORITE,
+                      tau_days: int = TAU_DAYS) -> sparse.csr_matrix:
+    user_ids = list(user_ids)
+    user_pos, course_ids, codes, days_ago = fetch_events_for_users(user_ids, limit=max_events)
+    return user_profiles_from_events(len(user_ids), user_pos, course_ids, codes, days_ago,
+                                     w_enroll=w_enroll, w_favorite=w_favorite, tau_days=tau_days)
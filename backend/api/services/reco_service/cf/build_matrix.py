@@ -1,66 +1,80 @@
 from __future__ import annotations
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 from datetime import datetime, timezone
+import numpy as np
 from scipy import sparse
-from api.services.reco_service.data_access.interactions import fetch_all_interactions
-from api.services.reco_service.cf.weighting import event_weight
+from api.services.reco_service.data_access.interactions import fetch_interaction_arrays
+from api.services.reco_service.cf.weighting import event_weights
 
 """
 Xây ma trận R (user × item) dạng sparse (CSR) từ Enrollments + Favorites:
-- Lấy events từ data_access.interactions (timestamp included)
-- Quy đổi thành trọng số implicit + time-decay
+- Lấy events từ data_access.interactions dưới dạng mảng numpy (1 query, đọc theo chunk)
+- Quy đổi thành trọng số implicit + time-decay (vectorized)
 - Trả:
     R (csr_matrix), user_index (user_id -> row), item_index (course_id -> col)
+- extend_user_item_matrix: cộng thêm sự kiện mới vào R đã có (cập nhật CF incremental);
+  user / course mới được thêm vào cuối index (không giữ thứ tự id đã sort).
 """
 
-# Tính số ngày đã qua từ timestamp ts đến 'bây giờ' (UTC).
-def _days_ago(ts: datetime) -> float:
-    if ts is None:
-        return 0.0
-    if ts.tzinfo is None:
-        ts = ts.replace(tzinfo=timezone.utc)
-    now = datetime.now(timezone.utc)
-    return max(0.0, (now - ts).total_seconds() / 86400.0)
-
 # Xây ma trận user-item R (CSR) từ events.
 # Các cột là course_id (int) và các hàng là user_id (str).
 def build_user_item_matrix() -> Tuple[sparse.csr_matrix, Dict[str, int], Dict[int, int]]:
-    events = fetch_all_interactions()  # [(student_id, course_id, type, timestamp), ...]
-    if not events:
+    student_ids, course_ids, ev_codes, ts = fetch_interaction_arrays()
+    if student_ids.size == 0:
         return sparse.csr_matrix((0, 0)), {}, {}
 
-    user_index: Dict[str, int] = {}
-    item_index: Dict[int, int] = {}
-
-    rows, cols, data = [], [], []
-
-    # Có thể dùng dict tạm để cộng dồn (u,i) -> weight
-    # Cộng dồn vì có thể user có thể vừa enroll vừa favorite 1 course.
-    accum: Dict[Tuple[int, int], float] = {}
+    # map id -> index (theo thứ tự id đã sort)
+    uids, rows = np.unique(student_ids.astype(str), return_inverse=True)
+    cids, cols = np.unique(course_ids, return_inverse=True)
+    user_index: Dict[str, int] = {uid: idx for idx, uid in enumerate(uids.tolist())}
+    item_index: Dict[int, int] = {int(cid): idx for idx, cid in enumerate(cids.tolist())}
 
-    for (user_id, course_id, ev_type, ts) in events:
-        # map id -> index
-        u = user_index.setdefault(user_id, len(user_index))
-        i = item_index.setdefault(course_id, len(item_index))
+    now = datetime.now(timezone.utc).timestamp()
+    weights = event_weights(ev_codes, (now - ts) / 86400.0)
+    keep = weights > 0
 
-        w = event_weight(ev_type, _days_ago(ts))
-        if w <= 0:
-            continue
+    # COO -> CSR tự cộng dồn (u,i) trùng (user có thể vừa enroll vừa favorite 1 course)
+    R = sparse.coo_matrix(
+        (weights[keep], (rows[keep], cols[keep])), shape=(len(user_index), len(item_index))
+    ).tocsr()
+    R.sum_duplicates()
+    return R, user_index, item_index
 
-        key = (u, i)
-        accum[key] = accum.get(key, 0.0) + w # cộng dồn trọng số nếu đã có, nếu chưa có thì khởi tạo
+# Cộng các sự kiện mới (mảng như fetch_interaction_arrays) vào R hiện có.
+# Trọng số tính theo thời điểm hiện tại; các phần tử cũ của R giữ nguyên time-decay lúc build.
+# Trả (R mới, user_index, item_index, hàng user có thay đổi, cột course có thay đổi).
+def extend_user_item_matrix(
+    R: sparse.csr_matrix,
+    user_index: Dict[str, int],
+    item_index: Dict[int, int],
+    student_ids: np.ndarray,
+    course_ids: np.ndarray,
+    ev_codes: np.ndarray,
+    ts: np.ndarray,
+    now: Optional[float] = None,
+) -> Tuple[sparse.csr_matrix, Dict[str, int], Dict[int, int], np.ndarray, np.ndarray]:
+    now = datetime.now(timezone.utc).timestamp() if now is None else float(now)
+    weights = event_weights(ev_codes, (now - ts) / 86400.0)
+    keep = weights > 0
+    sids = student_ids[keep].astype(str)
+    cids = np.asarray(course_ids)[keep]
 
-    if not accum:
-        # không có tương tác > 0
-        return sparse.csr_matrix((len(user_index), len(item_index))), user_index, item_index
+    user_index = dict(user_index)
+    item_index = dict(item_index)
+    for uid in np.unique(sids).tolist():
+        user_index.setdefault(uid, len(user_index))
+    for cid in np.unique(cids).tolist():
+        item_index.setdefault(int(cid), len(item_index))
+    rows = np.fromiter((user_index[u] for u in sids.tolist()), dtype=np.int64, count=sids.size)
+    cols = np.fromiter((item_index[int(c)] for c in cids.tolist()), dtype=np.int64, count=cids.size)
 
-    # đổ về 3 list để tạo CSR
-    for (u, i), w in accum.items():
-        rows.append(u)
-        cols.append(i)
-        data.append(w)
+    # mở rộng R: hàng mới rỗng (indptr lặp lại phần tử cuối), cột mới chỉ cần tăng shape
+    R = R.tocsr()
+    shape = (len(user_index), len(item_index))
+    indptr = np.concatenate([R.indptr, np.full(shape[0] - R.shape[0], R.indptr[-1], dtype=R.indptr.dtype)])
+    R = sparse.csr_matrix((R.data, R.indices, indptr), shape=shape)
 
-    n_users = len(user_index)
-    n_items = len(item_index)
-    R = sparse.csr_matrix((data, (rows, cols)), shape=(n_users, n_items))
-    return R, user_index, item_index
+    D = sparse.coo_matrix((weights[keep], (rows, cols)), shape=shape).tocsr()
+    R = (R + D).tocsr()
+    R.sum_duplicates()
+    return R, user_index, item_index, np.unique(rows), np.unique(cols)
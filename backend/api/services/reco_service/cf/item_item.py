@@ -0,0 +1,210 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+from datetime import datetime
+import numpy as np
+from scipy import sparse
+from api.services.reco_service.cf.build_matrix import build_user_item_matrix
+from api.services.reco_service.cf.weighting import apply_bm25, event_weights
+from api.services.reco_service.cf.streaming import topk_neighbor_csr_from_R
+from api.services.reco_service.cf.scoring import get_user_item_matrix
+from api.services.reco_service.data_access.interactions import fetch_events_for_users
+from api.services.reco_service.data_access.courses import visible_content_ids
+from api.services.reco_service.io.cf_store import ItemItemMatrix, save_item_item_matrix, load_item_item_store
+from api.services.reco_service.io.registry import get_artifact, publish_generation
+from api.services.reco_service.config import (
+    CF_STREAM_BLOCK_USERS,
+    CF_STREAM_N_JOBS,
+    CF_USE_BM25,
+    CF_BM25_K1,
+    CF_BM25_B,
+    CF_BM25_ITEM_IDF,
+    CF_ITEM_TOP_M,
+    CF_ITEM_MIN_SIM,
+    CF_ITEM_SHRINK_BETA,
+    CF_ITEM_TOP_N,
+)
+
+"""
+Item-item CF (course × course), dùng cho ứng viên Home khi CF_ENGINE = "item":
+- Build: S = cosine giữa các cột của R (R sau BM25, như user-user), shrinkage theo số user chung
+  c / (c + beta), bỏ đường chéo, giữ top-M mỗi course. Chính là top-K neighbors trên R.T nên
+  dùng lại kernel streaming (cf/streaming.py). RAM ~ I × M, không phụ thuộc số user.
+- Hàng / cột của S theo course_id đã sort (cf_item_item_ids.npy), độc lập với cột của R
+  (R có thể được cập nhật incremental, thêm course vào cuối).
+- Online: w = trọng số của user (hàng R + sự kiện mới hơn built_at từ DB, như fresh_user_item_weights),
+  score = (w @ S) / sum(w) (trung bình có trọng số của similarity, trong [0, 1]),
+  bỏ course đã tương tác / đang ẩn, lấy top-N. 1 phép nhân trên ma trận I × I nhỏ,
+  không tra neighbors và hàng R của user khác.
+
+Public:
+- build_item_item_matrix(R, ...) -> (S, I × I)
+- rebuild_item_item_matrix(artifact_dir=..., R=None, item_ids=None, ...) -> stats
+- get_item_item_matrix(artifact_dir) -> ItemItemMatrix | None (registry "cf")
+- user_weight_rows(IM, user_ids) -> CSR (n × I) trọng số user trên trục S
+- item_item_topn(IM, W, top_n, allowed) -> (rows, pos, scores)
+- item_item_candidates(user_id, top_n=CF_ITEM_TOP_N) -> {course_id: score}
+"""
+
+# S (I × I) float32 từ R (U × I): top-M course giống nhất mỗi course
+def build_item_item_matrix(
+    R: sparse.csr_matrix,
+    *,
+    top_m: int = CF_ITEM_TOP_M,
+    min_sim: float = CF_ITEM_MIN_SIM,
+    shrink_beta: Optional[float] = CF_ITEM_SHRINK_BETA,
+    block_size: int = CF_STREAM_BLOCK_USERS,
+    n_jobs: int = CF_STREAM_N_JOBS,
+) -> sparse.csr_matrix:
+    return topk_neighbor_csr_from_R(
+        R.T.tocsr(),
+        k=top_m,
+        min_sim=min_sim,
+        shrink_beta=shrink_beta,
+        block_size=block_size,
+        n_jobs=n_jobs,
+    )
+
+# Build S và lưu về artifact_dir. R / item_ids (course_id theo cột) truyền vào để dùng lại R vừa build
+# (vd. R đã lưu của user-user CF); None -> build_user_item_matrix() từ DB.
+def rebuild_item_item_matrix(
+    *,
+    artifact_dir: str = "api/var/reco",
+    R: Optional[sparse.csr_matrix] = None,
+    item_ids: Optional[np.ndarray] = None,
+    use_bm25: bool = CF_USE_BM25,
+    bm25_k1: float = CF_BM25_K1,
+    bm25_b: float = CF_BM25_B,
+    bm25_item_idf: bool = CF_BM25_ITEM_IDF,
+    top_m: int = CF_ITEM_TOP_M,
+    min_sim: float = CF_ITEM_MIN_SIM,
+    shrink_beta: Optional[float] = CF_ITEM_SHRINK_BETA,
+    publish: bool = True,
+) -> Dict:
+    if R is None:
+        R, _user_index, item_index = build_user_item_matrix()
+        item_ids = np.full(R.shape[1], -1, dtype=np.int64)
+        for cid, col in item_index.items():
+            item_ids[col] = cid
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    n_users, n_items = R.shape
+
+    if use_bm25 and n_users > 0 and n_items > 0:
+        R = apply_bm25(R, k1=bm25_k1, b=bm25_b, item_idf=bm25_item_idf)
+    S = build_item_item_matrix(R, top_m=top_m, min_sim=min_sim, shrink_beta=shrink_beta)
+
+    # hàng / cột theo course_id tăng dần
+    order = np.argsort(item_ids, kind="stable")
+    S = S[order][:, order].tocsr()
+    save_item_item_matrix(artifact_dir, S, item_ids=item_ids[order])
+
+    generation = publish_generation("cf", artifact_dir) if publish else None
+    return {
+        "mode": "item_item",
+        "users": n_users,
+        "items": n_items,
+        "nnz": int(S.nnz),
+        "top_m": top_m,
+        "min_sim": min_sim,
+        "shrink_beta": shrink_beta,
+        "use_bm25": use_bm25,
+        "artifact_dir": artifact_dir,
+        "generation": generation,
+        "ts": datetime.utcnow().isoformat() + "Z",
+    }
+
+# S của generation "cf" hiện tại, giữ trong registry; None nếu chưa build
+def get_item_item_matrix(artifact_dir: str = "api/var/reco") -> Optional[ItemItemMatrix]:
+    return get_artifact(
+        "cf",
+        "item_item",
+        lambda: load_item_item_store(artifact_dir),
+        artifact_dir,
+    )
+
+# Trọng số của các user trên trục S: hàng R (lúc build) + sự kiện mới hơn built_at (1 query cho cả lô).
+# Chưa có R -> đọc sự kiện từ DB (như fresh_user_item_weights). Course không có trong S bị bỏ.
+def user_weight_rows(
+    IM: ItemItemMatrix,
+    user_ids: Sequence[str],
+    artifact_dir: str = "api/var/reco",
+) -> sparse.csr_matrix:
+    user_ids = list(user_ids)
+    n = len(user_ids)
+    rows: List[np.ndarray] = []
+    cols: List[np.ndarray] = []
+    vals: List[np.ndarray] = []
+
+    M = get_user_item_matrix(artifact_dir)
+    if M is not None:
+        r_rows = np.fromiter((M.row(u) for u in user_ids), dtype=np.int64, count=n)
+        ok = np.flatnonzero(r_rows >= 0)
+        sub = M.R[r_rows[ok]].tocoo()
+        pos = IM.positions(M.item_ids)[sub.col]
+        keep = pos >= 0
+        rows.append(ok[sub.row[keep]])
+        cols.append(pos[keep])
+        vals.append(sub.data[keep].astype(np.float64))
+        user_pos, cids, codes, days_ago = fetch_events_for_users(user_ids, limit=None, since=M.built_at)
+    else:
+        user_pos, cids, codes, days_ago = fetch_events_for_users(user_ids, limit=200)
+
+    w = event_weights(codes, days_ago)
+    pos = IM.positions(cids)
+    keep = (pos >= 0) & (w > 0.0)
+    rows.append(np.asarray(user_pos, dtype=np.int64)[keep])
+    cols.append(pos[keep])
+    vals.append(w[keep])
+
+    W = sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n, len(IM))
+    )
+    W.sum_duplicates()
+    return W
+
+# Top-n course mỗi user từ W (n × I): score = (W @ S) / sum(W), bỏ course đã tương tác (W > 0)
+# và course không thuộc allowed (mask (I,), None = tất cả). Trả (hàng user, vị trí trong S, score).
+def item_item_topn(
+    IM: ItemItemMatrix,
+    W: sparse.csr_matrix,
+    top_n: int = CF_ITEM_TOP_N,
+    allowed: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n, n_items = W.shape
+    k = max(0, min(int(top_n), n_items))
+    if n == 0 or k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    scores = np.asarray((W @ IM.S).todense(), dtype=np.float64)  # (n × I)
+    denom = np.asarray(W.sum(axis=1)).ravel()
+    np.divide(scores, denom[:, None], out=scores, where=denom[:, None] > 0)
+    seen_r, seen_c = W.nonzero()
+    scores[seen_r, seen_c] = -np.inf
+    if allowed is not None:
+        scores[:, ~allowed] = -np.inf
+
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < n_items else np.tile(np.arange(k), (n, 1))
+    vals = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-vals, axis=1, kind="stable")
+    idx = np.take_along_axis(idx, order, axis=1)
+    vals = np.take_along_axis(vals, order, axis=1)
+
+    rows = np.repeat(np.arange(n), k)
+    idx, vals = idx.ravel(), vals.ravel()
+    ok = np.isfinite(vals) & (vals > 0.0)
+    return rows[ok], idx[ok], vals[ok]
+
+# Ứng viên CF item-item cho 1 user: {course_id: score} (course đang hiển thị, chưa tương tác)
+def item_item_candidates(
+    user_id: str,
+    top_n: int = CF_ITEM_TOP_N,
+    artifact_dir: str = "api/var/reco",
+) -> Dict[int, float]:
+    IM = get_item_item_matrix(artifact_dir)
+    if IM is None or len(IM) == 0:
+        return {}
+    W = user_weight_rows(IM, [user_id], artifact_dir)
+    if W.nnz == 0:
+        return {}
+    allowed = np.isin(IM.item_ids, visible_content_ids())
+    _, pos, vals = item_item_topn(IM, W, top_n, allowed)
+    return dict(zip(IM.item_ids[pos].tolist(), vals.tolist()))
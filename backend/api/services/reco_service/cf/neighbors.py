@@ -2,11 +2,17 @@ from __future__ import annotations
 from typing import Dict, List, Tuple, Optional
 import numpy as np
 from scipy import sparse
-from api.services.reco_service.cf.user_user import cosine_row_against_all
+from api.services.reco_service.cf.streaming import topk_neighbor_csr_from_R, neighbor_csr_to_dict
 from api.services.reco_service.io.cf_store import (
+    BIN_PREFIX,
+    UserNeighborStore,
     save_user_neighbors_json,
-    load_user_neighbors_json,
+    save_user_neighbors_bin,
+    save_user_neighbors_csr,
+    load_user_neighbors_store,
 )
+from api.services.reco_service.io.registry import get_artifact
+from api.services.reco_service.config import CF_STREAM_BLOCK_USERS, CF_STREAM_N_JOBS
 
 # Chọn chỉ số top‑k theo giá trị giảm dần
 def _argpartition_topk(values: np.ndarray, k: int) -> np.ndarray:
@@ -18,7 +24,7 @@ def _argpartition_topk(values: np.ndarray, k: int) -> np.ndarray:
 
 # Đảo ngược user_index {user_id(str) -> row_index(int)} thành list inv sao cho inv[row_index] = user_id (str)
 # Tiện lợi cho việc tra cứu ngược id từ index.
-def _invert_user_index(user_index: Dict[str, int]) -> List[Optional[str]]:
+def invert_user_index(user_index: Dict[str, int]) -> List[Optional[str]]:
     if not user_index:
         return []
     inv: List[Optional[str]] = [None] * (max(user_index.values()) + 1)
@@ -38,7 +44,7 @@ def topk_neighbors_from_U(
     min_sim: float = 0.0,
 ) -> Dict[str, List[Tuple[str, float]]]:
     n_users = U.shape[0]
-    inv = _invert_user_index(user_index)
+    inv = invert_user_index(user_index)
 
     out: Dict[str, List[Tuple[str, float]]] = {}
     for u in range(n_users):
@@ -69,9 +75,9 @@ def topk_neighbors_from_U(
 
 
 # ------ cách 2: streaming trực tiếp từ R ------
-# Không dựng full U. Với từng user u:
-#   sims_u = cosine_row_against_all(R, u, shrink_beta=...) -> lấy top‑K theo sims_u
-# Phù hợp khi số user lớn, muốn tiết kiệm RAM.
+# Không dựng full U. Xử lý user theo block (cf/streaming.py):
+#   S_block = X[block] @ X.T (+ shrinkage) -> top‑K vectorized cho cả block
+# Phù hợp khi số user lớn, muốn tiết kiệm RAM (RAM đỉnh giới hạn theo block).
 def topk_neighbors_from_R_streaming(
     R: sparse.csr_matrix,
     user_index: Dict[str, int],
@@ -79,53 +85,61 @@ def topk_neighbors_from_R_streaming(
     k: int = 200,
     min_sim: float = 0.0,
     shrink_beta: Optional[float] = 50.0,
+    block_size: int = CF_STREAM_BLOCK_USERS,
+    n_jobs: int = CF_STREAM_N_JOBS,
 ) -> Dict[str, List[Tuple[str, float]]]:
-    n_users = R.shape[0]
-    inv = _invert_user_index(user_index)
+    N = topk_neighbor_csr_from_R(
+        R, k=k, min_sim=min_sim, shrink_beta=shrink_beta, block_size=block_size, n_jobs=n_jobs
+    )
+    return neighbor_csr_to_dict(N, invert_user_index(user_index))
 
-    out: Dict[str, List[Tuple[str, float]]] = {}
-    for u in range(n_users):
-        sims_col = cosine_row_against_all(
-            R,
-            u_idx=u,
-            l2_on_user_rows=True,
-            shrink_beta=shrink_beta,
-        )  # (U × 1)
-        if sims_col.nnz == 0:
-            uid = inv[u] if inv and inv[u] is not None else None
-            if uid is not None:
-                out[uid] = []
-            continue
-
-        sims = sims_col.toarray().ravel()
-        idx = _argpartition_topk(sims, k)
-        uid = inv[u] if inv and inv[u] is not None else None
-        if uid is None:
-            continue
-
-        neighs: List[Tuple[str, float]] = []
-        for v in idx:
-            s = float(sims[v])
-            if s <= min_sim:
-                continue
-            vid = inv[v] if inv[v] is not None else None
-            if vid is None:
-                continue
-            neighs.append((vid, s))
-        out[uid] = neighs
-    return out
+# Lưu neighbors dạng CSR (U × U) trực tiếp vào store nhị phân (không qua dict)
+def save_neighbor_csr(
+    artifact_dir: str,
+    N: sparse.csr_matrix,
+    user_index: Dict[str, int],
+    prefix: str = BIN_PREFIX,
+) -> None:
+    save_user_neighbors_csr(artifact_dir, invert_user_index(user_index), N, prefix=prefix)
 
-# Lưu neighbors user-based.
+# Lưu neighbors user-based dạng nhị phân (memmap); write_json=True để xuất thêm bản JSON cũ.
 def save_neighbors(
     artifact_dir: str,
     neighbors: Dict[str, List[Tuple[str, float]]],
+    prefix: str = BIN_PREFIX,
+    *,
+    write_json: bool = False,
     file_name: str = "cf_user_neighbors.json",
 ) -> None:
-    save_user_neighbors_json(artifact_dir, neighbors, file_name=file_name)
+    save_user_neighbors_bin(artifact_dir, neighbors, prefix=prefix)
+    if write_json:
+        save_user_neighbors_json(artifact_dir, neighbors, file_name=file_name)
 
-# Đọc neighbors user-based.
+# Đọc toàn bộ neighbors user-based (store nhị phân hoặc JSON cũ) về dict.
 def load_neighbors(
     artifact_dir: str,
-    file_name: str = "cf_user_neighbors.json",
+    prefix: str = BIN_PREFIX,
 ) -> Dict[str, List[Tuple[str, float]]]:
-    return load_user_neighbors_json(artifact_dir, file_name=file_name)
+    store = load_user_neighbors_store(artifact_dir, prefix=prefix)
+    return store.to_dict() if store is not None else {}
+
+# Store neighbors (memmap) của generation "cf" hiện tại, giữ trong registry.
+def get_neighbor_store(artifact_dir: str = "api/var/reco") -> Optional[UserNeighborStore]:
+    return get_artifact(
+        "cf",
+        "user_neighbors",
+        lambda: load_user_neighbors_store(artifact_dir),
+        artifact_dir,
+    )
+
+# Top-k neighbors của 1 user: [(neighbor_user_id, sim), ...] theo sim giảm dần.
+# Chỉ đọc đúng đoạn của user trong memmap, không parse toàn bộ file.
+def get_user_neighbors(
+    user_id: str,
+    artifact_dir: str = "api/var/reco",
+    k: Optional[int] = None,
+) -> List[Tuple[str, float]]:
+    store = get_neighbor_store(artifact_dir)
+    if store is None:
+        return []
+    return store.neighbors(user_id, k)
@@ -0,0 +1,197 @@
+"""
+Benchmark CF:
+- test_shrinkage_performance: shrinkage user-user, vòng lặp Python cũ vs apply_shrinkage (vectorized).
+  Dữ liệu tổng hợp: mỗi user tương tác ngẫu nhiên `per_user` course trong `n_items` course.
+- test_item_item_vs_user_user: so sánh offline user-user vs item-item trên R thật (leave-one-out:
+  mỗi user đánh giá giấu 1 course) - HitRate@K, NDCG@K, coverage, thời gian build / chấm điểm.
+
+Chạy test:
+    python manage.py shell -c "from api.services.reco_service.cf.performance_test import test_shrinkage_performance; test_shrinkage_performance()"
+    python manage.py shell -c "from api.services.reco_service.cf.performance_test import test_item_item_vs_user_user; test_item_item_vs_user_user()"
+"""
+import time
+import numpy as np
+from scipy import sparse
+from api.services.reco_service.cf.user_user import (
+    compute_user_user_cosine,
+    apply_shrinkage,
+    _pairwise_common_counts,
+)
+from api.services.reco_service.cf.build_matrix import build_user_item_matrix
+from api.services.reco_service.cf.weighting import apply_bm25
+from api.services.reco_service.cf.streaming import topk_neighbor_csr_from_R
+from api.services.reco_service.cf.item_item import build_item_item_matrix, item_item_topn
+from api.services.reco_service.io.cf_store import ItemItemMatrix
+from api.services.reco_service.config import (
+    CF_USE_BM25, CF_K_NEIGHBORS, MIN_SIM_CF, CF_ITEM_TOP_M, CF_ITEM_MIN_SIM, CF_ITEM_SHRINK_BETA
+)
+
+# Cách cũ (trước khi vectorize): duyệt từng hàng U, dựng dict n_common cho mỗi hàng.
+def _apply_shrinkage_loop(U_cosine: sparse.csr_matrix, R: sparse.csr_matrix, beta: float = 50.0) -> sparse.csr_matrix:
+    Uc = U_cosine.copy().tocsr()
+    C_csr = _pairwise_common_counts(R)
+    indptr, indices, data = Uc.indptr, Uc.indices, Uc.data
+    for u in range(Uc.shape[0]):
+        start, end = indptr[u], indptr[u + 1]
+        if start == end:
+            continue
+        cols = indices[start:end]
+        sims = data[start:end]
+        c_row = C_csr.getrow(u)
+        common_map = {c_row.indices[k]: c_row.data[k] for k in range(len(c_row.indices))}
+        for k in range(len(cols)):
+            n_common = float(common_map.get(cols[k], 0.0))
+            sims[k] = 0.0 if n_common <= 0.0 else sims[k] * (n_common / (n_common + beta))
+    Uc.eliminate_zeros()
+    return Uc
+
+# Ma trận R (users × items) tổng hợp, trọng số trong (0, 1]
+def _synthetic_R(n_users: int, n_items: int, per_user: int, seed: int = 42) -> sparse.csr_matrix:
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(n_users), per_user)
+    cols = rng.integers(0, n_items, size=rows.size)
+    data = rng.uniform(0.1, 1.0, size=rows.size)
+    R = sparse.csr_matrix((data, (rows, cols)), shape=(n_users, n_items))
+    R.sum_duplicates()
+    return R
+
+def test_shrinkage_performance(
+    sizes=(10_000, 100_000, 1_000_000),
+    per_user: int = 3,
+    beta: float = 50.0,
+    max_loop_users: int = 100_000,
+):
+    """
+    - sizes: số user cần đo
+    - n_items = max(1000, n_users // 2) để U không quá dày ở quy mô lớn
+    - max_loop_users: bỏ qua cách cũ khi số user lớn hơn (quá chậm)
+    """
+    print("=" * 70)
+    print("PERFORMANCE TEST: apply_shrinkage (user-user CF)")
+    print("=" * 70)
+
+    for n_users in sizes:
+        n_items = max(1000, n_users // 2)
+        R = _synthetic_R(n_users, n_items, per_user)
+        U = compute_user_user_cosine(R)
+        print(f"\n📊 users={n_users:,}  items={n_items:,}  nnz(R)={R.nnz:,}  nnz(U)={U.nnz:,}")
+
+        start = time.time()
+        U_vec = apply_shrinkage(U, R, beta=beta)
+        t_vec = time.time() - start
+        print(f"   - Vectorized: {t_vec:.3f}s")
+
+        if n_users > max_loop_users:
+            print(f"   - Loop cũ: bỏ qua (> {max_loop_users:,} users)")
+            continue
+
+        start = time.time()
+        U_loop = _apply_shrinkage_loop(U, R, beta=beta)
+        t_loop = time.time() - start
+        same = U_loop.shape == U_vec.shape and abs(U_loop - U_vec).max() < 1e-5 if U_vec.nnz else U_loop.nnz == 0
+        print(f"   - Loop cũ:    {t_loop:.3f}s  (nhanh hơn ~{t_loop / max(t_vec, 1e-9):.1f}x, kết quả khớp: {same})")
+
+    print("\n" + "=" * 70)
+    print("✅ Test hoàn tất!")
+    print("=" * 70)
+
+# Giấu 1 course ngẫu nhiên của mỗi user được đánh giá (user có >= 2 course) -> (R_train, users, held-out cột)
+def _leave_one_out(R: sparse.csr_matrix, n_eval: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    counts = np.diff(R.indptr)
+    users = np.flatnonzero(counts >= 2)
+    if users.size > n_eval:
+        users = np.sort(rng.choice(users, size=n_eval, replace=False))
+    pick = R.indptr[users] + rng.integers(0, counts[users])
+    held = R.indices[pick].copy()
+    R_train = R.copy()
+    R_train.data[pick] = 0.0
+    R_train.eliminate_zeros()
+    return R_train, users, held
+
+# HitRate@K, NDCG@K (1 course giấu / user), coverage từ top-K (n × K, -1 = trống)
+def _rank_metrics(top: np.ndarray, held: np.ndarray, n_items: int):
+    hit_pos = np.argmax(top == held[:, None], axis=1)
+    hit = (top == held[:, None]).any(axis=1)
+    ndcg = np.where(hit, 1.0 / np.log2(hit_pos + 2.0), 0.0)
+    rec = top[top >= 0]
+    return float(hit.mean()), float(ndcg.mean()), np.unique(rec).size / max(1, n_items), float((top >= 0).any(axis=1).mean())
+
+# Top-K mỗi hàng của ma trận điểm dense (đã sort giảm dần; -1 nếu không đủ course có điểm > 0)
+def _topk_dense(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-vals, axis=1, kind="stable")
+    idx, vals = np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
+    return np.where(np.isfinite(vals) & (vals > 0), idx, -1)
+
+def test_item_item_vs_user_user(k: int = 10, n_eval: int = 2000, chunk: int = 256, seed: int = 42):
+    """
+    - k: số course đề xuất mỗi user (HitRate@K / NDCG@K)
+    - n_eval: số user được đánh giá (lấy mẫu trong user có >= 2 course)
+    User-user: sims @ R_train[neighbors] (CF_K_NEIGHBORS láng giềng, như collab_scores_for_user).
+    Item-item: (w @ S) / sum(w) (như item_item_candidates). Cả 2 bỏ course đã tương tác.
+    """
+    print("=" * 70)
+    print("OFFLINE: user-user CF vs item-item CF (leave-one-out)")
+    print("=" * 70)
+
+    R, _, _ = build_user_item_matrix()
+    if R.nnz == 0:
+        print("❌ Không có tương tác nào.")
+        return
+    R_train, users, held = _leave_one_out(R.tocsr(), n_eval, seed)
+    if users.size == 0:
+        print("❌ Không có user nào có >= 2 course.")
+        return
+    n_users, n_items = R.shape
+    Rw = apply_bm25(R_train) if CF_USE_BM25 else R_train
+    print(f"\n📊 users={n_users:,}  items={n_items:,}  nnz(R)={R.nnz:,}  user đánh giá={users.size:,}  K={k}")
+
+    # user-user
+    start = time.perf_counter()
+    N = topk_neighbor_csr_from_R(Rw, k=CF_K_NEIGHBORS, min_sim=MIN_SIM_CF, shrink_beta=50.0)
+    t_build_uu = time.perf_counter() - start
+    start = time.perf_counter()
+    tops = []
+    for s in range(0, users.size, chunk):
+        u = users[s:s + chunk]
+        scores = np.asarray((N[u] @ R_train).todense(), dtype=np.float64)
+        seen_r, seen_c = R_train[u].nonzero()
+        scores[seen_r, seen_c] = -np.inf
+        tops.append(_topk_dense(scores, k))
+    top_uu = np.vstack(tops)
+    t_score_uu = time.perf_counter() - start
+
+    # item-item
+    start = time.perf_counter()
+    S = build_item_item_matrix(Rw, top_m=CF_ITEM_TOP_M, min_sim=CF_ITEM_MIN_SIM, shrink_beta=CF_ITEM_SHRINK_BETA)
+    t_build_ii = time.perf_counter() - start
+    IM = ItemItemMatrix(S, np.arange(n_items, dtype=np.int64))
+    start = time.perf_counter()
+    top_ii = np.full((users.size, k), -1, dtype=np.int64)
+    for s in range(0, users.size, chunk):
+        rows, pos, _vals = item_item_topn(IM, R_train[users[s:s + chunk]], k)
+        rank = np.arange(rows.size) - np.searchsorted(rows, rows, side="left")
+        top_ii[s + rows, rank] = pos
+    t_score_ii = time.perf_counter() - start
+
+    print(f"\n{'':<12}{'HR@K':>8}{'NDCG@K':>9}{'coverage':>10}{'có đề xuất':>12}{'build':>10}{'chấm/user':>12}{'nnz':>12}")
+    for name, top, t_build, t_score, nnz in (
+        ("user-user", top_uu, t_build_uu, t_score_uu, N.nnz),
+        ("item-item", top_ii, t_build_ii, t_score_ii, S.nnz),
+    ):
+        hr, ndcg, cov, has = _rank_metrics(top, held, n_items)
+        print(
+            f"{name:<12}{hr:>8.3f}{ndcg:>9.3f}{cov:>10.1%}{has:>12.1%}"
+            f"{t_build:>9.2f}s{t_score / users.size * 1e3:>10.3f}ms{nnz:>12,}"
+        )
+
+    print("\n" + "=" * 70)
+    print("✅ Test hoàn tất!")
+    print("=" * 70)
+
+if __name__ == "__main__":
+    test_shrinkage_performance()
+    test_item_item_vs_user_user()
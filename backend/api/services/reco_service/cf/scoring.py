@@ -1,40 +1,112 @@
 from __future__ import annotations
-from typing import Dict, Optional, Iterable
+from typing import Dict, List, Optional, Iterable, Sequence, Set, Tuple
 from collections import defaultdict
-from api.services.reco_service.data_access.interactions import fetch_user_events
-from api.services.reco_service.cf.weighting import event_weight
-from api.services.reco_service.io.cf_store import load_user_neighbors_json
+import numpy as np
+from scipy import sparse
+from api.services.reco_service.data_access.interactions import EVENT_CODES, fetch_events_for_users
+from api.services.reco_service.cf.weighting import event_weights
+from api.services.reco_service.cf.neighbors import get_user_neighbors
+from api.services.reco_service.cf.streaming import topk_rows_csr
+from api.services.reco_service.io.cf_store import UserItemMatrix, load_user_item_matrix
+from api.services.reco_service.io.registry import get_artifact
 
 """
 User-based CF scoring:
 - Lấy neighbors của user u: [(v, sim_uv), ...] (đã build & lưu sẵn).
-- Lấy vector tương tác (implicit weight) của từng láng giềng v: w(v, i).
-- Cộng dồn: score[i] += sim_uv * w(v, i) cho mọi item i của v.
-- Loại item user u đã seen (đã enroll/favorite).
+- Lấy vector tương tác (implicit weight) của từng láng giềng v: w(v, i)
+  từ ma trận R lưu lúc build CF (giữ trong RAM), fallback đọc DB nếu chưa có R.
+- Cộng dồn: score[i] += sim_uv * w(v, i) cho mọi item i của v  (= sims @ R[neighbors]).
+- Loại item user u đã seen (đã enroll/favorite): hàng R của u + overlay sự kiện mới hơn lần build từ DB.
 - (Tuỳ chọn) lọc theo candidates; giới hạn số item lấy từ mỗi láng giềng.
 - (Tuỳ chọn) chuẩn hoá min-max về [0,1] để phối Hybrid.
 
 Public:
 - user_seen_items(user_id, max_events=200) -> set[int]
 - user_item_weights(user_id, max_events=200) -> dict[int, float]
+- users_item_weights(user_ids, max_events=200) -> dict[user_id, dict[int, float]] (1 query)
+- fresh_user_item_weights(user_id) -> dict[int, float] (R + sự kiện mới từ DB)
+- neighbors_item_weights(user_ids, max_items=None) -> dict[user_id, dict[int, float]] (từ R)
 - collab_scores_for_user(user_id, ...) -> dict[int, float]
 - top_k_collab_for_user(user_id, k=12, ...) -> list[(course_id, score)]
 """
 
 # Lấy tâp course_id mà user đã enroll -> để loại khỏi đề xuất.
 def user_seen_items(user_id: str, max_events: int = 200) -> set[int]:
-    evs = fetch_user_events(user_id, limit=max_events)
-    return {int(e["course_id"]) for e in evs if e.get("event_type") == "enroll"}
+    _, cids, codes, _ = fetch_events_for_users([user_id], limit=max_events)
+    return set(cids[codes == EVENT_CODES["enroll"]].tolist())
+
+# Cộng dồn trọng số theo (user, course) từ mảng sự kiện -> list dict, phần tử thứ p ứng với user_ids[p]
+def _group_item_weights(n_users: int, user_pos: np.ndarray, cids: np.ndarray, w: np.ndarray) -> List[Dict[int, float]]:
+    out: List[Dict[int, float]] = [{} for _ in range(n_users)]
+    for p, cid, x in zip(user_pos.tolist(), cids.tolist(), w.tolist()):
+        if x <= 0.0:
+            continue
+        acc = out[p]
+        acc[cid] = acc.get(cid, 0.0) + x  # cộng dồn nếu có nhiều event
+    return out
+
+# Trọng số implicit của nhiều user trên từng course đã tương tác (1 query cho tất cả user)
+def users_item_weights(user_ids: Sequence[str], max_events: Optional[int] = 200) -> Dict[str, Dict[int, float]]:
+    user_ids = list(user_ids)
+    user_pos, cids, codes, days_ago = fetch_events_for_users(user_ids, limit=max_events)
+    grouped = _group_item_weights(len(user_ids), user_pos, cids, event_weights(codes, days_ago))
+    out: Dict[str, Dict[int, float]] = {}
+    for uid, w in zip(user_ids, grouped):
+        out.setdefault(uid, w)
+    return out
 
 # Trọng số implicit của user trên từng course đã tương tác:
 #   w(u, i) = base_weight(event_type) * time_decay(days_ago)
 def user_item_weights(user_id: str, max_events: int = 200) -> Dict[int, float]:
-    evs = fetch_user_events(user_id, limit=max_events)
-    acc: Dict[int, float] = defaultdict(float)
-    for e in evs:
-        cid = int(e["course_id"])
-        acc[cid] += event_weight(e["type"], e.get("days_ago", 0.0)) # cộng dồn nếu có nhiều event
-    return {cid: w for cid, w in acc.items() if w > 0.0}
+    return users_item_weights([user_id], max_events=max_events).get(user_id, {})
+
+# Thứ hạng của mỗi sự kiện trong nhóm user của nó (mảng đã sort theo user, thời gian giảm dần)
+def _rank_within_user(user_pos: np.ndarray) -> np.ndarray:
+    return np.arange(user_pos.size) - np.searchsorted(user_pos, user_pos, side="left")
+
+# R (user × item) của generation "cf" hiện tại, giữ trong registry; None nếu chưa build
+def get_user_item_matrix(artifact_dir: str = "api/var/reco") -> Optional[UserItemMatrix]:
+    return get_artifact(
+        "cf",
+        "user_item",
+        lambda: load_user_item_matrix(artifact_dir),
+        artifact_dir,
+    )
+
+# Trọng số của 1 user: hàng R (lúc build) + overlay sự kiện mới hơn built_at từ DB (1 query, chỉ user này)
+def fresh_user_item_weights(
+    user_id: str,
+    artifact_dir: str = "api/var/reco",
+    M: Optional[UserItemMatrix] = None,
+) -> Dict[int, float]:
+    if M is None:
+        M = get_user_item_matrix(artifact_dir)
+    if M is None:
+        return user_item_weights(user_id)
+    acc = M.item_weights(user_id)
+    _, cids, codes, days_ago = fetch_events_for_users([user_id], limit=None, since=M.built_at)
+    for cid, w in zip(cids.tolist(), event_weights(codes, days_ago).tolist()):
+        if w > 0.0:
+            acc[cid] = acc.get(cid, 0.0) + w
+    return acc
+
+# Trọng số item của nhiều user (láng giềng) lấy từ R trong RAM, không query DB.
+# max_items: chỉ giữ max_items course có trọng số cao nhất mỗi user. Chưa có R -> đọc DB.
+def neighbors_item_weights(
+    user_ids: Sequence[str],
+    artifact_dir: str = "api/var/reco",
+    max_items: Optional[int] = None,
+) -> Dict[str, Dict[int, float]]:
+    M = get_user_item_matrix(artifact_dir)
+    if M is None:
+        return users_item_weights(user_ids, max_events=max_items)
+    out: Dict[str, Dict[int, float]] = {}
+    for uid in user_ids:
+        w = M.item_weights(uid)
+        if max_items is not None and len(w) > max_items:
+            w = dict(sorted(w.items(), key=lambda x: x[1], reverse=True)[:max_items])
+        out[uid] = w
+    return out
 
 # Chuẩn hoá score của các item về [0,1] theo min-max normalization.
 def _min_max_normalize(scores: Dict[int, float]) -> Dict[int, float]:
@@ -47,49 +119,70 @@ def _min_max_normalize(scores: Dict[int, float]) -> Dict[int, float]:
     rng = hi - lo
     return {k: (v - lo) / rng for k, v in scores.items()}
 
-# Tính điểm CF user-based cho user_id.
-def collab_scores_for_user(
+# Điểm CF từ R trong RAM: scores = sims @ R[neighbors] (1 phép nhân sparse), trả (scores, tổng sim)
+def _collab_scores_from_matrix(
+    M: UserItemMatrix,
     user_id: str,
-    *,
-    artifact_dir: str = "api/var/reco",
-    k_neighbors: int = 200,
-    max_items_per_neighbor: int = 500,
-    candidates: Optional[Iterable[int]] = None,
-    min_sim: float = 0.0,
-    normalize_scores: bool = True,
-    max_events_user: int = 200,
-    max_events_neighbor: int = 500,
-    sim_normalize: bool = False,
-) -> Dict[int, float]:
-    # Load user neighbors từ file JSON - ma trận user-user đã được tính sẵn.
-    all_neighbors = load_user_neighbors_json(artifact_dir)
-    neighs = all_neighbors.get(str(user_id), [])
-    if not neighs:
-        return {}
+    picked: List[Tuple[str, float]],
+    candidates: Optional[Set[int]],
+    max_items_per_neighbor: int,
+) -> Tuple[Dict[int, float], float]:
+    rows = np.array([M.row(v_uid) for v_uid, _ in picked], dtype=np.int64)
+    sims = np.array([s for _, s in picked], dtype=np.float64)
+    sim_denom = float(sims.sum())
+    ok = rows >= 0
+    rows, sims = rows[ok], sims[ok]
+    if rows.size == 0:
+        return {}, sim_denom
 
-    # Tập seen (course_id của các course đã enroll) của user u (để loại khỏi đề xuất)
-    seen_u = user_seen_items(user_id, max_events=max_events_user)
-
-    # candidates → set
+    # cột được phép: chưa seen (R của u + sự kiện mới) và thuộc candidates (nếu có)
+    seen_u = np.fromiter(fresh_user_item_weights(user_id, M=M).keys(), dtype=np.int64)
+    allowed = ~np.isin(M.item_ids, seen_u)
     if candidates is not None:
-        candidates = set(int(c) for c in candidates)
+        allowed &= np.isin(M.item_ids, np.fromiter(candidates, dtype=np.int64))
+
+    Rn = M.R[rows]
+    Rn.data = Rn.data * allowed[Rn.indices]
+    Rn.eliminate_zeros()
+
+    # giới hạn số item mỗi láng giềng (giữ item trọng số cao nhất)
+    if max_items_per_neighbor and Rn.nnz and int(np.diff(Rn.indptr).max()) > max_items_per_neighbor:
+        r, c, v = topk_rows_csr(Rn, max_items_per_neighbor, 0.0)
+        Rn = sparse.csr_matrix((v, (r, c)), shape=Rn.shape)
+
+    agg = np.asarray(Rn.T @ sims).ravel()  # (I,)
+    nz = np.flatnonzero(agg > 0.0)
+    return dict(zip(M.item_ids[nz].tolist(), agg[nz].tolist())), sim_denom
+
+# Điểm CF đọc sự kiện từ DB (khi chưa có R): 1 query cho user u + toàn bộ láng giềng
+def _collab_scores_from_db(
+    user_id: str,
+    picked: List[Tuple[str, float]],
+    candidates: Optional[Set[int]],
+    max_items_per_neighbor: int,
+    max_events_user: int,
+    max_events_neighbor: int,
+) -> Tuple[Dict[int, float], float]:
+    # Sự kiện của user u + toàn bộ láng giềng: 1 query, rồi cắt theo giới hạn riêng của u / láng giềng
+    user_ids = [user_id] + [v_uid for v_uid, _ in picked]
+    user_pos, cids, codes, days_ago = fetch_events_for_users(
+        user_ids, limit=max(max_events_user, max_events_neighbor)
+    )
+    limits = np.where(user_pos == 0, max_events_user, max_events_neighbor)
+    keep = _rank_within_user(user_pos) < limits
+    user_pos, cids, codes, days_ago = user_pos[keep], cids[keep], codes[keep], days_ago[keep]
+
+    # Tập seen (course_id user u đã tương tác) để loại khỏi đề xuất
+    seen_u = set(cids[user_pos == 0].tolist())
+    weights = _group_item_weights(len(user_ids), user_pos, cids, event_weights(codes, days_ago))
 
-    # Duyệt qua k láng giềng có sim cao nhất
     scores: Dict[int, float] = defaultdict(float)
     sim_denom = 0.0
-
-    used = 0
-    for (v_uid, sim_uv) in neighs:
-        if used >= k_neighbors:
-            break
-        s = float(sim_uv)
-        if s <= min_sim:
-            continue
-        used += 1
+    for p, (v_uid, s) in enumerate(picked, start=1):
         sim_denom += s
 
-        # Lấy vector item của láng giềng v
-        w_vi = user_item_weights(v_uid, max_events=max_events_neighbor)
+        # Vector item của láng giềng v
+        w_vi = weights[p]
         if not w_vi:
             continue
 
@@ -104,6 +197,41 @@ def collab_scores_for_user(
             count_i += 1
             if count_i >= max_items_per_neighbor:
                 break
+    return dict(scores), sim_denom
+
+# Tính điểm CF user-based cho user_id.
+def collab_scores_for_user(
+    user_id: str,
+    *,
+    artifact_dir: str = "api/var/reco",
+    k_neighbors: int = 200,
+    max_items_per_neighbor: int = 500,
+    candidates: Optional[Iterable[int]] = None,
+    min_sim: float = 0.0,
+    normalize_scores: bool = True,
+    max_events_user: int = 200,
+    max_events_neighbor: int = 500,
+    sim_normalize: bool = False,
+) -> Dict[int, float]:
+    # Neighbors của user (đã build sẵn) - lấy từ registry trong RAM
+    neighs = get_user_neighbors(user_id, artifact_dir, k=k_neighbors)
+    if not neighs:
+        return {}
+
+    # candidates → set
+    if candidates is not None:
+        candidates = set(int(c) for c in candidates)
+
+    # k láng giềng có sim cao nhất (bỏ sim <= min_sim)
+    picked = [(v_uid, float(sim_uv)) for (v_uid, sim_uv) in neighs if float(sim_uv) > min_sim][:k_neighbors]
+
+    M = get_user_item_matrix(artifact_dir)
+    if M is not None:
+        scores, sim_denom = _collab_scores_from_matrix(M, user_id, picked, candidates, max_items_per_neighbor)
+    else:
+        scores, sim_denom = _collab_scores_from_db(
+            user_id, picked, candidates, max_items_per_neighbor, max_events_user, max_events_neighbor
+        )
 
     # Chuẩn hoá theo tổng sim láng giềng
     if sim_normalize and sim_denom > 0:
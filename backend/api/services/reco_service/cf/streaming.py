@@ -0,0 +1,237 @@
+from __future__ import annotations
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+from api.services.reco_service.config import (
+    CF_STREAM_BLOCK_USERS,
+    CF_STREAM_MAX_BLOCK_MB,
+    CF_STREAM_N_JOBS,
+)
+
+"""
+Streaming neighbor builder theo block (user-user CF), không dựng full U:
+- L2-normalize R và binarize (cho shrinkage) đúng 1 lần.
+- Xử lý user theo block B hàng: 1 phép nhân sparse / block
+    S = X[block] @ X.T, C = B[block] @ B.T (số item chung)
+- Shrinkage, bỏ self-similarity, lọc min_sim và chọn top-K vectorized trên cả block.
+- Các block có thể chia cho process pool; X / X.T được đặt trong shared memory
+  để worker không phải copy ma trận.
+- RAM đỉnh mỗi block ~ B × U × 12 bytes (trường hợp xấu nhất), B tự giảm để
+  không vượt CF_STREAM_MAX_BLOCK_MB.
+
+Kết quả: CSR N (U × U), hàng u chứa tối đa K neighbors của u.
+"""
+
+# Chọn top-k mỗi hàng của block CSR S (b × U) -> (rows_local, cols, vals), đã sort sim giảm dần trong từng hàng
+def topk_rows_csr(S: sparse.csr_matrix, k: int, min_sim: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    counts = np.diff(S.indptr)
+    rows = np.repeat(np.arange(S.shape[0]), counts)
+    keep = S.data > min_sim
+    rows, cols, vals = rows[keep], S.indices[keep], S.data[keep]
+    if rows.size == 0:
+        return rows, cols, vals
+
+    order = np.lexsort((-vals, rows))  # theo hàng, trong hàng theo sim giảm dần
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    starts = np.searchsorted(rows, rows, side="left")
+    rank = np.arange(rows.size) - starts
+    sel = rank < k
+    return rows[sel], cols[sel], vals[sel]
+
+# Tính top-K neighbors cho các user [start, end)
+def _block_topk(
+    X: sparse.csr_matrix,
+    XT: sparse.csr_matrix,
+    BT: Optional[sparse.csr_matrix],
+    start: int,
+    end: int,
+    k: int,
+    min_sim: float,
+    shrink_beta: Optional[float],
+    dtype=np.float32,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    r, c, v = _rows_topk(X[start:end], np.arange(start, end), XT, BT, k, min_sim, shrink_beta, dtype)
+    return r + start, c, v
+
+# Top-K neighbors cho block hàng Xb = X[rows] (rows: chỉ số user tương ứng, dùng để bỏ self-similarity).
+# Trả rows_local (0..len(rows)-1), cols, vals.
+def _rows_topk(
+    Xb: sparse.csr_matrix,
+    rows: np.ndarray,
+    XT: sparse.csr_matrix,
+    BT: Optional[sparse.csr_matrix],
+    k: int,
+    min_sim: float,
+    shrink_beta: Optional[float],
+    dtype=np.float32,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    S = (Xb @ XT).tocsr().astype(dtype, copy=False)  # (b × U) cosine
+
+    if shrink_beta is not None and shrink_beta > 0:
+        # số item chung: B là bản binarize cùng cấu trúc với X
+        Bb = sparse.csr_matrix((np.ones_like(Xb.data), Xb.indices, Xb.indptr), shape=Xb.shape)
+        C = (Bb @ BT).tocsr()
+        C.data = C.data / (C.data + float(shrink_beta))
+        S = S.multiply(C).tocsr().astype(dtype, copy=False)
+
+    # bỏ self-similarity
+    local_rows = np.repeat(np.arange(S.shape[0]), np.diff(S.indptr))
+    S.data[S.indices == rows[local_rows]] = 0.0
+
+    return topk_rows_csr(S, k, min_sim)
+
+# Bản binarize của X.T (dùng chung indices/indptr, chỉ cấp phát data = 1)
+def _binarize_like(XT: sparse.csr_matrix) -> sparse.csr_matrix:
+    return sparse.csr_matrix((np.ones_like(XT.data), XT.indices, XT.indptr), shape=XT.shape)
+
+# ---------------- shared memory cho process pool ----------------
+_WORKER: Dict[str, object] = {}
+
+def _shm_put(arrays: Dict[str, np.ndarray]):
+    from multiprocessing import shared_memory
+    handles, meta = [], {}
+    for name, arr in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        view[...] = arr
+        handles.append(shm)
+        meta[name] = (shm.name, arr.shape, arr.dtype.str)
+    return handles, meta
+
+def _worker_init(meta: Dict[str, tuple], x_shape: Tuple[int, int]) -> None:
+    from multiprocessing import shared_memory
+    arrs, handles = {}, []
+    for name, (shm_name, shape, dtype) in meta.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        handles.append(shm)
+        arrs[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _WORKER["handles"] = handles  # giữ tham chiếu để buffer không bị giải phóng
+    _WORKER["X"] = sparse.csr_matrix((arrs["x_data"], arrs["x_indices"], arrs["x_indptr"]), shape=x_shape)
+    _WORKER["XT"] = sparse.csr_matrix(
+        (arrs["xt_data"], arrs["xt_indices"], arrs["xt_indptr"]), shape=(x_shape[1], x_shape[0])
+    )
+    _WORKER["BT"] = _binarize_like(_WORKER["XT"])
+
+def _worker_block(args: Tuple[int, int, int, float, Optional[float]]):
+    start, end, k, min_sim, shrink_beta = args
+    return _block_topk(_WORKER["X"], _WORKER["XT"], _WORKER["BT"], start, end, k, min_sim, shrink_beta)
+
+# Số user mỗi block, giới hạn theo RAM (trường hợp block dense: b × U × 12 bytes)
+def _effective_block_size(n_users: int, block_size: int, max_block_mb: Optional[float]) -> int:
+    b = max(1, int(block_size))
+    if max_block_mb and n_users > 0:
+        b = min(b, max(1, int(max_block_mb * 1024 * 1024 // (n_users * 12))))
+    return b
+
+def topk_neighbor_csr_from_R(
+    R: sparse.csr_matrix,
+    *,
+    k: int = 200,
+    min_sim: float = 0.0,
+    shrink_beta: Optional[float] = 50.0,
+    block_size: int = CF_STREAM_BLOCK_USERS,
+    n_jobs: int = CF_STREAM_N_JOBS,
+    max_block_mb: Optional[float] = CF_STREAM_MAX_BLOCK_MB,
+) -> sparse.csr_matrix:
+    """
+    Top-K neighbors cho mọi user từ R (U × I), trả CSR N (U × U) float32.
+    n_jobs > 1: chia block cho process pool (shared memory); nếu không tạo được
+    process con (vd. trong Celery worker daemon) -> tự chạy tuần tự.
+    """
+    n_users, n_items = R.shape
+    if n_users == 0 or n_items == 0:
+        return sparse.csr_matrix((n_users, n_users), dtype=np.float32)
+
+    X = normalize(R.tocsr(), norm="l2", axis=1, copy=True).astype(np.float32)
+    XT = X.T.tocsr()
+    b = _effective_block_size(n_users, block_size, max_block_mb)
+    tasks = [(s, min(s + b, n_users), int(k), float(min_sim), shrink_beta) for s in range(0, n_users, b)]
+
+    results = None
+    n_jobs = int(n_jobs or 1)
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs > 1 and len(tasks) > 1:
+        results = _run_parallel(X, XT, tasks, n_jobs)
+    if results is None:
+        BT = _binarize_like(XT) if (shrink_beta is not None and shrink_beta > 0) else None
+        results = [_block_topk(X, XT, BT, *t) for t in tasks]
+
+    rows = np.concatenate([r[0] for r in results])
+    cols = np.concatenate([r[1] for r in results])
+    vals = np.concatenate([r[2] for r in results]).astype(np.float32, copy=False)
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(n_users, n_users), dtype=np.float32)
+
+def topk_neighbor_rows_from_R(
+    R: sparse.csr_matrix,
+    rows: np.ndarray,
+    *,
+    k: int = 200,
+    min_sim: float = 0.0,
+    shrink_beta: Optional[float] = 50.0,
+    block_size: int = CF_STREAM_BLOCK_USERS,
+    max_block_mb: Optional[float] = CF_STREAM_MAX_BLOCK_MB,
+) -> sparse.csr_matrix:
+    """
+    Top-K neighbors chỉ cho các user `rows` (so với mọi user trong R), trả CSR (len(rows) × U)
+    float32: hàng i là neighbors của user rows[i], giống hàng rows[i] của topk_neighbor_csr_from_R.
+    Dùng cho cập nhật incremental (chỉ tính lại user bị ảnh hưởng), chạy tuần tự.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    n_users, n_items = R.shape
+    if rows.size == 0 or n_users == 0 or n_items == 0:
+        return sparse.csr_matrix((rows.size, n_users), dtype=np.float32)
+
+    X = normalize(R.tocsr(), norm="l2", axis=1, copy=True).astype(np.float32)
+    XT = X.T.tocsr()
+    BT = _binarize_like(XT) if (shrink_beta is not None and shrink_beta > 0) else None
+    b = _effective_block_size(n_users, block_size, max_block_mb)
+
+    parts = []
+    for s in range(0, rows.size, b):
+        sel = rows[s:s + b]
+        r, c, v = _rows_topk(X[sel], sel, XT, BT, int(k), float(min_sim), shrink_beta)
+        parts.append((r + s, c, v))
+    r = np.concatenate([p[0] for p in parts])
+    c = np.concatenate([p[1] for p in parts])
+    v = np.concatenate([p[2] for p in parts]).astype(np.float32, copy=False)
+    return sparse.csr_matrix((v, (r, c)), shape=(rows.size, n_users), dtype=np.float32)
+
+def _run_parallel(X, XT, tasks, n_jobs):
+    from concurrent.futures import ProcessPoolExecutor
+    handles, meta = [], {}
+    try:
+        handles, meta = _shm_put({
+            "x_data": X.data, "x_indices": X.indices, "x_indptr": X.indptr,
+            "xt_data": XT.data, "xt_indices": XT.indices, "xt_indptr": XT.indptr,
+        })
+        with ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_worker_init, initargs=(meta, X.shape)
+        ) as ex:
+            return list(ex.map(_worker_block, tasks))
+    except (AssertionError, OSError, RuntimeError):
+        # daemonic process không được tạo process con / không có shared memory
+        return None
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+# Chuyển CSR neighbors -> dict {user_id: [(neighbor_id, sim), ...]} (sim giảm dần)
+def neighbor_csr_to_dict(N: sparse.csr_matrix, inv_user_ids: List[Optional[str]]) -> Dict[str, List[Tuple[str, float]]]:
+    out: Dict[str, List[Tuple[str, float]]] = {}
+    for u in range(N.shape[0]):
+        uid = inv_user_ids[u] if u < len(inv_user_ids) else None
+        if uid is None:
+            continue
+        start, end = N.indptr[u], N.indptr[u + 1]
+        cols, vals = N.indices[start:end], N.data[start:end]
+        order = np.argsort(-vals, kind="stable")
+        out[uid] = [
+            (inv_user_ids[v], float(s))
+            for v, s in zip(cols[order].tolist(), vals[order].tolist())
+            if inv_user_ids[v] is not None
+        ]
+    return out
@@ -1,20 +1,45 @@
 from __future__ import annotations
+import time
 from typing import Dict, Optional
 from datetime import datetime
-from api.services.reco_service.cf.build_matrix import build_user_item_matrix
+import numpy as np
+from scipy import sparse
+from api.services.reco_service.cf.build_matrix import build_user_item_matrix, extend_user_item_matrix
 from api.services.reco_service.cf.weighting import apply_bm25
 from api.services.reco_service.cf.user_user import compute_user_user_cosine, apply_shrinkage
 from api.services.reco_service.cf.neighbors import (
     topk_neighbors_from_U,
-    topk_neighbors_from_R_streaming,
     save_neighbors,
+    save_neighbor_csr,
+    invert_user_index,
 )
-from api.services.reco_service.io.misc_store import save_json
+from api.services.reco_service.cf.streaming import topk_neighbor_csr_from_R, topk_neighbor_rows_from_R
+from api.services.reco_service.config import (
+    CF_STREAM_BLOCK_USERS,
+    CF_STREAM_N_JOBS,
+    CF_USE_BM25,
+    CF_BM25_K1,
+    CF_BM25_B,
+    CF_BM25_ITEM_IDF,
+    CF_INCREMENTAL_MAX_EVENTS,
+    CF_INCREMENTAL_MAX_AFFECTED_RATIO,
+    CF_INCREMENTAL_MAX_AGE_HOURS,
+)
+from api.services.reco_service.data_access.interactions import fetch_interaction_arrays
+from api.services.reco_service.io.cf_store import (
+    save_user_item_matrix,
+    load_user_item_matrix,
+    load_user_neighbors_bin,
+    patch_user_neighbors_csr,
+)
+from api.services.reco_service.io.registry import publish_generation
 
 """
 Update pipeline cho CF (user-based):
 - FULL: build toàn bộ neighbors từ ma trận user-user U
-- STREAMING: không dựng full U; tính theo từng user (phù hợp dữ liệu lớn)
+- STREAMING: không dựng full U; tính theo block user, có thể song song (phù hợp dữ liệu lớn)
+- INCREMENTAL: chỉ đọc sự kiện sau lần build trước, cộng vào R đã lưu và tính lại neighbors
+  của các user bị ảnh hưởng; delta quá lớn / artifacts quá cũ -> STREAMING
 
 Có thể gọi các hàm này trong management command (vd. reco_init) để
 khởi tạo/làm mới artifacts CF.
@@ -25,21 +50,24 @@ khởi tạo/làm mới artifacts CF.
 def rebuild_user_neighbors_full(
     *,
     artifact_dir: str = "api/var/reco",
-    use_bm25: bool = False,
-    bm25_k1: float = 1.2,
-    bm25_b: float = 0.75,
+    use_bm25: bool = CF_USE_BM25,
+    bm25_k1: float = CF_BM25_K1,
+    bm25_b: float = CF_BM25_B,
+    bm25_item_idf: bool = CF_BM25_ITEM_IDF,
     shrink_beta: Optional[float] = 50.0,
     k_neighbors: int = 200,
     min_sim: float = 0.0,
     save_indices: bool = True,
 ) -> Dict:
     # R + index maps
+    built_at = time.time()  # sự kiện sau thời điểm này chưa có trong R
     R, user_index, item_index = build_user_item_matrix()
     n_users, n_items = R.shape
+    R_raw = R  # lưu lại cho CF scoring (apply_bm25 trả ma trận mới)
 
     # BM25
     if use_bm25 and n_users > 0 and n_items > 0:
-        R = apply_bm25(R, k1=bm25_k1, b=bm25_b)
+        R = apply_bm25(R, k1=bm25_k1, b=bm25_b, item_idf=bm25_item_idf)
 
     # cosine U
     U = compute_user_user_cosine(R)  # csr (U×U) zero-diagonal
@@ -53,11 +81,12 @@ def rebuild_user_neighbors_full(
         U, user_index, k=k_neighbors, min_sim=min_sim
     )
 
-    save_neighbors(artifact_dir, neighbors, file_name="cf_user_neighbors.json")
+    save_neighbors(artifact_dir, neighbors)
 
     if save_indices:
-        save_json(f"{artifact_dir}/cf_user_index.json", {uid: int(idx) for uid, idx in user_index.items()})
-        save_json(f"{artifact_dir}/cf_item_index.json", {int(cid): int(idx) for cid, idx in item_index.items()})
+        save_user_item_matrix(artifact_dir, R_raw, user_index, item_index, built_at)
+
+    generation = publish_generation("cf", artifact_dir)
 
     return {
         "mode": "full",
@@ -66,9 +95,11 @@ def rebuild_user_neighbors_full(
         "neighbors_users": len(neighbors),
         "k_neighbors": k_neighbors,
         "use_bm25": use_bm25,
+        "bm25_item_idf": bm25_item_idf,
         "shrink_beta": shrink_beta,
         "min_sim": min_sim,
         "artifact_dir": artifact_dir,
+        "generation": generation,
         "ts": datetime.utcnow().isoformat() + "Z",
     }
 
@@ -77,38 +108,176 @@ def rebuild_user_neighbors_full(
 def rebuild_user_neighbors_streaming(
     *,
     artifact_dir: str = "api/var/reco",
-    use_bm25: bool = False,
-    bm25_k1: float = 1.2,
-    bm25_b: float = 0.75,
+    use_bm25: bool = CF_USE_BM25,
+    bm25_k1: float = CF_BM25_K1,
+    bm25_b: float = CF_BM25_B,
+    bm25_item_idf: bool = CF_BM25_ITEM_IDF,
     shrink_beta: Optional[float] = 50.0,
     k_neighbors: int = 200,
     min_sim: float = 0.0,
+    block_size: int = CF_STREAM_BLOCK_USERS,
+    n_jobs: int = CF_STREAM_N_JOBS,
     save_indices: bool = True,
 ) -> Dict:
+    built_at = time.time()  # sự kiện sau thời điểm này chưa có trong R
     R, user_index, item_index = build_user_item_matrix()
     n_users, n_items = R.shape
+    R_raw = R  # lưu lại cho CF scoring (apply_bm25 trả ma trận mới)
 
     if use_bm25 and n_users > 0 and n_items > 0:
-        R = apply_bm25(R, k1=bm25_k1, b=bm25_b)
+        R = apply_bm25(R, k1=bm25_k1, b=bm25_b, item_idf=bm25_item_idf)
 
-    neighbors = topk_neighbors_from_R_streaming(
-        R, user_index, k=k_neighbors, min_sim=min_sim, shrink_beta=shrink_beta
+    N = topk_neighbor_csr_from_R(
+        R,
+        k=k_neighbors,
+        min_sim=min_sim,
+        shrink_beta=shrink_beta,
+        block_size=block_size,
+        n_jobs=n_jobs,
     )
-    save_neighbors(artifact_dir, neighbors, file_name="cf_user_neighbors.json")
+    save_neighbor_csr(artifact_dir, N, user_index)
 
     if save_indices:
-        save_json(f"{artifact_dir}/cf_user_index.json", {uid: int(idx) for uid, idx in user_index.items()})
-        save_json(f"{artifact_dir}/cf_item_index.json", {int(cid): int(idx) for cid, idx in item_index.items()})
+        save_user_item_matrix(artifact_dir, R_raw, user_index, item_index, built_at)
+
+    generation = publish_generation("cf", artifact_dir)
 
     return {
         "mode": "streaming",
         "users": n_users,
         "items": n_items,
-        "neighbors_users": len(neighbors),
+        "neighbors_users": n_users,
+        "block_size": block_size,
+        "n_jobs": n_jobs,
+        "k_neighbors": k_neighbors,
+        "use_bm25": use_bm25,
+        "bm25_item_idf": bm25_item_idf,
+        "shrink_beta": shrink_beta,
+        "min_sim": min_sim,
+        "artifact_dir": artifact_dir,
+        "generation": generation,
+        "ts": datetime.utcnow().isoformat() + "Z",
+    }
+
+# Các user có similarity (với bất kỳ ai) có thể đổi khi các hàng changed_rows của R thay đổi:
+# chính các user đó + mọi user có chung ít nhất 1 course với họ (cosine / số item chung chỉ đổi
+# trên các cặp này). item_idf: IDF của course bị chạm đổi -> mọi user của course đó cũng đổi hàng.
+def affected_user_rows(
+    R: sparse.csr_matrix,
+    changed_rows: np.ndarray,
+    touched_cols: np.ndarray,
+    item_idf: bool = False,
+) -> np.ndarray:
+    R = R.tocsr()
+    C = R.tocsc()
+    changed = np.asarray(changed_rows, dtype=np.int64)
+    if item_idf and touched_cols.size:
+        changed = np.union1d(changed, C[:, touched_cols].indices)
+    items = np.unique(R[changed].indices)
+    return np.union1d(changed, C[:, items].indices).astype(np.int64)
+
+# Cập nhật neighbors theo delta: chỉ sự kiện sau lần build trước (cf_user_item_meta.json built_at).
+# Bỏ qua (trả mode "full"/"streaming" như rebuild_user_neighbors_streaming) khi chưa có artifacts,
+# lần build toàn bộ gần nhất quá max_age_hours, quá max_events sự kiện mới hoặc
+# quá max_affected_ratio user bị ảnh hưởng.
+# Sai khác so với build toàn bộ: time-decay của phần R cũ và avg_len của BM25 không được tính lại
+# cho user không bị ảnh hưởng; enroll / favorite bị xoá chỉ được phản ánh ở lần build toàn bộ.
+def update_user_neighbors_incremental(
+    *,
+    artifact_dir: str = "api/var/reco",
+    use_bm25: bool = CF_USE_BM25,
+    bm25_k1: float = CF_BM25_K1,
+    bm25_b: float = CF_BM25_B,
+    bm25_item_idf: bool = CF_BM25_ITEM_IDF,
+    shrink_beta: Optional[float] = 50.0,
+    k_neighbors: int = 200,
+    min_sim: float = 0.0,
+    block_size: int = CF_STREAM_BLOCK_USERS,
+    n_jobs: int = CF_STREAM_N_JOBS,
+    max_events: int = CF_INCREMENTAL_MAX_EVENTS,
+    max_affected_ratio: float = CF_INCREMENTAL_MAX_AFFECTED_RATIO,
+    max_age_hours: Optional[float] = CF_INCREMENTAL_MAX_AGE_HOURS,
+) -> Dict:
+    def _full(reason: str, **extra) -> Dict:
+        stats = rebuild_user_neighbors_streaming(
+            artifact_dir=artifact_dir,
+            use_bm25=use_bm25,
+            bm25_k1=bm25_k1,
+            bm25_b=bm25_b,
+            bm25_item_idf=bm25_item_idf,
+            shrink_beta=shrink_beta,
+            k_neighbors=k_neighbors,
+            min_sim=min_sim,
+            block_size=block_size,
+            n_jobs=n_jobs,
+        )
+        stats["fallback"] = reason
+        stats.update(extra)
+        return stats
+
+    M = load_user_item_matrix(artifact_dir)
+    store = load_user_neighbors_bin(artifact_dir)
+    if M is None or store is None:
+        return _full("no_artifacts")
+    built_at = time.time()
+    if max_age_hours and built_at - M.full_built_at > float(max_age_hours) * 3600:
+        return _full("stale")
+
+    # (built_at cũ, built_at mới]: sự kiện tạo sau built_at mới để dành cho lần chạy sau (không cộng 2 lần)
+    student_ids, course_ids, ev_codes, ts = fetch_interaction_arrays(since=M.built_at, until=built_at)
+    n_events = int(student_ids.size)
+    if n_events == 0:
+        return {"mode": "incremental", "events": 0, "affected_users": 0, "artifact_dir": artifact_dir}
+    if n_events > max_events:
+        return _full("too_many_events", events=n_events)
+
+    user_index = {uid: int(r) for uid, r in M.user_index.items()}
+    item_index = {int(cid): int(col) for col, cid in enumerate(M.item_ids.tolist())}
+    R_raw, user_index, item_index, changed, touched = extend_user_item_matrix(
+        M.R, user_index, item_index, student_ids, course_ids, ev_codes, ts, now=built_at
+    )
+    n_users, n_items = R_raw.shape
+
+    R = R_raw
+    if use_bm25 and n_users > 0 and n_items > 0:
+        R = apply_bm25(R_raw, k1=bm25_k1, b=bm25_b, item_idf=bm25_item_idf)
+    affected = affected_user_rows(R_raw, changed, touched, item_idf=use_bm25 and bm25_item_idf)
+    if affected.size > max_affected_ratio * max(1, n_users):
+        return _full("too_many_affected", events=n_events, affected_users=int(affected.size))
+
+    N_rows = None
+    if affected.size:
+        N_rows = topk_neighbor_rows_from_R(
+            R,
+            affected,
+            k=k_neighbors,
+            min_sim=min_sim,
+            shrink_beta=shrink_beta,
+            block_size=block_size,
+        )
+    # R + meta + index: 1 generation, đổi CURRENT trước khi đổi neighbor store.
+    # built_at tiến lên: sự kiện đã cộng vào R không bị overlay lần nữa khi chấm điểm
+    save_user_item_matrix(artifact_dir, R_raw, user_index, item_index, built_at, full_built_at=M.full_built_at)
+    if N_rows is not None:
+        patch_user_neighbors_csr(artifact_dir, store, invert_user_index(user_index), affected, N_rows)
+
+    generation = publish_generation("cf", artifact_dir)
+
+    return {
+        "mode": "incremental",
+        "users": n_users,
+        "items": n_items,
+        "events": n_events,
+        "changed_users": int(changed.size),
+        "affected_users": int(affected.size),
+        "new_users": n_users - M.R.shape[0],
+        "new_items": n_items - M.R.shape[1],
         "k_neighbors": k_neighbors,
         "use_bm25": use_bm25,
+        "bm25_item_idf": bm25_item_idf,
         "shrink_beta": shrink_beta,
         "min_sim": min_sim,
         "artifact_dir": artifact_dir,
+        "generation": generation,
         "ts": datetime.utcnow().isoformat() + "Z",
     }
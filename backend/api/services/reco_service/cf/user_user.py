@@ -40,6 +40,8 @@ def _pairwise_common_counts(R: sparse.csr_matrix) -> sparse.csr_matrix:
 
 # Áp dụng shrinkage lên ma trận cosine user-user để giảm ảnh hưởng của các cặp user có ít item chung.
 #  sim' = (n_common / (n_common + beta)) * sim, trong đó n_common là số item chung giữa 2 user.
+# Vectorized: tính hệ số trên C.data rồi nhân element-wise với U (không lặp từng hàng trong Python).
+# Cặp không có item chung (n_common = 0) -> sim' = 0, giống cách cũ.
 def apply_shrinkage(
     U_cosine: sparse.csr_matrix,
     R: sparse.csr_matrix,
@@ -50,41 +52,18 @@ def apply_shrinkage(
     if beta <= 0:
         return U_cosine
 
-    Uc = U_cosine if in_place else U_cosine.copy()
-
-    # ma trận số item chung
+    # ma trận số item chung, đổi data thành hệ số shrink n / (n + beta)
     C = _pairwise_common_counts(R)  # (U × U)
-    C = C.tocsr()
-
-    # Áp dụng hệ số scale trên từng phần tử khác 0 của U
-    # Duyệt theo cấu trúc CSR của Uc
-    Uc = Uc.tocsr()
-    indptr, indices, data = Uc.indptr, Uc.indices, Uc.data
-    C_csr = C.tocsr()
-
-    for u in range(Uc.shape[0]):
-        start, end = indptr[u], indptr[u + 1]
-        if start == end:
-            continue
-        cols = indices[start:end]
-        sims = data[start:end]
-        # lấy n_common(u, cols) từ C
-        c_row = C_csr.getrow(u)
-        # map col → n_common
-        # cách nhanh: convert row sparse thành dict tạm
-        c_idx = c_row.indices
-        c_dat = c_row.data
-        common_map = {c_idx[k]: c_dat[k] for k in range(len(c_idx))}
-        # scale
-        for k in range(len(cols)):
-            v = cols[k]
-            n_common = float(common_map.get(v, 0.0))
-            if n_common <= 0.0:
-                sims[k] = 0.0
-            else:
-                sims[k] = sims[k] * (n_common / (n_common + beta))
+    C.data = C.data / (C.data + float(beta))
 
+    Uc = U_cosine.tocsr()
+    dtype = Uc.dtype
+    Uc = Uc.multiply(C).tocsr().astype(dtype, copy=False)
     Uc.eliminate_zeros()
+    if in_place and sparse.isspmatrix_csr(U_cosine):
+        # giữ ngữ nghĩa in_place: ghi kết quả vào object cũ
+        U_cosine.data, U_cosine.indices, U_cosine.indptr = Uc.data, Uc.indices, Uc.indptr
+        return U_cosine
     return Uc
 
 # Tính similarity giữa user u_idx với toàn bộ user khác (vector cột/ hàng).
@@ -42,6 +42,18 @@ def event_weight(ev_type: str, days_ago: float,
         return 0.0
     return bw * time_decay(days_ago, tau_days=tau_days)
 
+# Bản vectorized của event_weight cho mảng sự kiện
+# ev_codes: 0 = enroll, 1 = favorite (xem data_access.interactions.EVENT_CODES)
+def event_weights(ev_codes: np.ndarray, days_ago: np.ndarray,
+                  w_enroll: float = WEIGHT_ENROLL,
+                  w_favorite: float = WEIGHT_FAVORITE,
+                  tau_days: int = TAU_DAYS) -> np.ndarray:
+    ev_codes = np.asarray(ev_codes)
+    bw = np.select([ev_codes == 0, ev_codes == 1], [float(w_enroll), float(w_favorite)], default=0.0)
+    if tau_days is None or tau_days <= 0:
+        return bw
+    d = np.maximum(0.0, np.nan_to_num(np.asarray(days_ago, dtype=np.float64), nan=0.0))
+    return bw * np.exp(-d / float(tau_days))
 
 # BM25 - like row scaling cho implicit feedback
 # score = ((k1+1)*x) / (k1*(1 - b + b*len/avg_len) + x)
@@ -50,24 +62,37 @@ def event_weight(ev_type: str, days_ago: float,
 # - len = tổng trọng số trên row (tổng trọng số user đã tương tác)
 # - avg_len = trung bình len toàn tập (trung bình tổng trọng số user)
 # Dùng để giảm ảnh hưởng user có quá nhiều tương tác hoặc item quá phổ biến.
+# item_idf=True: nhân thêm IDF theo item  idf = log(1 + (n_users - df + 0.5) / (df + 0.5))
+# (df = số user đã tương tác với item) -> giảm trọng số course quá phổ biến.
+# Vectorized: hệ số theo row được trải ra từng phần tử bằng np.repeat(np.diff(indptr)).
 # Tạo ra ma trận mới (CSR).
-def apply_bm25(R: sparse.csr_matrix, k1: float = 1.2, b: float = 0.75) -> sparse.csr_matrix:
+def apply_bm25(
+    R: sparse.csr_matrix,
+    k1: float = 1.2,
+    b: float = 0.75,
+    item_idf: bool = False,
+) -> sparse.csr_matrix:
     if R.shape[0] == 0:
         return R
 
     R = R.tocsr(copy=True)
-    row_sums = np.array(R.sum(axis=1)).ravel()  # len của mỗi user
+    R.sum_duplicates()
+    row_sums = np.asarray(R.sum(axis=1)).ravel()  # len của mỗi user
     avg_len = float(row_sums.mean()) if R.shape[0] > 0 else 0.0
     if avg_len <= 0:
         return R
 
-    # áp dụng theo từng row: x -> ((k1+1)*x) / (k1*(1-b+b*len/avg_len) + x)
-    rows, _ = R.shape
-    for i in range(rows):
-        start, end = R.indptr[i], R.indptr[i+1]
-        if start == end:
-            continue
-        x = R.data[start:end]
-        denom = (k1 * (1.0 - b + b * (row_sums[i] / avg_len))) + x
-        R.data[start:end] = ((k1 + 1.0) * x) / (denom + 1e-12) # +1e-12 để tranh chia 0
-    return R
+    # x -> ((k1+1)*x) / (k1*(1-b+b*len/avg_len) + x), len/avg_len trải theo từng phần tử của row
+    norm = k1 * (1.0 - b + b * (row_sums / avg_len))
+    x = R.data.astype(np.float64, copy=False)
+    denom = np.repeat(norm, np.diff(R.indptr)) + x
+    data = ((k1 + 1.0) * x) / (denom + 1e-12)  # +1e-12 để tranh chia 0
+
+    if item_idf and R.nnz > 0:
+        n_users = R.shape[0]
+        df = np.bincount(R.indices, minlength=R.shape[1]).astype(np.float64)
+        idf = np.log1p((n_users - df + 0.5) / (df + 0.5))
+        data *= idf[R.indices]
+
+    out_dtype = R.dtype if np.issubdtype(R.dtype, np.floating) else np.float64
+    return sparse.csr_matrix((data.astype(out_dtype, copy=False), R.indices, R.indptr), shape=R.shape)
@@ -3,6 +3,8 @@
 TFIDF_MIN_DF = 2
 TFIDF_MAX_FEATURES = 50000
 WORD_NGRAM = (1, 2)
+TOKENIZE_N_JOBS = -1 # số process tokenize corpus khi fit (-1 = số CPU; Celery worker daemon sẽ tự chạy tuần tự)
+TOKENIZE_PARALLEL_MIN_DOCS = 200 # ít văn bản cần tokenize hơn ngưỡng -> chạy tuần tự (tránh chi phí khởi tạo pool)
 
 # User profile
 WEIGHT_ENROLL = 1.0
@@ -14,6 +16,9 @@ TAU_DAYS = 60 # time-decay
 TTL_POPULAR = 60 # (nếu có) — ở đây bạn không dùng popularity nữa
 TTL_SIMILAR = 600
 TTL_USER_HOME = 120
+RESULT_CACHE_LOCAL_MAX = 2048 # số kết quả giữ trong LRU của mỗi tiến trình (tầng 1, trước Redis)
+RESULT_CACHE_LOCAL_TTL = 30 # giây tối đa giữ ở tầng 1 (ngắn hơn TTL để early refresh ở Redis có tác dụng)
+RESULT_CACHE_VERSION_TTL = 1.0 # giây giữ version của user/course trong tiến trình (tránh 1 lần gọi Redis mỗi request)
 
 # === Hybrid & Post-process ===
 # Cache
@@ -23,16 +28,87 @@ TOPK_CANDIDATES = 20
 CF_K_NEIGHBORS = 10
 CF_K_ITEM_PER_NEIGHBOR = 5
 CB_USER_MAX_ITEMS = 10
+HOME_BATCH_CHUNK_USERS = 256 # số user mỗi chunk khi chấm điểm Home theo lô (hybrid/batch.py)
+HOME_WARM_INTERVAL_MINUTES = 60 # chu kỳ chạy reco_warm_home (cron)
+TTL_USER_HOME_WARM = (HOME_WARM_INTERVAL_MINUTES + 10) * 60 # TTL cache Home ghi bởi warm_home_cache: sống tới lần warm kế tiếp (+10 phút cho lần đó chạy xong)
 
 # CB Similarity threshold
 MIN_SIM_CB = 0.2
+CB_PROFILE_MAX_EVENTS = 50 # số sự kiện mới nhất mỗi user dùng để dựng profile CB
+
+# Ma trận course-course similarity (precomputed)
+COURSE_SIM_TOP_M = None # bật prune: số láng giềng giữ lại mỗi course, vd. 100 (None/0 -> giữ đủ N x N như cũ)
+COURSE_SIM_MIN_SIM = 0.0 # similarity tối thiểu được lưu (0 -> giữ mọi giá trị > 0), vd. 0.01 khi prune
+COURSE_SIM_BLOCK_ROWS = 256 # số hàng tính mỗi block (RAM đỉnh ~ block x N x 4 bytes)
+
+# Engine chấm điểm CB: "sparse" (TF-IDF, chính xác) | "dense" (embedding SVD/LSA float32, xem cb/embedding.py)
+CB_ENGINE = "sparse"
+CB_EMBED_DIM = 192 # số chiều embedding (128-256); RAM ~ N x d x 4 bytes
+CB_EMBED_N_ITER = 5 # số vòng lặp randomized SVD khi fit
+
+# ANN index (IVF) cho course similarity khi catalog lớn (cb/ann_index.py)
+COURSE_ANN_ENABLED = True
+COURSE_ANN_MIN_COURSES = 20000 # chỉ build index khi N >= ngưỡng (nhỏ hơn -> quét chính xác đủ nhanh)
+COURSE_ANN_NLIST = None # số cluster (None -> ~sqrt(N)); RAM centroid ~ nlist x dim x 4 bytes
+COURSE_ANN_NPROBE = 8 # số cluster dò mỗi query: tăng -> recall cao hơn, chậm hơn (>= nlist -> chính xác)
+COURSE_ANN_KMEANS_ITER = 10 # số vòng k-means khi train
+COURSE_ANN_TRAIN_SAMPLE = 20000 # số course lấy mẫu để train centroid
+
+# Cập nhật TF-IDF / similarity khi course thay đổi: qua hàng đợi Celery (cb/update_queue.py)
+CB_UPDATE_DEBOUNCE_SECONDS = 10 # course không bị sửa thêm trong khoảng này mới được xử lý (gộp các lần sửa liên tiếp)
+CB_UPDATE_MAX_WAIT_SECONDS = 120 # course bị sửa liên tục vẫn được xử lý sau tối đa khoảng này
+CB_UPDATE_MAX_BATCH = 100 # số course tối đa mỗi lô (RAM cột similarity ~ N x batch x 4 bytes)
 
 # CF Similarity threshold
 MIN_SIM_CF = 0.02
 
+# BM25 reweighting ma trận R trước khi tính similarity user-user
+CF_USE_BM25 = True # bật mặc định khi build CF neighbors
+CF_BM25_K1 = 1.2
+CF_BM25_B = 0.75 # mức chuẩn hoá theo số tương tác của user
+CF_BM25_ITEM_IDF = False # nhân thêm IDF theo item (giảm ảnh hưởng course quá phổ biến)
+
+# CF streaming builder (theo block user)
+CF_STREAM_BLOCK_USERS = 1024 # số user mỗi block
+CF_STREAM_MAX_BLOCK_MB = 256 # giới hạn RAM mỗi block (tự giảm block size nếu cần)
+CF_STREAM_N_JOBS = 1 # số process song song (-1 = số CPU; Celery worker daemon sẽ tự chạy tuần tự)
+
+# CF incremental (cf/update.update_user_neighbors_incremental): chỉ tính lại neighbors của user bị ảnh hưởng
+CF_INCREMENTAL_MAX_EVENTS = 5000 # số sự kiện mới tối đa mỗi lần; nhiều hơn -> rebuild toàn bộ (streaming)
+CF_INCREMENTAL_MAX_AFFECTED_RATIO = 0.3 # tỉ lệ user bị ảnh hưởng tối đa; lớn hơn -> rebuild toàn bộ
+CF_INCREMENTAL_MAX_AGE_HOURS = 24 # rebuild toàn bộ định kỳ (time-decay, avg_len BM25, sự kiện bị xoá)
+
+# Engine CF cho ứng viên Home: "user" (user-user, neighbor store) | "item" (item-item, cf/item_item.py)
+CF_ENGINE = "user"
+CF_ITEM_TOP_M = 50 # số course láng giềng giữ lại mỗi course trong S (RAM ~ I x M x 8 bytes)
+CF_ITEM_MIN_SIM = 0.0 # similarity item-item tối thiểu được lưu
+CF_ITEM_SHRINK_BETA = 20.0 # shrinkage theo số user chung: sim * c / (c + beta)
+CF_ITEM_TOP_N = CF_K_NEIGHBORS * CF_K_ITEM_PER_NEIGHBOR # số ứng viên CF mỗi user (bằng số ứng viên của user-user)
+
 # Filter rules
 RULE_MAX_PER_TEACHER = 3
 RULE_MAX_PER_CATEGORY = 5
 RECENCY_MAX_BOOST = 0.2 # tối đa +20% điểm
 MIN_SCORE_THRESHOLD = 0.01 # lọc điểm quá thấp
 MIN_CANDIDATES = 10 # nếu lọc quá nhiều → hạ tiêu chuẩn
+
+# === Popularity (guest / fallback) ===
+POPULARITY_WINDOWS = (7, 30, 90) # cửa sổ đếm enroll/favorite (ngày)
+POPULARITY_TAU_DAYS = 30 # time-decay cho điểm phổ biến
+POPULARITY_CACHE_TTL = 6 * 3600 # giây; bảng xếp hạng được làm mới định kỳ bởi Celery beat
+POPULARITY_REFRESH_MINUTES = 30 # chu kỳ refresh_popularity_task
+
+# === Data access ===
+INTERACTION_CHUNK_ROWS = 5000 # số dòng mỗi lần fetch khi đọc toàn bộ interactions (server-side cursor)
+
+# === Artifacts ===
+# Registry trong RAM: chu kỳ (giây) đọc lại generation stamp trên đĩa
+REGISTRY_CHECK_INTERVAL = 1.0
+# Delta segment (TF-IDF / similarity): tự gộp vào ma trận gốc khi số hàng trong delta
+# vượt max(DELTA_COMPACT_MIN_ROWS, DELTA_COMPACT_RATIO * N)
+DELTA_COMPACT_RATIO = 0.1
+DELTA_COMPACT_MIN_ROWS = 50
+CB_DELTA_COMPACT_HOUR = 3 # giờ (UTC) chạy compact_cb_deltas_task mỗi ngày
+# Số thư mục generation giữ lại cho mỗi artifact (CURRENT + các bản trước cho reader đang đọc dở)
+ARTIFACT_KEEP_GENERATIONS = 2
+ARTIFACT_GENERATION_MIN_AGE = 300 # giây; generation bị thay thế chưa đủ lâu không bị xoá (reader có thể đang mở file)
@@ -1,6 +1,10 @@
+import os
 from api.models import CourseContent, Course
-from typing import List, Dict, Optional, Tuple
-from django.db.models import Count
+from typing import Iterable, List, Dict, Optional, Tuple
+import numpy as np
+from api.services.reco_service.io.registry import current_generation, get_artifact, publish_generation
+
+ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
 
 # Lấy dữ liệu course từ DB, bao gồm categories
 def fetch_courses_with_categories() -> List[Dict]:
@@ -27,49 +31,88 @@ def fetch_course_by_id(course_id: int) -> Dict:
         }
     except CourseContent.DoesNotExist:
         return {}
+
+# Lấy dữ liệu nhiều course (1 query + prefetch categories); course không còn tồn tại bị bỏ qua
+def fetch_courses_by_ids(course_ids: Iterable[int]) -> List[Dict]:
+    courses = CourseContent.objects.prefetch_related('categories').filter(id__in=list(course_ids))
+    return [
+        {
+            'id': course.id,
+            'title': course.title,
+            'description': course.description,
+            'categories': [cat.name for cat in course.categories.all()]
+        }
+        for course in courses
+    ]
     
 # Lấy tất cả course IDs
 def fetch_all_course_ids() -> List[int]:
     return list(CourseContent.objects.values_list('id', flat=True))
 
+# ---------------- Visibility index ----------------
+# 1 query lấy (course.id, course_content_id) của các course is_visible=True, giữ trong registry
+# (kind "visibility"). Signal save/delete của Course gọi refresh_visibility_index() để đổi
+# generation -> mọi worker nạp lại ở lần đọc sau.
+# Trả (course_ids, content_ids): 2 mảng int64 đã sort, dùng cho np.isin / searchsorted.
+def _load_visibility_index() -> Tuple[np.ndarray, np.ndarray]:
+    rows = list(Course.objects.filter(is_visible=True).values_list("id", "course_content_id"))
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    arr = np.asarray(rows, dtype=np.int64)
+    return np.sort(arr[:, 0]), np.sort(arr[:, 1])
+
+def _visibility_index() -> Tuple[np.ndarray, np.ndarray]:
+    return get_artifact("visibility", "index", _load_visibility_index, ARTIFACT_DIR)
+
+# Đổi generation của visibility index (gọi khi Course thay đổi is_visible / bị xoá)
+def refresh_visibility_index() -> str:
+    return publish_generation("visibility", ARTIFACT_DIR)
+
+# course_content_id của các course đang hiển thị (mảng int64 đã sort)
+def visible_content_ids() -> np.ndarray:
+    return _visibility_index()[1]
+
+# Mask bool (N,) thẳng hàng với TF-IDF row map: mask[row] = course ở hàng đó đang hiển thị.
+# inv_row_map: course_id theo hàng (-1 = hàng trống), xem cb.tfidf_builder.load_tfidf_inv_row_map.
+# Cache 1 slot trong bundle "visibility": (generation "cb", mask), thay khi row map đổi generation
+# (không giữ mask của các generation cũ).
+def visible_row_mask(inv_row_map: np.ndarray) -> np.ndarray:
+    def _build() -> np.ndarray:
+        return (inv_row_map >= 0) & np.isin(inv_row_map, visible_content_ids())
+
+    slot = get_artifact("visibility", "row_mask", lambda: [None], ARTIFACT_DIR)
+    cb_gen = current_generation("cb", ARTIFACT_DIR)
+    entry = slot[0]
+    if entry is None or entry[0] != cb_gen or entry[1].shape[0] != inv_row_map.shape[0]:
+        # generation đổi (hoặc row map vừa đổi nhưng stamp chưa kịp đọc lại) -> tính lại, thay slot
+        entry = (cb_gen, _build())
+        slot[0] = entry
+    return entry[1]
+
+# Lọc danh sách course_content_id, chỉ giữ course đang hiển thị (giữ thứ tự)
+def filter_visible(course_ids: Iterable[int]) -> List[int]:
+    ids = np.fromiter((int(c) for c in course_ids), dtype=np.int64)
+    if ids.size == 0:
+        return []
+    return ids[np.isin(ids, visible_content_ids())].tolist()
+
 # Lấy danh sách course_id ứng viên để gợi ý
 def visible_candidates(exclude_ids: Optional[set[int]] = None) -> List[int]:
-    course_contents = fetch_courses_with_categories()
-    ids = []
-    for cc in course_contents:
-        if exclude_ids and cc['id'] in exclude_ids:
-            continue
-        if Course.objects.filter(id=cc['id'], is_visible=False).exists():
-            continue
-        ids.append(cc['id'])
-    return ids
-
-# Lấy danh sách course_id phổ biến nhất (dựa trên tổng số enroll + favorite)
+    ids = visible_content_ids()
+    if exclude_ids:
+        ids = ids[~np.isin(ids, np.fromiter((int(c) for c in exclude_ids), dtype=np.int64))]
+    return ids.tolist()
+
+# Lấy danh sách course_id phổ biến nhất (bảng xếp hạng materialized trong cache, xem data_access.popularity)
 def fetch_popular_course_ids(limit: int = 100) -> list[int]:
-    courses = (
-        Course.objects.select_related("course_content")
-        .filter(is_visible=True)
-        .annotate(
-            num_students=Count("enrollments", distinct=True),
-            num_favorites=Count("favorites", distinct=True),
-        )
-        .order_by("-num_students", "-num_favorites")
-        .values_list("id", flat=True)
-    )
-    if limit > 0:
-        courses = courses[:limit]
+    from api.services.reco_service.data_access.popularity import popular_course_ids
 
     result: List[Tuple] = []
-    for cid in courses:
+    for cid, _score in popular_course_ids(limit=limit):
         result.append((cid, 1.0))  # popular courses có score = 1.0
 
     return result
 
-# Lấy tất cả course_id đang is_visible=True
+# Lấy tất cả course_id đang is_visible=True (từ visibility index, không query mỗi lần gọi)
 def list_visible_course_ids() -> list[int]:
-    courses = (
-        Course.objects.select_related("course_content")
-        .filter(is_visible=True)
-        .values_list("id", flat=True)
-    )
-    return list(courses)
+    return _visibility_index()[0].tolist()
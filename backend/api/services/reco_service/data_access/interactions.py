@@ -1,56 +1,180 @@
 from __future__ import annotations
-from typing import Dict, List, Tuple, Literal
-from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, List, Optional, Sequence, Tuple, Literal
+from datetime import datetime, timedelta, timezone
+import numpy as np
 from django.db import connection
-from api.models import Enrollment, Favorite
+from django.db.models import F, IntegerField, Value
+from django.utils.dateparse import parse_datetime
+from api.models import Enrollment, Favorite, User
+from api.services.reco_service.config import INTERACTION_CHUNK_ROWS
 
 EventType = Literal["enroll", "favorite"]
 
+# Mã hoá loại sự kiện trong các mảng numpy (int8)
+EVENT_CODES: Dict[str, int] = {"enroll": 0, "favorite": 1}
+EVENT_TYPES: Tuple[EventType, ...] = ("enroll", "favorite")
+
 def _utc_now() -> datetime:
     return datetime.now(timezone.utc)
 
-# Lấy các sự kiện (enroll, favorite) của user 
-def fetch_user_events(user_id: str, limit: int = 50) -> List[Dict]:
-    enrollments = Enrollment.objects.filter(student_id=user_id)
-    favorites = Favorite.objects.filter(student_id=user_id)
+# Queryset UNION ALL enrollments + favorites (join sang courses để lấy course_content_id)
+# -> (uid, cid, ev, ts) = (student_id, course_id, event_code, created_at), 1 câu SQL duy nhất.
+# user_ids: chỉ lấy sự kiện của các user này (None = tất cả); since: chỉ lấy created_at > since;
+# until: chỉ lấy created_at <= until
+def _interactions_union_qs(
+    user_ids: Optional[Sequence[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    fields = ("uid", "cid", "ev", "ts")
+
+    def _events(model, ev_type: str):
+        qs = model.objects.all()
+        if user_ids is not None:
+            qs = qs.filter(student_id__in=list(user_ids))
+        if since is not None:
+            qs = qs.filter(created_at__gt=since)
+        if until is not None:
+            qs = qs.filter(created_at__lte=until)
+        return qs.annotate(
+            uid=F("student_id"),
+            cid=F("course__course_content_id"),
+            ev=Value(EVENT_CODES[ev_type], output_field=IntegerField()),
+            ts=F("created_at"),
+        ).values_list(*fields)
+
+    return _events(Enrollment, "enroll").union(_events(Favorite, "favorite"), all=True)
+
+# datetime (hoặc chuỗi ISO từ raw cursor) -> epoch seconds (naive coi như UTC)
+def _epoch(ts) -> float:
+    if isinstance(ts, str):
+        ts = parse_datetime(ts)
+    if not isinstance(ts, datetime):
+        return np.nan
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+# Chuẩn hoá user id (UUID / hex / str) -> str dạng có gạch nối như trong artifacts CF
+def _uid_key(v) -> str:
+    return str(User._meta.pk.to_python(v))
+
+# Lấy sự kiện (enroll, favorite) của nhiều user bằng 1 query:
+# UNION ALL + ROW_NUMBER() OVER (PARTITION BY user ORDER BY created_at DESC) để giữ `limit` sự kiện mới nhất mỗi user.
+# since (epoch giây): chỉ lấy sự kiện mới hơn mốc này (vd. overlay sự kiện sau lần build CF).
+# Trả mảng (đã sort theo user, trong mỗi user theo thời gian giảm dần):
+#   user_pos (int32, vị trí trong user_ids), course_ids (int64), event_codes (int8), days_ago (float64)
+def fetch_events_for_users(
+    user_ids: Sequence[str],
+    limit: Optional[int] = 50,
+    since: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    empty = (
+        np.empty(0, dtype=np.int32),
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.int8),
+        np.empty(0, dtype=np.float64),
+    )
+    pos: Dict[str, int] = {}
+    for i, u in enumerate(user_ids):
+        if u:
+            pos.setdefault(_uid_key(u), i)  # user trùng -> vị trí xuất hiện đầu tiên
+    if not pos:
+        return empty
+
+    since_dt = datetime.fromtimestamp(since, tz=timezone.utc) if since is not None else None
+    inner, params = _interactions_union_qs(list(pos.keys()), since_dt).query.sql_with_params()
+    sql = (
+        "SELECT uid, cid, ev, ts FROM ("
+        " SELECT e.uid, e.cid, e.ev, e.ts,"
+        " ROW_NUMBER() OVER (PARTITION BY e.uid ORDER BY e.ts DESC) AS rn"
+        f" FROM ({inner}) e"
+        ") t"
+    )
+    params = list(params)
+    if limit is not None and limit > 0:
+        sql += " WHERE rn <= %s"
+        params.append(int(limit))
+    sql += " ORDER BY uid, rn"
+
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    if not rows:
+        return empty
 
-    rows = []
-    for e in enrollments:
-        rows.append((e.course.course_content.id, 'enroll', e.created_at))
+    u, c, e, t = zip(*rows)
+    n = len(rows)
+    user_pos = np.fromiter((pos[_uid_key(x)] for x in u), dtype=np.int32, count=n)
+    course_ids = np.fromiter(c, dtype=np.int64, count=n)
+    codes = np.fromiter(e, dtype=np.int8, count=n)
+    ts = np.fromiter((_epoch(x) for x in t), dtype=np.float64, count=n)
+    days_ago = np.nan_to_num(np.maximum(0.0, (_utc_now().timestamp() - ts) / 86400.0), nan=0.0)
 
-    for f in favorites:
-        rows.append((f.course.course_content.id, 'favorite', f.created_at))
+    # sort lại theo thứ tự user_ids (ổn định -> giữ thứ tự thời gian trong từng user)
+    order = np.argsort(user_pos, kind="stable")
+    return user_pos[order], course_ids[order], codes[order], days_ago[order]
 
+# user_id của mọi user có ít nhất 1 enroll / favorite (job offline: warm cache, email digest)
+def fetch_active_user_ids() -> List[str]:
+    ids = Enrollment.objects.values_list("student_id", flat=True).union(
+        Favorite.objects.values_list("student_id", flat=True)
+    )
+    return sorted(_uid_key(u) for u in ids)
+
+# Lấy các sự kiện (enroll, favorite) của user (tối đa `limit` sự kiện mới nhất)
+def fetch_user_events(user_id: str, limit: int = 50) -> List[Dict]:
+    _, course_ids, codes, days_ago = fetch_events_for_users([user_id], limit=limit)
     now = _utc_now()
     out: List[Dict] = []
-    for course_id, ev_type, ts in rows:
-        # ts có thể là naive hoặc aware; chuẩn hóa về aware UTC nếu cần
-        if isinstance(ts, datetime) and ts.tzinfo is None:
-            ts = ts.replace(tzinfo=timezone.utc)
-        delta_days = (now - ts).total_seconds() / 86400.0 if isinstance(ts, datetime) else 0.0
+    for course_id, ev, d in zip(course_ids.tolist(), codes.tolist(), days_ago.tolist()):
         out.append({
             "course_id": int(course_id),
-            "type": ev_type,
-            "timestamp": ts,
-            "days_ago": float(max(0.0, delta_days)),
+            "type": EVENT_TYPES[ev],
+            "timestamp": now - timedelta(days=d),
+            "days_ago": float(d),
         })
     return out
 
-# Lấy toàn bộ interactions để build CF ma trận R
-def fetch_all_interactions() -> List[Tuple[str, int, EventType, datetime]]:
-    enrollments = Enrollment.objects.all()
-    favorites = Favorite.objects.all()
-
-    rows = []
-    for e in enrollments:
-        rows.append((e.student.id, e.course.course_content.id, 'enroll', e.created_at))
+# Bulk loader cho CF: đọc toàn bộ interactions bằng 1 query, stream theo chunk (server-side cursor
+# trên PostgreSQL) và đổ thẳng vào mảng numpy.
+# since / until (epoch giây): chỉ lấy sự kiện trong (since, until] (vd. cập nhật CF incremental).
+# Trả (student_ids (object), course_ids (int64), event_codes (int8), ts_epoch (float64, giây)).
+def fetch_interaction_arrays(
+    chunk_size: int = INTERACTION_CHUNK_ROWS,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    since_dt = datetime.fromtimestamp(since, tz=timezone.utc) if since is not None else None
+    until_dt = datetime.fromtimestamp(until, tz=timezone.utc) if until is not None else None
+    it = _interactions_union_qs(since=since_dt, until=until_dt).iterator(chunk_size=chunk_size)
+    users, courses, codes, ts = [], [], [], []
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            break
+        u, c, e, t = zip(*chunk)
+        n = len(chunk)
+        users.append(np.array(u, dtype=object))
+        courses.append(np.fromiter(c, dtype=np.int64, count=n))
+        codes.append(np.fromiter(e, dtype=np.int8, count=n))
+        ts.append(np.fromiter((_epoch(x) for x in t), dtype=np.float64, count=n))
 
-    for f in favorites:
-        rows.append((f.student.id, f.course.course_content.id, 'favorite', f.created_at))
+    if not users:
+        return (
+            np.empty(0, dtype=object),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int8),
+            np.empty(0, dtype=np.float64),
+        )
+    return np.concatenate(users), np.concatenate(courses), np.concatenate(codes), np.concatenate(ts)
 
+# Lấy toàn bộ interactions để build CF ma trận R
+def fetch_all_interactions() -> List[Tuple[str, int, EventType, datetime]]:
     out: List[Tuple[str, int, EventType, datetime]] = []
-    for student_id, course_id, ev_type, ts in rows:
+    for student_id, course_id, ev, ts in _interactions_union_qs().iterator(chunk_size=INTERACTION_CHUNK_ROWS):
         if isinstance(ts, datetime) and ts.tzinfo is None:
             ts = ts.replace(tzinfo=timezone.utc)
-        out.append((str(student_id), int(course_id), ev_type, ts))
+        out.append((str(student_id), int(course_id), EVENT_TYPES[ev], ts))
     return out
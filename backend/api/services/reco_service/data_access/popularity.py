@@ -0,0 +1,180 @@
+from __future__ import annotations
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+from api.models import Enrollment, Favorite
+from api.services.shared_cache import get_or_compute, put
+from api.services.reco_service.cf.weighting import base_weight, event_weights
+from api.services.reco_service.data_access.courses import list_visible_course_ids
+from api.services.reco_service.data_access.interactions import EVENT_CODES
+from api.services.reco_service.config import (
+    POPULARITY_WINDOWS,
+    POPULARITY_TAU_DAYS,
+    POPULARITY_CACHE_TTL,
+)
+
+"""
+Bảng xếp hạng course phổ biến (materialized) cho guest / fallback:
+- Đếm enroll + favorite trong các cửa sổ POPULARITY_WINDOWS (7/30/90 ngày).
+- Điểm = tổng base_weight(type) * time_decay(days_ago, POPULARITY_TAU_DAYS) trong cửa sổ lớn nhất.
+- Thứ hạng: điểm giảm dần, rồi tổng enroll, tổng favorite (toàn thời gian).
+- Lưu trong cache dùng chung (key POPULAR_KEY, định dạng của services/shared_cache): request chỉ đọc
+  1 key, không aggregate DB. Cache trống / hết hạn -> get_or_compute single-flight: chỉ 1 tiến trình
+  chạy build_popularity(), các request khác trả bản cũ hoặc chờ kết quả của nó.
+- Làm mới toàn bộ bởi Celery beat (refresh_popularity_task), cộng dồn tăng dần khi có enroll/favorite mới.
+  Mọi lần ghi key (cộng dồn / refresh) giữ lock POPULAR_LOCK_KEY (cache.add) -> 2 worker cộng dồn
+  cùng lúc không làm mất sự kiện, refresh không bị ghi đè bởi state cũ.
+
+State (dict):
+    course_ids (int64, đã xếp hạng), scores (float64), enrolls / favorites (int64, toàn thời gian),
+    windows {days: counts int64}, built_at (epoch giây)
+"""
+
+POPULAR_KEY = "reco:popular"
+POPULAR_LOCK_KEY = "reco:popular:lock"
+LOCK_TIMEOUT = 10  # giây; lock tự hết hạn nếu tiến trình giữ lock bị chết
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.02
+
+# Lock ngắn quanh thao tác đọc-sửa-ghi POPULAR_KEY (cache.add = set-if-absent)
+@contextmanager
+def _state_lock():
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(POPULAR_LOCK_KEY, token, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise TimeoutError("popularity lock busy")
+        time.sleep(LOCK_POLL)
+    try:
+        yield
+    finally:
+        if cache.get(POPULAR_LOCK_KEY) == token:
+            cache.delete(POPULAR_LOCK_KEY)
+
+# Sắp xếp lại state theo thứ hạng (điểm, enroll, favorite giảm dần)
+def _rank(state: Dict) -> Dict:
+    order = np.lexsort((-state["favorites"], -state["enrolls"], -state["scores"]))
+    out = dict(state)
+    for name in ("course_ids", "scores", "enrolls", "favorites"):
+        out[name] = state[name][order]
+    out["windows"] = {d: c[order] for d, c in state["windows"].items()}
+    return out
+
+# Đếm theo course (toàn thời gian) bằng 1 query GROUP BY
+def _count_by_course(model) -> Dict[int, int]:
+    return dict(model.objects.values("course_id").annotate(n=Count("id")).values_list("course_id", "n"))
+
+# Tính bảng xếp hạng từ DB (4 query: 2 GROUP BY toàn thời gian + 2 lấy sự kiện trong cửa sổ lớn nhất)
+def build_popularity() -> Dict:
+    now = timezone.now()
+    max_days = max(POPULARITY_WINDOWS)
+    since = now - timedelta(days=max_days)
+
+    course_ids = np.asarray(list_visible_course_ids(), dtype=np.int64)
+    pos = {int(c): i for i, c in enumerate(course_ids.tolist())}
+    n = course_ids.size
+
+    enrolls = np.zeros(n, dtype=np.int64)
+    favorites = np.zeros(n, dtype=np.int64)
+    for counts, model in ((enrolls, Enrollment), (favorites, Favorite)):
+        for cid, cnt in _count_by_course(model).items():
+            i = pos.get(int(cid))
+            if i is not None:
+                counts[i] = cnt
+
+    # sự kiện trong cửa sổ lớn nhất: (vị trí course, mã sự kiện, số ngày)
+    rows: List[Tuple[int, int, float]] = []
+    for model, ev_type in ((Enrollment, "enroll"), (Favorite, "favorite")):
+        for cid, ts in model.objects.filter(created_at__gte=since).values_list("course_id", "created_at"):
+            i = pos.get(int(cid))
+            if i is not None:
+                rows.append((i, EVENT_CODES[ev_type], (now - ts).total_seconds() / 86400.0))
+
+    scores = np.zeros(n, dtype=np.float64)
+    windows = {int(d): np.zeros(n, dtype=np.int64) for d in POPULARITY_WINDOWS}
+    if rows:
+        idx, codes, days = (np.asarray(x) for x in zip(*rows))
+        np.add.at(scores, idx, event_weights(codes, days, tau_days=POPULARITY_TAU_DAYS))
+        for d, counts in windows.items():
+            np.add.at(counts, idx[days <= d], 1)
+
+    return _rank({
+        "course_ids": course_ids,
+        "scores": scores,
+        "enrolls": enrolls,
+        "favorites": favorites,
+        "windows": windows,
+        "built_at": time.time(),
+    })
+
+# Tính lại và ghi vào cache (dùng cho Celery beat). Trả tóm tắt.
+def refresh_popularity() -> Dict:
+    start = time.time()
+    state = build_popularity()
+    with _state_lock():
+        put(POPULAR_KEY, state, POPULARITY_CACHE_TTL, delta=time.time() - start)
+    return {"courses": int(state["course_ids"].size), "built_at": state["built_at"]}
+
+# State hiện tại từ cache; cache trống / hết hạn -> chỉ 1 tiến trình tính lại (single-flight).
+# Không làm mới sớm (beta=0): beat đã refresh trước khi hết hạn.
+def get_popularity() -> Dict:
+    state, _status = get_or_compute(POPULAR_KEY, build_popularity, POPULARITY_CACHE_TTL, beta=0.0)
+    return state
+
+# Cộng dồn 1 sự kiện mới (enroll/favorite) vào bảng xếp hạng trong cache, không query DB.
+# Cache trống / đã hết hạn -> bỏ qua (lần đọc sau sẽ tính lại đầy đủ). Lock bận quá LOCK_WAIT -> TimeoutError.
+def record_popularity_event(course_id: int, ev_type: str) -> bool:
+    with _state_lock():
+        entry = cache.get(POPULAR_KEY)
+        if not (isinstance(entry, tuple) and len(entry) == 3):
+            return False
+        state, delta, expires_at = entry
+        ttl = int(expires_at - time.time())
+        if ttl <= 0:
+            return False
+        state = _add_event(state, int(course_id), ev_type)
+        put(POPULAR_KEY, state, ttl, delta=delta)  # giữ nguyên hạn của state gốc
+    return True
+
+# State mới (đã xếp hạng lại) sau khi cộng 1 sự kiện của course_id
+def _add_event(state: Dict, course_id: int, ev_type: str) -> Dict:
+    w = base_weight(ev_type)
+    hits = np.flatnonzero(state["course_ids"] == course_id)
+    if hits.size == 0:
+        # course chưa có trong bảng (vd. mới hiển thị) -> thêm vào cuối
+        state = dict(state)
+        state["course_ids"] = np.append(state["course_ids"], course_id)
+        for name in ("scores", "enrolls", "favorites"):
+            state[name] = np.append(state[name], 0)
+        state["windows"] = {d: np.append(c, 0) for d, c in state["windows"].items()}
+        i = state["course_ids"].size - 1
+    else:
+        i = int(hits[0])
+    state["scores"][i] += w
+    state["enrolls" if ev_type == "enroll" else "favorites"][i] += 1
+    for counts in state["windows"].values():
+        counts[i] += 1
+    return _rank(state)
+
+# Top course phổ biến (đang hiển thị): [(course_id, score), ...]; limit <= 0 -> toàn bộ.
+# window (ngày): xếp hạng theo số sự kiện trong cửa sổ đó thay vì điểm time-decay.
+def popular_course_ids(limit: int = 100, window: Optional[int] = None) -> List[Tuple[int, float]]:
+    state = get_popularity()
+    course_ids, scores = state["course_ids"], state["scores"]
+    if window is not None and int(window) in state["windows"]:
+        counts = state["windows"][int(window)]
+        order = np.lexsort((-scores, -counts))
+        course_ids, scores = course_ids[order], counts[order].astype(np.float64)
+
+    # course bị ẩn sau lần build gần nhất
+    keep = np.isin(course_ids, np.asarray(list_visible_course_ids(), dtype=np.int64))
+    course_ids, scores = course_ids[keep], scores[keep]
+    if limit > 0:
+        course_ids, scores = course_ids[:limit], scores[:limit]
+    return list(zip(course_ids.tolist(), scores.tolist()))
@@ -0,0 +1,306 @@
+from __future__ import annotations
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from scipy import sparse
+from api.services.reco_service.cb.tfidf_builder import load_tfidf, load_tfidf_inv_row_map
+from api.services.reco_service.cb.user_profile import user_profiles_from_events
+from api.services.reco_service.cb.similarity import user_course_scores
+from api.services.reco_service.cf.neighbors import get_neighbor_store
+from api.services.reco_service.cf.item_item import get_item_item_matrix, user_weight_rows, item_item_topn
+from api.services.reco_service.cf.scoring import get_user_item_matrix
+from api.services.reco_service.data_access.interactions import fetch_events_for_users, fetch_active_user_ids
+from api.services.reco_service.data_access.courses import visible_content_ids, visible_row_mask
+from api.services.reco_service.data_access.popularity import popular_course_ids
+from api.services.reco_service.hybrid.candidates import cf_neighbor_items_candidates
+from api.services.reco_service.hybrid.service import HOME_CACHE_GENERATIONS, home_cache_params
+from api.services.reco_service.io.cache import key_home, prime_result
+from api.services.reco_service.config import (
+    ALPHA_HOME,
+    CB_USER_MAX_ITEMS,
+    CB_PROFILE_MAX_EVENTS,
+    CF_K_NEIGHBORS,
+    CF_K_ITEM_PER_NEIGHBOR,
+    CF_ENGINE,
+    CF_ITEM_TOP_N,
+    HOME_BATCH_CHUNK_USERS,
+    MIN_SIM_CB,
+    TTL_USER_HOME_WARM,
+)
+
+"""
+Hybrid Home theo lô (job offline: email digest, warm cache sau khi rebuild artifacts).
+Cùng logic với hybrid_recommend_home nhưng chấm điểm cả chunk user một lần:
+- 1 query sự kiện / chunk (fetch_events_for_users): dùng cho profile CB và tập seen.
+- CB: P (chunk × d) = normalize(W @ X) (1 phép nhân sparse), S = P @ X.T (chunk × N)
+  (CB_ENGINE = "dense": S = 1 GEMM trên embedding, xem cb/embedding.py)
+  -> top CB_USER_MAX_ITEMS mỗi hàng bằng argpartition 2-D, bỏ course ẩn / sim < MIN_SIM_CB.
+- CF: láng giềng từ neighbor store + R trong RAM, chọn item theo thứ tự láng giềng như
+  cf_neighbor_items_candidates (vectorized).
+  CF_ENGINE = "item": W (chunk × I) @ S item-item, top CF_ITEM_TOP_N mỗi hàng (như item_item_candidates).
+- Trục item chung = course hiển thị ∪ popular; blend alpha * CB + (1 - alpha) * CF, seen -> 0,
+  top-K mỗi user bằng argpartition 2-D rồi sort phần đã chọn, cùng thứ tự với đường đơn lẻ
+  (hybrid.service.rank_home; cùng điểm: ứng viên CB/CF trước, rồi thứ hạng phổ biến, rồi course_id).
+
+Public:
+- hybrid_recommend_many(user_ids, k=None, alpha=ALPHA_HOME) -> {user_id: [{"course_id", "score"}, ...]}
+- warm_home_cache(user_ids=None, alpha=ALPHA_HOME) -> stats (ghi sẵn cache Home, cùng key với API)
+"""
+
+ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
+
+# Vị trí của từng id trong trục item (mảng đã sort), -1 nếu không có
+def _axis_positions(axis: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    ids = np.asarray(ids, dtype=np.int64)
+    if axis.size == 0:
+        return np.full(ids.shape, -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(axis, ids), axis.size - 1)
+    return np.where(axis[pos] == ids, pos, -1)
+
+# Chỉ số top-k mỗi hàng của ma trận dense (chưa sort trong hàng)
+def _topk_2d(S: np.ndarray, k: int) -> np.ndarray:
+    k = max(0, min(int(k), S.shape[1]))
+    if k == 0:
+        return np.empty((S.shape[0], 0), dtype=np.int64)
+    if k == S.shape[1]:
+        return np.tile(np.arange(k), (S.shape[0], 1))
+    return np.argpartition(-S, k - 1, axis=1)[:, :k]
+
+class _BatchContext:
+    """
+    Artifacts dùng chung cho mọi chunk của 1 lần gọi (nạp 1 lần từ registry).
+    """
+
+    def __init__(self):
+        _, self.X, _ = load_tfidf()
+        self.XT = self.X.T.tocsr()
+        inv = load_tfidf_inv_row_map()
+        mask = visible_row_mask(inv)
+        self.row_visible = mask if mask.shape[0] == self.X.shape[0] else None
+
+        pop = popular_course_ids(limit=-1)
+        pop_ids = np.asarray([cid for cid, _ in pop], dtype=np.int64)
+        self.axis = np.union1d(visible_content_ids(), pop_ids)
+        self.row_pos = _axis_positions(self.axis, inv)
+        self.is_pop = np.zeros(self.axis.size, dtype=bool)
+        self.pop_rank = np.full(self.axis.size, pop_ids.size, dtype=np.int64)
+        pp = _axis_positions(self.axis, pop_ids)
+        self.is_pop[pp] = True
+        self.pop_rank[pp] = np.arange(pop_ids.size)
+
+        # CF item-item: S + vị trí course của S trên trục item, mask course đang hiển thị
+        self.IM = get_item_item_matrix(ARTIFACT_DIR) if CF_ENGINE == "item" else None
+        if self.IM is not None:
+            self.im_pos = _axis_positions(self.axis, self.IM.item_ids)
+            self.im_allowed = np.isin(self.IM.item_ids, visible_content_ids())
+
+        # CF: R + ánh xạ hàng neighbor store -> hàng R
+        self.store = get_neighbor_store(ARTIFACT_DIR)
+        self.M = get_user_item_matrix(ARTIFACT_DIR)
+        self.R = None
+        if self.store is not None and self.M is not None:
+            self.R = self.M.R.tocsr()
+            self.store_rows = np.fromiter(
+                (self.M.row(u) for u in self.store.uids.tolist()), dtype=np.int64, count=len(self.store)
+            )
+            self.col_pos = _axis_positions(self.axis, self.M.item_ids)
+            self.col_pos[~np.isin(self.M.item_ids, visible_content_ids())] = -1
+
+# CB: (điểm, có ứng viên) trên trục item cho 1 chunk, từ profile P (chunk × d)
+def _cb_scores(ctx: _BatchContext, P: sparse.csr_matrix, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    scores = np.zeros((n, ctx.axis.size), dtype=np.float64)
+    has = np.zeros((n, ctx.axis.size), dtype=bool)
+    if ctx.X.shape[0] == 0:
+        return scores, has
+
+    S = user_course_scores(P, ctx.X, ctx.XT)  # (chunk × N) cosine
+    if ctx.row_visible is not None:
+        S[:, ~ctx.row_visible] = -np.inf  # bỏ course ẩn trước khi chọn top
+    idx = _topk_2d(S, CB_USER_MAX_ITEMS)
+    vals = np.take_along_axis(S, idx, axis=1).ravel()
+    rows = np.repeat(np.arange(n), idx.shape[1])
+    idx = idx.ravel()
+
+    has_profile = np.diff(P.indptr) > 0
+    ok = has_profile[rows] & (ctx.row_pos[idx] >= 0) & (vals >= MIN_SIM_CB)
+    scores[rows[ok], ctx.row_pos[idx[ok]]] = vals[ok]
+    has[rows[ok], ctx.row_pos[idx[ok]]] = True
+    return scores, has
+
+# CF: (điểm, có ứng viên) trên trục item cho 1 chunk.
+# Mỗi user: duyệt láng giềng theo sim giảm dần, item của láng giềng theo trọng số giảm dần,
+# item đã chọn bởi láng giềng trước bị bỏ qua, tối đa CF_K_NEIGHBORS * CF_K_ITEM_PER_NEIGHBOR item.
+def _cf_scores(ctx: _BatchContext, user_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(user_ids)
+    scores = np.zeros((n, ctx.axis.size), dtype=np.float64)
+    has = np.zeros((n, ctx.axis.size), dtype=bool)
+    if CF_ENGINE == "item":
+        if ctx.IM is not None and len(ctx.IM):
+            W = user_weight_rows(ctx.IM, user_ids, ARTIFACT_DIR)
+            rows, pos, vals = item_item_topn(ctx.IM, W, CF_ITEM_TOP_N, ctx.im_allowed)
+            scores[rows, ctx.im_pos[pos]] = vals
+            has[rows, ctx.im_pos[pos]] = True
+        return scores, has
+    if ctx.store is None:
+        return scores, has
+    if ctx.R is None:
+        # chưa có R -> từng user qua DB (giống đường đơn lẻ)
+        for p, uid in enumerate(user_ids):
+            cands = cf_neighbor_items_candidates(uid, artifact_dir=ARTIFACT_DIR)
+            pos = _axis_positions(ctx.axis, np.fromiter(cands.keys(), dtype=np.int64, count=len(cands)))
+            ok = pos >= 0
+            scores[p, pos[ok]] = np.fromiter(cands.values(), dtype=np.float64, count=len(cands))[ok]
+            has[p, pos[ok]] = True
+        return scores, has
+
+    # (user, thứ hạng láng giềng, hàng R của láng giềng)
+    us, ranks, rrows = [], [], []
+    for p, uid in enumerate(user_ids):
+        idx, _sims = ctx.store.neighbor_arrays(uid, CF_K_NEIGHBORS)
+        if len(idx) == 0:
+            continue
+        us.append(np.full(len(idx), p, dtype=np.int64))
+        ranks.append(np.arange(len(idx), dtype=np.int64))
+        rrows.append(ctx.store_rows[np.asarray(idx, dtype=np.int64)])
+    if not us:
+        return scores, has
+    u, rank, rrow = np.concatenate(us), np.concatenate(ranks), np.concatenate(rrows)
+    ok = rrow >= 0
+    u, rank, rrow = u[ok], rank[ok], rrow[ok]
+
+    # trải item của từng láng giềng: (user, rank, cột, trọng số)
+    starts = ctx.R.indptr[rrow]
+    counts = ctx.R.indptr[rrow + 1] - starts
+    rep = np.repeat(np.arange(rrow.size), counts)
+    offs = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    nz = starts[rep] + offs
+    u, rank = u[rep], rank[rep]
+    cols, w = ctx.R.indices[nz], ctx.R.data[nz].astype(np.float64)
+
+    keep = (ctx.col_pos[cols] >= 0) & (w > 0.0)  # chỉ course đang hiển thị
+    u, rank, cols, w = u[keep], rank[keep], cols[keep], w[keep]
+    if u.size == 0:
+        return scores, has
+
+    # thứ tự chọn: user, láng giềng (sim giảm dần), trọng số giảm dần; giữ lần chọn đầu tiên của mỗi item
+    order = np.lexsort((-w, rank, u))
+    u, cols, w = u[order], cols[order], w[order]
+    _, first = np.unique(u * ctx.R.shape[1] + cols, return_index=True)
+    first.sort()
+    u, cols, w = u[first], cols[first], w[first]
+    picked = (np.arange(u.size) - np.searchsorted(u, u, side="left")) < CF_K_NEIGHBORS * CF_K_ITEM_PER_NEIGHBOR
+    u, cols, w = u[picked], cols[picked], w[picked]
+
+    scores[u, ctx.col_pos[cols]] = w
+    has[u, ctx.col_pos[cols]] = True
+    return scores, has
+
+# Top-k mỗi hàng theo thứ tự Home của hybrid.service.rank_home: điểm giảm dần, cùng điểm -> ứng viên
+# CB/CF trước, rồi thứ hạng phổ biến, rồi course_id tăng dần (trục item đã sort theo course_id).
+# Hàng có nhiều course cùng điểm ở biên top-k hơn số chỗ còn lại -> xếp cả hàng để chọn đúng.
+def _order_rows(ctx: _BatchContext, scores: np.ndarray, is_cand: np.ndarray, k: int) -> np.ndarray:
+    n_items = scores.shape[1]
+    k = max(0, min(int(k), n_items))
+    idx = _topk_2d(scores, k)
+    if 0 < k < n_items:
+        sel = np.take_along_axis(scores, idx, axis=1)
+        kth = sel.min(axis=1)[:, None]
+        ragged = np.isfinite(kth[:, 0]) & ((scores == kth).sum(axis=1) > (sel == kth).sum(axis=1))
+        all_items = np.arange(n_items)
+        for p in np.flatnonzero(ragged):
+            idx[p] = np.lexsort((all_items, ctx.pop_rank, ~is_cand[p], -scores[p]))[:k]
+    order = np.lexsort(
+        (idx, ctx.pop_rank[idx], ~np.take_along_axis(is_cand, idx, axis=1), -np.take_along_axis(scores, idx, axis=1)),
+        axis=1,
+    )
+    return np.take_along_axis(idx, order, axis=1)
+
+# Xếp hạng 1 chunk: blend, seen -> 0, top-k mỗi user
+def _rank_chunk(
+    ctx: _BatchContext,
+    user_ids: List[str],
+    k: Optional[int],
+    alpha: float,
+) -> Dict[str, List[dict]]:
+    n = len(user_ids)
+    user_pos, course_ids, codes, days_ago = fetch_events_for_users(user_ids, limit=100)
+
+    # profile CB: CB_PROFILE_MAX_EVENTS sự kiện mới nhất mỗi user (giống build_user_vector)
+    recent = (np.arange(user_pos.size) - np.searchsorted(user_pos, user_pos, side="left")) < CB_PROFILE_MAX_EVENTS
+    P = user_profiles_from_events(n, user_pos[recent], course_ids[recent], codes[recent], days_ago[recent])
+    cb, cb_has = _cb_scores(ctx, P, n)
+    cf, cf_has = _cf_scores(ctx, user_ids)
+
+    scores = alpha * cb + (1.0 - alpha) * cf
+    is_cand = cb_has | cf_has
+    included = is_cand | ctx.is_pop[None, :]
+
+    seen_pos = _axis_positions(ctx.axis, course_ids)
+    ok = seen_pos >= 0
+    scores[user_pos[ok], seen_pos[ok]] = 0.0
+    scores[~included] = -np.inf
+
+    idx = _order_rows(ctx, scores, is_cand, ctx.axis.size if k is None else k)
+    sel = np.take_along_axis(scores, idx, axis=1)
+
+    out: Dict[str, List[dict]] = {}
+    axis = ctx.axis.tolist()
+    for p, uid in enumerate(user_ids):
+        row_idx, row_sc = idx[p], sel[p]
+        fin = np.isfinite(row_sc)
+        out[uid] = [
+            {"course_id": axis[i], "score": s}
+            for i, s in zip(row_idx[fin].tolist(), row_sc[fin].tolist())
+        ]
+    return out
+
+def _chunks(user_ids: List[str], size: int):
+    size = max(1, int(size))
+    for start in range(0, len(user_ids), size):
+        yield user_ids[start:start + size]
+
+# Gợi ý Home cho nhiều user: {user_id: [{"course_id", "score"}, ...]} (k=None -> toàn bộ danh sách như API)
+def hybrid_recommend_many(
+    user_ids: Sequence[str],
+    k: Optional[int] = None,
+    alpha: float = ALPHA_HOME,
+    chunk_size: int = HOME_BATCH_CHUNK_USERS,
+) -> Dict[str, List[dict]]:
+    user_ids = list(dict.fromkeys(str(u) for u in user_ids if u))
+    if not user_ids:
+        return {}
+    alpha = float(max(0.0, min(1.0, alpha)))
+    ctx = _BatchContext()
+    out: Dict[str, List[dict]] = {}
+    for chunk in _chunks(user_ids, chunk_size):
+        out.update(_rank_chunk(ctx, chunk, k, alpha))
+    return out
+
+# Tính trước & ghi cache Home (cùng key với hybrid_recommend_home) cho user_ids
+# (None = mọi user có tương tác). TTL mặc định kéo tới lần warm kế tiếp (TTL_USER_HOME_WARM),
+# không phải TTL_USER_HOME của cache theo request. Trả thống kê.
+def warm_home_cache(
+    user_ids: Optional[Sequence[str]] = None,
+    alpha: float = ALPHA_HOME,
+    chunk_size: int = HOME_BATCH_CHUNK_USERS,
+    ttl: int = TTL_USER_HOME_WARM,
+) -> Dict[str, float]:
+    t0 = time.time()
+    if user_ids is None:
+        user_ids = fetch_active_user_ids()
+    user_ids = list(dict.fromkeys(str(u) for u in user_ids if u))
+    params = home_cache_params(alpha)
+    alpha = float(max(0.0, min(1.0, alpha)))
+
+    warmed, chunks = 0, 0
+    ctx = _BatchContext() if user_ids else None
+    for chunk in _chunks(user_ids, chunk_size):
+        start = time.time()
+        results = _rank_chunk(ctx, chunk, None, alpha)
+        per_user = (time.time() - start) / len(chunk)  # delta cho early refresh
+        for uid, recs in results.items():
+            prime_result(key_home(uid), params, recs, ttl, generations=HOME_CACHE_GENERATIONS, delta=per_user)
+        warmed += len(results)
+        chunks += 1
+    return {"users": warmed, "chunks": chunks, "seconds": round(time.time() - t0, 3)}
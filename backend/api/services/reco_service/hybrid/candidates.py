@@ -1,20 +1,25 @@
 from __future__ import annotations
 from typing import List, Set, Dict, Optional, Tuple
 import numpy as np
-from api.services.reco_service.cb.tfidf_builder import load_tfidf
+from api.services.reco_service.cb.tfidf_builder import load_tfidf, load_tfidf_inv_row_map
 from api.services.reco_service.cb.user_profile import build_user_vector
-from api.services.reco_service.cf.scoring import user_item_weights
-from api.services.reco_service.io.cf_store import load_user_neighbors_json
-from api.services.reco_service.data_access.courses import list_visible_course_ids
+from api.services.reco_service.cb.similarity import user_course_scores
+from api.services.reco_service.cf.scoring import neighbors_item_weights
+from api.services.reco_service.cf.neighbors import get_user_neighbors
+from api.services.reco_service.cf.item_item import item_item_candidates
+from api.services.reco_service.data_access.courses import filter_visible, visible_row_mask
+from api.services.reco_service.data_access.popularity import popular_course_ids
 from api.services.reco_service.config import (
     CF_K_NEIGHBORS,
     CB_USER_MAX_ITEMS,
     MIN_SIM_CB,
-    CF_K_ITEM_PER_NEIGHBOR
+    CF_K_ITEM_PER_NEIGHBOR,
+    CF_ENGINE,
 )
 
 """
 Ứng viên (candidates) cho Hybrid Recommender: Home (user đã đăng nhập) - union( CB-quick topM, CF-neighbor items )
+CF_ENGINE = "item": ứng viên CF lấy từ item-item (cf/item_item.py) thay cho item của láng giềng.
 """
 
 # Hỗ trợ đảo row_map {course_id: row_idx} -> inv[row_idx] = course_id
@@ -45,13 +50,16 @@ def _cb_quick_candidates(
     if u_vec is None or u_vec.nnz == 0:
         return {}
 
-    sims = (X @ u_vec.T).toarray().ravel()  # Tính cosine similarity giữa u_vec và tất cả các course -> (N,)
+    sims = user_course_scores(u_vec, X).ravel()  # Tính cosine similarity giữa u_vec và tất cả các course -> (N,)
+    inv = load_tfidf_inv_row_map()
+    mask = visible_row_mask(inv)
+    if mask.shape[0] == sims.shape[0]:
+        sims[~mask] = -np.inf  # bỏ course ẩn trước khi chọn top-n
     idx = _topk_indices(sims, topk)  # Lấy chỉ số top-n theo similarity
-    inv = _invert_row_map(row_map)
 
     out: Dict[int, float] = {}
     for r in idx.tolist():
-        if r < 0 or r >= len(inv) or inv[r] is None:
+        if r < 0 or r >= len(inv) or inv[r] < 0:
             continue
         cid = int(inv[r])
         if sims[r] < min_sim:
@@ -60,27 +68,29 @@ def _cb_quick_candidates(
     return out
 
 # CF: hợp item mà láng giềng đã tương tác
-def _cf_neighbor_items_candidates(
+def cf_neighbor_items_candidates(
     user_id: str,
     k_neighbors: int = CF_K_NEIGHBORS,
     top_items_per_neighbor: int = CF_K_ITEM_PER_NEIGHBOR,
     exclude_ids: Optional[Set[int]] = None,
     artifact_dir: str = "api/var/reco",
 ) -> Dict[int, float]:
-    all_neighbors = load_user_neighbors_json(artifact_dir)
-    neighs = all_neighbors.get(str(user_id), [])
+    neighs = get_user_neighbors(user_id, artifact_dir, k=k_neighbors)
     if not neighs:
         return {}
 
+    # Vector item của k láng giềng: lấy từ R trong RAM (không query DB).
+    # Lấy toàn bộ item của mỗi láng giềng; top_items_per_neighbor chỉ dùng cho tổng số ứng viên
+    neighs = neighs[:k_neighbors]
+    weights = neighbors_item_weights([v_uid for v_uid, _ in neighs], artifact_dir)
+
+    # chỉ giữ course đang hiển thị
+    visible = set(filter_visible({c for w in weights.values() for c in w}))
+
     res: Dict[int, float] = {}
     picked: Set[int] = set()
-    used = 0
     for v_uid, sim in neighs:
-        if used >= k_neighbors:
-            break
-        used += 1
-
-        w_vi = user_item_weights(v_uid, max_events=top_items_per_neighbor)
+        w_vi = {c: w for c, w in weights.get(v_uid, {}).items() if c in visible and w > 0.0}
         # chọn theo weight giảm dần
         k = k_neighbors * top_items_per_neighbor
         for cid, _w in sorted(w_vi.items(), key=lambda x: x[1], reverse=True):
@@ -100,9 +110,9 @@ def _cf_neighbor_items_candidates(
             break
     return res
 
-# Popular: lấy top-n course phổ biến nhất (theo enroll/fav trong 30-90d) - fallback
+# Popular: course đang hiển thị theo thứ hạng phổ biến (enroll/fav trong 7/30/90d, time-decay) - fallback
 def _popular_candidates() -> Dict[int, float]:
-    return {cid: 0.0 for cid in list_visible_course_ids()}
+    return {cid: 0.0 for cid, _score in popular_course_ids(limit=-1)}
 
 # Ứng viên cho trang Home (user đã đăng nhập)
 def build_candidates_for_home(
@@ -112,8 +122,11 @@ def build_candidates_for_home(
     # CB quick top-n
     cb_cands = _cb_quick_candidates(user_id)
 
-    # CF neighbor items
-    cf_cands = _cf_neighbor_items_candidates(user_id)
+    # CF: item của láng giềng (user-user) hoặc course giống course đã tương tác (item-item)
+    if CF_ENGINE == "item":
+        cf_cands = item_item_candidates(user_id)
+    else:
+        cf_cands = cf_neighbor_items_candidates(user_id)
 
     # Popular fallback
     pop_cands = _popular_candidates() if include_popular else {}
@@ -1,32 +1,66 @@
 from __future__ import annotations
-from typing import List
+from typing import Dict, Iterable, List, Sequence, Tuple
 from api.services.reco_service.hybrid.candidates import build_candidates_for_home
 from api.services.reco_service.hybrid.blend import blend_weighted
-from api.services.reco_service.data_access.interactions import fetch_user_events
-from api.services.reco_service.data_access.courses import fetch_popular_course_ids
-from api.services.reco_service.config import ALPHA_HOME
+from api.services.reco_service.data_access.interactions import fetch_events_for_users
+from api.services.reco_service.data_access.courses import fetch_popular_course_ids, filter_visible
+from api.services.reco_service.io.cache import cached_result, key_home
+from api.services.reco_service.config import ALPHA_HOME, TTL_USER_HOME
+
+# Cache Home: theo user + alpha, đổi key khi artifacts CB / CF / visibility đổi generation
+HOME_CACHE_GENERATIONS = ("cb", "cf", "visibility")
+
+def home_cache_params(alpha: float) -> dict:
+    return {"alpha": round(float(alpha), 4)}
+
+# Thứ tự Home, dùng chung với hybrid/batch.py (_rank_chunk): điểm giảm dần; cùng điểm -> ứng viên CB/CF
+# trước course chỉ đến từ popular, rồi theo thứ hạng phổ biến (course ngoài bảng xếp sau), rồi course_id tăng dần.
+def rank_home(
+    scores: Dict[int, float],
+    candidates: Iterable[int],
+    popular_ids: Sequence[int],
+) -> List[Tuple[int, float]]:
+    cand = set(candidates)
+    pop_rank = {cid: i for i, cid in enumerate(popular_ids)}
+    n_pop = len(pop_rank)
+    return sorted(
+        scores.items(),
+        key=lambda x: (-x[1], x[0] not in cand, pop_rank.get(x[0], n_pop), x[0]),
+    )
 
 def _get_course_seen_ids(user_id: str) -> List[int]:
-    seen = []
-    for ev in fetch_user_events(user_id, limit=100):
-        seen.append(int(ev.get("course_id")))
-    return seen
+    _, course_ids, _, _ = fetch_events_for_users([user_id], limit=100)
+    return course_ids.tolist()
 
 # Trả về danh sách đề xuất cho trang Home (người dùng đã đăng nhập).
 def hybrid_recommend_home(
     user_id: str,
     alpha: float = ALPHA_HOME,
+    use_cache: bool = True,
 ) -> List[dict]:
     """
     Hybrid cho trang Home (người dùng đã đăng nhập).
     - candidates = union(CF-neighbor items, CB-quick, Popular)
     - CB & CF scoring chỉ trên candidates
     - Blend (switch hoặc weighted)
+    - Kết quả được cache 2 tầng theo user + alpha + generation cb/cf/visibility (io/cache.py)
     """
     if not user_id:
-        course_ids = fetch_popular_course_ids(limit=-1)
-        return [{"course_id": cid, "score": 0.0} for cid in course_ids]
+        popular = fetch_popular_course_ids(limit=-1)
+        return [{"course_id": cid, "score": 0.0} for (cid, _score) in popular]
+
+    if not use_cache:
+        return _hybrid_recommend_home(user_id, alpha)
+    return cached_result(
+        "home",
+        key_home(user_id),
+        home_cache_params(alpha),
+        lambda: _hybrid_recommend_home(user_id, alpha),
+        TTL_USER_HOME,
+        generations=HOME_CACHE_GENERATIONS,
+    )
 
+def _hybrid_recommend_home(user_id: str, alpha: float) -> List[dict]:
     # Candidates - tuple(cb, cf, popular)
     candidates = build_candidates_for_home(user_id)
     if not candidates:
@@ -39,8 +73,10 @@ def hybrid_recommend_home(
     # Blend - Nếu một nhánh rỗng hoàn toàn, vẫn tiếp tục với nhánh còn lại
     scores_blend = blend_weighted(cb_cands, cf_cands, alpha=alpha)
 
-    # Kết hợp với popular candidates
-    combined_cands = set(scores_blend.keys()).union(set(pop_cands))
+    # Kết hợp với popular candidates (đã là course hiển thị, theo thứ hạng phổ biến);
+    # CB/CF chỉ giữ course đang hiển thị (lọc theo visibility index)
+    blend_cands = filter_visible(scores_blend.keys())
+    combined_cands = list(dict.fromkeys(blend_cands + list(pop_cands)))
 
     seen = _get_course_seen_ids(user_id)
     scores_combined = {}
@@ -48,5 +84,5 @@ def hybrid_recommend_home(
         # scores_combined[cid] = scores_blend.get(cid, 0.0) / 20 if cid in seen else scores_blend.get(cid, 0.0)
         scores_combined[cid] = 0.0 if cid in seen else scores_blend.get(cid, 0.0)
         
-    ranked = sorted(scores_combined.items(), key=lambda x: x[1], reverse=True)
+    ranked = rank_home(scores_combined, blend_cands, list(pop_cands))
     return [{"course_id": cid, "score": score} for (cid, score) in ranked]
@@ -1,6 +1,41 @@
 from __future__ import annotations
-from typing import Any
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
 from django.core.cache import cache
+from api.services.reco_service.config import (
+    RESULT_CACHE_LOCAL_MAX, RESULT_CACHE_LOCAL_TTL, RESULT_CACHE_VERSION_TTL
+)
+from api.services.reco_service.io.registry import current_generation
+from api.services.shared_cache import (
+    HIT, STALE, WAIT, MISS, REFRESH,
+    get_or_compute,
+    put,
+    get_version,
+    bump_version,
+)
+
+"""
+Cache kết quả gợi ý 2 tầng:
+- Tầng 1: LRU trong tiến trình (RESULT_CACHE_LOCAL_MAX phần tử, có TTL) -> không phải gọi Redis/unpickle.
+- Tầng 1 giữ tối đa RESULT_CACHE_LOCAL_TTL giây để early refresh ở tầng 2 có tác dụng.
+- Tầng 2: Django cache dùng chung giữa các worker (Redis), qua api.services.shared_cache:
+  single-flight khi tính lại + probabilistic early refresh.
+
+Key = <key_home|key_similar>:v<version>:<generation artifacts>:<hash params>
+- version: bộ đếm theo từng user/course, tăng khi cần huỷ chính xác (vd. user vừa enroll/favorite)
+  -> mọi biến thể params của user đó cùng hết hạn, không cần quét key.
+  Version được giữ trong tiến trình RESULT_CACHE_VERSION_TTL giây (như generation stamp với
+  REGISTRY_CHECK_INTERVAL): tiến trình tự huỷ thấy ngay, tiến trình khác thấy sau tối đa chừng đó.
+- generation: stamp của "cb"/"cf"/... (io/registry) -> rebuild CF/TF-IDF tự đổi key.
+- params: alpha, k, exclude... (json, sort_keys) -> md5.
+"""
+
+ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
 
 def cache_get(key: str) -> Any:
     return cache.get(key)
@@ -15,4 +50,134 @@ def key_similar(course_id: int) -> str:
     return f"reco:similar:{course_id}"
 
 def key_home(user_id: str) -> str:
-    return f"reco:home:{user_id}"
\ No newline at end of file
+    return f"reco:home:{user_id}"
+
+# ---------------- Tầng 1: LRU trong tiến trình ----------------
+class _LocalLRU:
+    def __init__(self, max_items: int):
+        self.max_items = max(0, int(max_items))
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+_local = _LocalLRU(RESULT_CACHE_LOCAL_MAX)
+# version theo base_key, giữ ngắn (RESULT_CACHE_VERSION_TTL) để không đọc Redis ở mọi request
+_versions = _LocalLRU(RESULT_CACHE_LOCAL_MAX)
+
+# ---------------- Bộ đếm hit/miss (theo tiến trình) ----------------
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+def _count(namespace: str, event: str) -> None:
+    with _stats_lock:
+        ns = _stats.setdefault(namespace, {
+            "local_hit": 0, "shared_hit": 0, "stale": 0, "miss": 0, "refresh": 0, "invalidate": 0,
+        })
+        ns[event] = ns.get(event, 0) + 1
+
+# {namespace: {local_hit, shared_hit, stale, miss, refresh, invalidate, hit_rate}}
+# stale: trả bản cũ trong lúc tiến trình khác tính lại; refresh: tính lại sớm (XFetch) hoặc sau hạn
+def cache_stats() -> Dict[str, Dict[str, float]]:
+    with _stats_lock:
+        out: Dict[str, Dict[str, float]] = {}
+        for ns, c in _stats.items():
+            hits = c["local_hit"] + c["shared_hit"] + c["stale"]
+            total = hits + c["miss"] + c["refresh"]
+            out[ns] = dict(c, hit_rate=hits / total if total else 0.0)
+        return out
+
+def reset_cache_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+# ---------------- Tầng 2 + key có version / generation / params ----------------
+# Huỷ mọi kết quả đã cache của base_key (mọi params / generation) bằng cách tăng version
+def invalidate_result(base_key: str, namespace: str = "result") -> None:
+    bump_version(base_key)
+    _versions.discard(base_key)
+    _count(namespace, "invalidate")
+
+def invalidate_home(user_id: str) -> None:
+    invalidate_result(key_home(str(user_id)), namespace="home")
+
+def invalidate_similar(course_id: int) -> None:
+    invalidate_result(key_similar(course_id), namespace="similar")
+
+# Version hiện tại của base_key (cache trong tiến trình, tối đa RESULT_CACHE_VERSION_TTL giây)
+def _result_version(base_key: str) -> int:
+    found, version = _versions.get(base_key)
+    if not found:
+        version = get_version(base_key)
+        _versions.set(base_key, version, RESULT_CACHE_VERSION_TTL)
+    return version
+
+def result_key(base_key: str, params: Optional[Dict[str, Any]] = None,
+               generations: Iterable[str] = ("cb", "cf")) -> str:
+    gen = ".".join(current_generation(kind, ARTIFACT_DIR) for kind in generations)
+    digest = hashlib.md5(
+        json.dumps(params or {}, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"{base_key}:v{_result_version(base_key)}:{gen}:{digest}"
+
+# trạng thái của shared_cache.get_or_compute -> bộ đếm
+_STATUS_EVENT = {HIT: "shared_hit", WAIT: "shared_hit", STALE: "stale", MISS: "miss", REFRESH: "refresh"}
+
+# Đọc kết quả qua 2 tầng; miss -> compute() (single-flight + early refresh ở tầng 2) rồi ghi vào tầng 1
+def cached_result(
+    namespace: str,
+    base_key: str,
+    params: Optional[Dict[str, Any]],
+    compute: Callable[[], Any],
+    ttl: int,
+    generations: Iterable[str] = ("cb", "cf"),
+) -> Any:
+    key = result_key(base_key, params, generations)
+
+    found, value = _local.get(key)
+    if found:
+        _count(namespace, "local_hit")
+        return value
+
+    value, status = get_or_compute(key, compute, ttl)
+    _count(namespace, _STATUS_EVENT[status])
+    _local.set(key, value, min(ttl, RESULT_CACHE_LOCAL_TTL))
+    return value
+
+# Ghi sẵn kết quả vào tầng 2 (job offline warm cache), cùng key mà cached_result sẽ đọc
+def prime_result(
+    base_key: str,
+    params: Optional[Dict[str, Any]],
+    value: Any,
+    ttl: int,
+    generations: Iterable[str] = ("cb", "cf"),
+    delta: float = 0.0,
+) -> None:
+    put(result_key(base_key, params, generations), value, ttl, delta)
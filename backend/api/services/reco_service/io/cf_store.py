@@ -2,25 +2,74 @@ from __future__ import annotations
 import os
 import json
 from typing import Dict, List, Tuple, Optional
+import numpy as np
 from scipy import sparse
+from api.services.reco_service.io.generations import (
+    new_generation_dir, current_dir, flip_current, prune_generations,
+)
+from api.services.reco_service.io.misc_store import save_npy_atomic
+from api.services.reco_service.config import ARTIFACT_KEEP_GENERATIONS, ARTIFACT_GENERATION_MIN_AGE
 
 def _pjoin(*xs) -> str: return os.path.join(*xs)
 
-# Lưu ma trận item-item S vào thư mục artifact_dir
+# ---------------- Ma trận item-item S (cf/item_item.py) ----------------
+#   cf_item_item_S.npz   : S (I × I) CSR float32, hàng c giữ top-M course giống c nhất
+#   cf_item_item_ids.npy : int64 (I,), course_id của hàng / cột S, đã sort tăng dần
+ITEM_ITEM_FILE = "cf_item_item_S.npz"
+ITEM_ITEM_IDS_FILE = "cf_item_item_ids.npy"
+
+class ItemItemMatrix:
+    """
+    S (course × course) + course_id theo hàng/cột (đã sort, tra cứu bằng searchsorted).
+    """
+
+    def __init__(self, S: "sparse.csr_matrix", item_ids: np.ndarray):
+        self.S = S
+        self.item_ids = item_ids
+
+    def __len__(self) -> int:
+        return int(self.item_ids.shape[0])
+
+    # Vị trí (hàng/cột S) của từng course_id, -1 nếu course không có trong S
+    def positions(self, course_ids) -> np.ndarray:
+        ids = np.asarray(course_ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.item_ids, ids), len(self) - 1)
+        return np.where(self.item_ids[pos] == ids, pos, -1)
+
+# Lưu ma trận item-item S vào thư mục artifact_dir (kèm course_id theo hàng nếu có)
 def save_item_item_matrix(artifact_dir: str,
                           S: "sparse.csr_matrix",
-                          file_name: str = "cf_item_item_S.npz") -> None:
+                          file_name: str = ITEM_ITEM_FILE,
+                          item_ids: Optional[np.ndarray] = None) -> None:
     os.makedirs(artifact_dir, exist_ok=True)
-    sparse.save_npz(_pjoin(artifact_dir, file_name), S)
+    path = _pjoin(artifact_dir, file_name)
+    tmp = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp.npz"
+    sparse.save_npz(tmp, S.tocsr())
+    os.replace(tmp, path)
+    if item_ids is not None:
+        save_npy_atomic(_pjoin(artifact_dir, ITEM_ITEM_IDS_FILE), np.asarray(item_ids, dtype=np.int64))
 
 # Tải ma trận item-item S từ thư mục artifact_dir
 def load_item_item_matrix(artifact_dir: str,
-                          file_name: str = "cf_item_item_S.npz") -> Optional["sparse.csr_matrix"]:
+                          file_name: str = ITEM_ITEM_FILE) -> Optional["sparse.csr_matrix"]:
     path = _pjoin(artifact_dir, file_name)
     if not os.path.exists(path):
         return None
     return sparse.load_npz(path)
 
+# Đọc S + course_id theo hàng; None nếu thiếu file hoặc không khớp kích thước
+def load_item_item_store(artifact_dir: str) -> Optional[ItemItemMatrix]:
+    S = load_item_item_matrix(artifact_dir)
+    ids_path = _pjoin(artifact_dir, ITEM_ITEM_IDS_FILE)
+    if S is None or not os.path.exists(ids_path):
+        return None
+    item_ids = np.load(ids_path, allow_pickle=False)
+    if S.shape != (item_ids.size, item_ids.size):
+        return None
+    return ItemItemMatrix(S.tocsr(), item_ids)
+
 # Lưu neighbors user-based.
 def save_user_neighbors_json(
     artifact_dir: str,
@@ -53,4 +102,356 @@ def load_user_neighbors_json(
     neighbors: Dict[str, List[Tuple[str, float]]] = {}
     for uid, neighs in data.items():
         neighbors[str(uid)] = [(str(n_uid), float(sim)) for n_uid, sim in neighs]
-    return neighbors
\ No newline at end of file
+    return neighbors
+
+# ---------------- Binary neighbor store (memmap) ----------------
+# Layout (prefix mặc định "cf_user_neighbors"), 4 mảng nằm chung 1 thư mục generation:
+#   <prefix>/CURRENT -> gen-<ts>-<id>   (io/generations.py)
+#   <prefix>/gen-*/uids.npy    : user_id đã sort tăng dần, dtype '<U*' (tra cứu bằng searchsorted)
+#   <prefix>/gen-*/indptr.npy  : int64 (U + 1), neighbors của uids[r] nằm trong [indptr[r], indptr[r+1])
+#   <prefix>/gen-*/indices.npy : int32 (nnz), chỉ số neighbor trong uids, đã sort theo sim giảm dần
+#   <prefix>/gen-*/sims.npy    : float32 (nnz), similarity tương ứng
+# Ghi cả bộ vào generation mới rồi đổi CURRENT -> reader không thấy indptr mới đi với indices cũ.
+# Bố cục cũ (<prefix>_<part>.npy phẳng trong artifact_dir) vẫn đọc được cho tới lần ghi kế tiếp.
+# Mở bằng np.load(mmap_mode="r") -> các worker dùng chung page cache của OS,
+# tra cứu 1 user là O(log U + K), không parse toàn bộ file.
+BIN_PREFIX = "cf_user_neighbors"
+_BIN_PARTS = ("uids", "indptr", "indices", "sims")
+
+# File phẳng bố cục cũ
+def _bin_path(artifact_dir: str, prefix: str, part: str) -> str:
+    return _pjoin(artifact_dir, f"{prefix}_{part}.npy")
+
+# Thư mục chứa 4 mảng đang dùng: generation CURRENT, None nếu chưa có
+def neighbor_store_dir(artifact_dir: str, prefix: str = BIN_PREFIX) -> Optional[str]:
+    return current_dir(_pjoin(artifact_dir, prefix))
+
+class UserNeighborStore:
+    """
+    Neighbors user-based dạng CSR: uids (sorted) + indptr + indices + sims.
+    Các mảng có thể là np.memmap (chỉ đọc) hoặc ndarray trong RAM.
+    """
+
+    def __init__(self, uids: np.ndarray, indptr: np.ndarray,
+                 indices: np.ndarray, sims: np.ndarray):
+        self.uids = uids
+        self.indptr = indptr
+        self.indices = indices
+        self.sims = sims
+
+    def __len__(self) -> int:
+        return int(self.uids.shape[0])
+
+    def _row(self, user_id: str) -> int:
+        uid = str(user_id)
+        pos = int(np.searchsorted(self.uids, uid))
+        if pos < len(self) and self.uids[pos] == uid:
+            return pos
+        return -1
+
+    def __contains__(self, user_id) -> bool:
+        return self._row(user_id) >= 0
+
+    # Mảng (neighbor_row_indices, sims) của 1 user, tối đa k phần tử đầu (sim cao nhất)
+    def neighbor_arrays(self, user_id: str, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        r = self._row(user_id)
+        if r < 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        start, end = int(self.indptr[r]), int(self.indptr[r + 1])
+        if k is not None:
+            end = min(end, start + max(0, int(k)))
+        return self.indices[start:end], self.sims[start:end]
+
+    # [(neighbor_user_id, sim), ...] của 1 user, giống format JSON cũ
+    def neighbors(self, user_id: str, k: Optional[int] = None) -> List[Tuple[str, float]]:
+        idx, sims = self.neighbor_arrays(user_id, k)
+        if idx.size == 0:
+            return []
+        n_uids = self.uids[idx]
+        return [(str(v), float(s)) for v, s in zip(n_uids.tolist(), sims.tolist())]
+
+    # Chuyển toàn bộ về dict (dùng cho debug / tương thích ngược)
+    def to_dict(self) -> Dict[str, List[Tuple[str, float]]]:
+        return {str(uid): self.neighbors(uid) for uid in self.uids.tolist()}
+
+# Dựng store trong RAM từ dict neighbors {user_id: [(neighbor_id, sim), ...]}
+def neighbor_store_from_dict(neighbors: Dict[str, List[Tuple[str, float]]]) -> UserNeighborStore:
+    all_ids = set(str(u) for u in neighbors.keys())
+    for neighs in neighbors.values():
+        all_ids.update(str(v) for v, _ in neighs)
+    uids_list = sorted(all_ids)
+    width = max((len(u) for u in uids_list), default=1)
+    uids = np.array(uids_list, dtype=f"<U{width}")
+    pos = {u: i for i, u in enumerate(uids_list)}
+
+    n = len(uids_list)
+    counts = np.zeros(n, dtype=np.int64)
+    for uid, neighs in neighbors.items():
+        counts[pos[str(uid)]] = len(neighs)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    indices = np.empty(int(indptr[-1]), dtype=np.int32)
+    sims = np.empty(int(indptr[-1]), dtype=np.float32)
+    for uid, neighs in neighbors.items():
+        if not neighs:
+            continue
+        r = pos[str(uid)]
+        # giữ thứ tự sim giảm dần để cắt top-k bằng slice
+        ordered = sorted(neighs, key=lambda x: float(x[1]), reverse=True)
+        start = int(indptr[r])
+        indices[start:start + len(ordered)] = [pos[str(v)] for v, _ in ordered]
+        sims[start:start + len(ordered)] = [float(s) for _, s in ordered]
+    return UserNeighborStore(uids, indptr, indices, sims)
+
+# Dựng store từ CSR neighbors N (U × U) và user_ids (row -> user_id), không qua dict Python
+def neighbor_store_from_csr(
+    user_ids: List[Optional[str]],
+    N: "sparse.csr_matrix",
+) -> UserNeighborStore:
+    N = N.tocsr()
+    valid = np.array([u is not None for u in user_ids[:N.shape[0]]] + [False] * max(0, N.shape[0] - len(user_ids)))
+    ids = np.array([str(u) if u is not None else "" for u in user_ids[:N.shape[0]]] + [""] * max(0, N.shape[0] - len(user_ids)))
+    width = max(1, max((len(u) for u in ids.tolist()), default=1))
+
+    old_rows = np.flatnonzero(valid)
+    order = old_rows[np.argsort(ids[old_rows], kind="stable")]
+    uids = ids[order].astype(f"<U{width}")
+    pos = np.full(N.shape[0], -1, dtype=np.int64)
+    pos[order] = np.arange(order.size)
+
+    # giữ phần tử có cả hàng & cột hợp lệ, đổi sang thứ tự mới, sort sim giảm dần trong hàng
+    src_rows = np.repeat(np.arange(N.shape[0]), np.diff(N.indptr))
+    new_rows = pos[src_rows]
+    new_cols = pos[N.indices]
+    keep = (new_rows >= 0) & (new_cols >= 0)
+    new_rows, new_cols, vals = new_rows[keep], new_cols[keep], N.data[keep]
+    o = np.lexsort((-vals, new_rows))
+
+    indptr = np.zeros(uids.size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(new_rows, minlength=uids.size), out=indptr[1:])
+    return UserNeighborStore(
+        uids, indptr, new_cols[o].astype(np.int32), vals[o].astype(np.float32)
+    )
+
+def _save_store(artifact_dir: str, store: UserNeighborStore, prefix: str) -> None:
+    root = _pjoin(artifact_dir, prefix)
+    os.makedirs(root, exist_ok=True)
+    gen_dir = new_generation_dir(root)
+    for part in _BIN_PARTS:
+        np.save(_pjoin(gen_dir, f"{part}.npy"), getattr(store, part))
+    flip_current(root, gen_dir)  # publish cả bộ
+    prune_generations(root, ARTIFACT_KEEP_GENERATIONS, ARTIFACT_GENERATION_MIN_AGE)
+    for part in _BIN_PARTS:
+        legacy = _bin_path(artifact_dir, prefix, part)
+        if os.path.isfile(legacy):
+            os.remove(legacy)
+
+# Lưu neighbors user-based dạng nhị phân (memmap-able)
+def save_user_neighbors_bin(
+    artifact_dir: str,
+    neighbors: Dict[str, List[Tuple[str, float]]],
+    prefix: str = BIN_PREFIX,
+) -> UserNeighborStore:
+    store = neighbor_store_from_dict(neighbors)
+    _save_store(artifact_dir, store, prefix)
+    return store
+
+# Lưu neighbors từ CSR (U × U) + user_ids theo hàng, dạng nhị phân
+def save_user_neighbors_csr(
+    artifact_dir: str,
+    user_ids: List[Optional[str]],
+    N: "sparse.csr_matrix",
+    prefix: str = BIN_PREFIX,
+) -> UserNeighborStore:
+    store = neighbor_store_from_csr(user_ids, N)
+    _save_store(artifact_dir, store, prefix)
+    return store
+
+# Thay neighbors của 1 nhóm user trong store hiện có (cập nhật incremental) rồi ghi lại.
+#   user_ids : row -> user_id của R hiện tại (có thể nhiều user hơn store: user mới)
+#   rows     : các hàng (theo user_ids) được tính lại; N_rows (len(rows) × U) cột theo user_ids
+# Neighbors của user khác được giữ nguyên (chỉ đổi chỉ số sang thứ tự mới).
+def patch_user_neighbors_csr(
+    artifact_dir: str,
+    store: UserNeighborStore,
+    user_ids: List[Optional[str]],
+    rows: np.ndarray,
+    N_rows: "sparse.csr_matrix",
+    prefix: str = BIN_PREFIX,
+) -> UserNeighborStore:
+    from api.services.reco_service.io.delta_store import replace_csr_rows
+
+    n = len(user_ids)
+    if n == 0:
+        raise ValueError("user_ids rỗng")
+    ids = np.array([str(u) if u is not None else "" for u in user_ids])
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    # hàng store -> hàng theo user_ids (-1 nếu user không còn)
+    pos = np.minimum(np.searchsorted(sorted_ids, store.uids), n - 1)
+    to_row = np.where(sorted_ids[pos] == store.uids, order[pos], -1)
+
+    old_rows = to_row[np.repeat(np.arange(len(store)), np.diff(store.indptr))]
+    old_cols = to_row[np.asarray(store.indices)]
+    keep = (old_rows >= 0) & (old_cols >= 0)
+    N_old = sparse.csr_matrix(
+        (np.asarray(store.sims)[keep], (old_rows[keep], old_cols[keep])), shape=(n, n), dtype=np.float32
+    )
+    N = replace_csr_rows(N_old, rows, N_rows, n_rows=n)
+    return save_user_neighbors_csr(artifact_dir, user_ids, N, prefix=prefix)
+
+# Độ dài 4 mảng có khớp nhau không (bộ file lẫn giữa 2 lần ghi, file bị cắt, ...)
+def _store_consistent(uids, indptr, indices, sims) -> bool:
+    if indptr.ndim != 1 or indptr.shape[0] != uids.shape[0] + 1:
+        return False
+    nnz = int(indptr[-1])
+    return int(indptr[0]) == 0 and indices.shape[0] == nnz and sims.shape[0] == nnz
+
+# Mở store nhị phân bằng memmap; None nếu chưa có hoặc các mảng không khớp nhau
+def load_user_neighbors_bin(
+    artifact_dir: str,
+    prefix: str = BIN_PREFIX,
+    mmap_mode: Optional[str] = "r",
+) -> Optional[UserNeighborStore]:
+    gen_dir = neighbor_store_dir(artifact_dir, prefix)
+    if gen_dir is not None:
+        paths = {part: _pjoin(gen_dir, f"{part}.npy") for part in _BIN_PARTS}
+    else:
+        paths = {part: _bin_path(artifact_dir, prefix, part) for part in _BIN_PARTS}
+    if not all(os.path.exists(p) for p in paths.values()):
+        return None
+    try:
+        arrays = {part: np.load(p, mmap_mode=mmap_mode, allow_pickle=False) for part, p in paths.items()}
+    except (OSError, ValueError):
+        return None
+    if not _store_consistent(arrays["uids"], arrays["indptr"], arrays["indices"], arrays["sims"]):
+        return None
+    return UserNeighborStore(arrays["uids"], arrays["indptr"], arrays["indices"], arrays["sims"])
+
+# Chuyển file JSON cũ sang store nhị phân (một lần). Trả None nếu không có JSON.
+def migrate_user_neighbors_json_to_bin(
+    artifact_dir: str,
+    file_name: str = "cf_user_neighbors.json",
+    prefix: str = BIN_PREFIX,
+) -> Optional[UserNeighborStore]:
+    if not os.path.exists(_pjoin(artifact_dir, file_name)):
+        return None
+    neighbors = load_user_neighbors_json(artifact_dir, file_name=file_name)
+    save_user_neighbors_bin(artifact_dir, neighbors, prefix=prefix)
+    return load_user_neighbors_bin(artifact_dir, prefix=prefix)
+
+# Loader chung: ưu tiên store nhị phân, fallback JSON cũ (migrate nếu ghi được, nếu không giữ trong RAM)
+def load_user_neighbors_store(
+    artifact_dir: str,
+    prefix: str = BIN_PREFIX,
+    legacy_file_name: str = "cf_user_neighbors.json",
+) -> Optional[UserNeighborStore]:
+    store = load_user_neighbors_bin(artifact_dir, prefix=prefix)
+    if store is not None:
+        return store
+    if not os.path.exists(_pjoin(artifact_dir, legacy_file_name)):
+        return None
+    try:
+        return migrate_user_neighbors_json_to_bin(artifact_dir, legacy_file_name, prefix)
+    except OSError:
+        # thư mục chỉ đọc -> dùng bản trong RAM
+        return neighbor_store_from_dict(load_user_neighbors_json(artifact_dir, legacy_file_name))
+
+# ---------------- Ma trận user-item R (trọng số implicit lúc build) ----------------
+# Cả bộ ghi vào 1 generation <artifact_dir>/cf_user_item/gen-*/ rồi đổi CURRENT 1 lần (io/generations.py)
+# -> reader không bao giờ ghép R mới với built_at / index cũ:
+#   cf_user_item_R.npz     : R (U × I) CSR, trọng số base_weight * time_decay (chưa BM25)
+#   cf_user_item_meta.json : {"built_at": epoch giây lúc bắt đầu đọc interactions, "shape": [U, I],
+#                             "full_built_at": lần build toàn bộ gần nhất (cập nhật incremental giữ nguyên)}
+#   cf_user_index.json     : {user_id: hàng R}
+#   cf_item_index.json     : {course_id: cột R}
+# Sự kiện có created_at > built_at chưa nằm trong R (dùng để overlay từ DB khi chấm điểm).
+# Chưa có CURRENT (bố cục cũ) -> đọc các file phẳng trong artifact_dir.
+USER_ITEM_DIR = "cf_user_item"
+USER_ITEM_FILE = "cf_user_item_R.npz"
+USER_ITEM_META_FILE = "cf_user_item_meta.json"
+USER_INDEX_FILE = "cf_user_index.json"
+ITEM_INDEX_FILE = "cf_item_index.json"
+_USER_ITEM_FILES = (USER_ITEM_FILE, USER_ITEM_META_FILE, USER_INDEX_FILE, ITEM_INDEX_FILE)
+
+class UserItemMatrix:
+    """
+    R (user × item) trong RAM + ánh xạ user_id -> hàng, cột -> course_id.
+    """
+
+    def __init__(self, R: "sparse.csr_matrix", user_index: Dict[str, int],
+                 item_ids: np.ndarray, built_at: float, full_built_at: Optional[float] = None):
+        self.R = R
+        self.user_index = user_index
+        self.item_ids = item_ids  # int64 (I,), item_ids[col] = course_id
+        self.built_at = float(built_at)
+        self.full_built_at = float(built_at if full_built_at is None else full_built_at)
+
+    def row(self, user_id: str) -> int:
+        return int(self.user_index.get(str(user_id), -1))
+
+    # {course_id: w} của 1 user theo R (rỗng nếu user chưa có trong R)
+    def item_weights(self, user_id: str) -> Dict[int, float]:
+        r = self.row(user_id)
+        if r < 0:
+            return {}
+        start, end = self.R.indptr[r], self.R.indptr[r + 1]
+        cids = self.item_ids[self.R.indices[start:end]]
+        return dict(zip(cids.tolist(), self.R.data[start:end].tolist()))
+
+# Thư mục chứa bộ R đang dùng: generation CURRENT, hoặc artifact_dir (bố cục cũ)
+def user_item_dir(artifact_dir: str) -> str:
+    return current_dir(_pjoin(artifact_dir, USER_ITEM_DIR)) or artifact_dir
+
+def _dump_json(path: str, obj) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+# Ghi R + meta + user_index / item_index vào generation mới rồi đổi CURRENT (publish cả bộ)
+def save_user_item_matrix(artifact_dir: str, R: "sparse.csr_matrix",
+                          user_index: Dict[str, int], item_index: Dict[int, int], built_at: float,
+                          full_built_at: Optional[float] = None) -> None:
+    root = _pjoin(artifact_dir, USER_ITEM_DIR)
+    os.makedirs(root, exist_ok=True)
+    gen_dir = new_generation_dir(root)
+    sparse.save_npz(_pjoin(gen_dir, USER_ITEM_FILE), R.tocsr())
+    _dump_json(_pjoin(gen_dir, USER_ITEM_META_FILE), {
+        "built_at": float(built_at),
+        "full_built_at": float(built_at if full_built_at is None else full_built_at),
+        "shape": [int(x) for x in R.shape],
+    })
+    _dump_json(_pjoin(gen_dir, USER_INDEX_FILE), {str(uid): int(idx) for uid, idx in user_index.items()})
+    _dump_json(_pjoin(gen_dir, ITEM_INDEX_FILE), {int(cid): int(idx) for cid, idx in item_index.items()})
+    flip_current(root, gen_dir)
+    prune_generations(root, ARTIFACT_KEEP_GENERATIONS, ARTIFACT_GENERATION_MIN_AGE)
+    for name in _USER_ITEM_FILES:
+        legacy = _pjoin(artifact_dir, name)
+        if os.path.isfile(legacy):
+            os.remove(legacy)
+
+# Đọc R + meta + index của generation CURRENT (hoặc bố cục cũ);
+# None nếu thiếu file, đọc lỗi hoặc kích thước không khớp
+def load_user_item_matrix(artifact_dir: str) -> Optional[UserItemMatrix]:
+    base = user_item_dir(artifact_dir)
+    paths = [_pjoin(base, x) for x in _USER_ITEM_FILES]
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    try:
+        R = sparse.load_npz(paths[0]).tocsr()
+        with open(paths[1], "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(paths[2], "r", encoding="utf-8") as f:
+            user_index = {str(k): int(v) for k, v in json.load(f).items()}
+        with open(paths[3], "r", encoding="utf-8") as f:
+            item_index = {int(k): int(v) for k, v in json.load(f).items()}
+    except (OSError, ValueError):
+        return None
+    if len(user_index) != R.shape[0] or len(item_index) != R.shape[1]:
+        return None
+    if "shape" in meta and [int(x) for x in meta["shape"]] != list(R.shape):
+        return None
+    item_ids = np.full(R.shape[1], -1, dtype=np.int64)
+    for cid, col in item_index.items():
+        item_ids[col] = cid
+    return UserItemMatrix(R, user_index, item_ids, float(meta.get("built_at", 0.0)), meta.get("full_built_at"))
@@ -0,0 +1,127 @@
+from __future__ import annotations
+import os
+from typing import Optional, Tuple
+import numpy as np
+from scipy import sparse
+from api.services.reco_service.io.misc_store import save_npz_atomic
+
+"""
+Delta segment cho ma trận CSR lưu dạng npz (TF-IDF, course similarity):
+- Cập nhật 1 vài hàng -> chỉ ghi các hàng đó vào file `<name>.delta.npz` (không ghi lại ma trận gốc).
+- Reader = ma trận gốc + delta (các hàng trong delta thay thế hàng gốc, có thể thêm hàng mới ở cuối).
+- Khi delta đủ lớn / theo lịch -> compact: gộp delta vào ma trận gốc và xoá delta.
+
+Delta lưu dạng (rows, M): rows là các hàng bị thay thế (kể cả hàng rỗng),
+M là CSR full-shape chỉ có dữ liệu tại các hàng trong rows.
+"""
+
+def delta_path(matrix_path: str) -> str:
+    root, _ = os.path.splitext(matrix_path)
+    return f"{root}.delta.npz"
+
+# Thay các hàng `rows` của base bằng các hàng tương ứng của patch (patch có len(rows) hàng).
+# Vectorized hoàn toàn (không chuyển LIL); tự mở rộng số hàng/cột nếu cần.
+def replace_csr_rows(
+    base: sparse.csr_matrix,
+    rows: np.ndarray,
+    patch: sparse.csr_matrix,
+    n_rows: Optional[int] = None,
+) -> sparse.csr_matrix:
+    base = base.tocsr()
+    patch = patch.tocsr()
+    rows = np.asarray(rows, dtype=np.int64)
+    if rows.size != patch.shape[0]:
+        raise ValueError("patch phải có đúng len(rows) hàng")
+
+    n_rows = max(base.shape[0], int(rows.max()) + 1 if rows.size else 0, int(n_rows or 0))
+    n_cols = max(base.shape[1], patch.shape[1])
+
+    replaced = np.zeros(n_rows, dtype=bool)
+    replaced[rows] = True
+
+    base_rows = np.repeat(np.arange(base.shape[0], dtype=np.int64), np.diff(base.indptr))
+    keep = ~replaced[base_rows]
+    patch_rows = rows[np.repeat(np.arange(rows.size), np.diff(patch.indptr))]
+
+    r = np.concatenate([base_rows[keep], patch_rows])
+    c = np.concatenate([base.indices[keep], patch.indices])
+    dtype = np.result_type(base.dtype, patch.dtype)
+    d = np.concatenate([base.data[keep].astype(dtype, copy=False), patch.data.astype(dtype, copy=False)])
+    return sparse.csr_matrix((d, (r, c)), shape=(n_rows, n_cols), dtype=dtype)
+
+# Đọc delta: (rows, M) hoặc None nếu không có
+def load_row_delta(matrix_path: str) -> Optional[Tuple[np.ndarray, sparse.csr_matrix]]:
+    path = delta_path(matrix_path)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as z:
+        rows = z["rows"].astype(np.int64)
+        M = sparse.csr_matrix(
+            (z["data"], z["indices"], z["indptr"]), shape=tuple(int(x) for x in z["shape"])
+        )
+    return rows, M
+
+# Ghi delta (atomic: file tạm + os.replace)
+def save_row_delta(matrix_path: str, rows: np.ndarray, M: sparse.csr_matrix) -> None:
+    path = delta_path(matrix_path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, rows=np.asarray(rows, dtype=np.int64), data=M.data, indices=M.indices,
+                 indptr=M.indptr, shape=np.asarray(M.shape, dtype=np.int64))
+    os.replace(tmp, path)
+
+def remove_row_delta(matrix_path: str) -> None:
+    try:
+        os.remove(delta_path(matrix_path))
+    except FileNotFoundError:
+        pass
+
+# Thêm các hàng mới vào delta (ghi đè hàng trùng). Chi phí O(nnz của delta), không đụng ma trận gốc.
+# Trả về (số hàng trong delta, nnz của delta).
+def append_row_delta(
+    matrix_path: str,
+    rows: np.ndarray,
+    patch: sparse.csr_matrix,
+    shape: Tuple[int, int],
+) -> Tuple[int, int]:
+    rows = np.asarray(rows, dtype=np.int64)
+    current = load_row_delta(matrix_path)
+    if current is None:
+        d_rows = np.empty(0, dtype=np.int64)
+        M = sparse.csr_matrix(shape, dtype=patch.dtype)
+    else:
+        d_rows, M = current
+    M = replace_csr_rows(M, rows, patch, n_rows=shape[0])
+    if M.shape[1] < shape[1]:
+        M = sparse.csr_matrix((M.data, M.indices, M.indptr), shape=(M.shape[0], shape[1]))
+    d_rows = np.union1d(d_rows, rows)
+    save_row_delta(matrix_path, d_rows, M)
+    return int(d_rows.size), int(M.nnz)
+
+# Áp delta (nếu có) lên ma trận gốc
+def apply_row_delta(
+    base: sparse.csr_matrix,
+    delta: Optional[Tuple[np.ndarray, sparse.csr_matrix]],
+) -> sparse.csr_matrix:
+    if delta is None:
+        return base
+    rows, M = delta
+    if rows.size == 0:
+        return base
+    return replace_csr_rows(base, rows, M[rows], n_rows=M.shape[0])
+
+# Ma trận gốc + delta từ đĩa
+def load_npz_with_delta(matrix_path: str) -> sparse.csr_matrix:
+    base = sparse.load_npz(matrix_path).tocsr()
+    return apply_row_delta(base, load_row_delta(matrix_path))
+
+# Gộp delta vào ma trận gốc, ghi lại npz và xoá delta. Trả True nếu có gộp.
+def compact_row_delta(matrix_path: str) -> bool:
+    delta = load_row_delta(matrix_path)
+    if delta is None:
+        return False
+    merged = apply_row_delta(sparse.load_npz(matrix_path).tocsr(), delta)
+    save_npz_atomic(matrix_path, merged)
+    remove_row_delta(matrix_path)  # base mới đã chứa delta: đọc base mới + delta cũ vẫn ra cùng kết quả
+    return True
@@ -0,0 +1,181 @@
+from __future__ import annotations
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+"""
+Thư mục generation cho 1 nhóm artifacts (vd. TF-IDF: vectorizer + matrix + row_map):
+
+    <root>/
+        CURRENT -> gen-<ts>-<id>          (symlink; hệ thống không có symlink: file text chứa tên)
+        gen-<ts>-<id>/
+            manifest.json                 (files: size + sha1, shape, nnz, số hàng nguồn, tham số build)
+            ...artifacts
+
+- Builder ghi toàn bộ artifacts vào thư mục generation mới, ghi manifest, rồi mới đổi CURRENT
+  (atomic: tạo link tạm + os.replace) -> reader luôn thấy đủ bộ file của cùng 1 lần build.
+- Reader resolve CURRENT 1 lần rồi đọc mọi file trong thư mục đó.
+- Cập nhật incremental không sửa generation đang dùng: fork_generation() tạo generation mới
+  (hard link các file không đổi), ghi thay đổi vào đó rồi mới đổi CURRENT.
+- Kiểm tra khi startup chỉ đọc manifest + stat file (không nạp artifacts);
+  verify_generation(checksums=True) băm lại từng file khi cần kiểm tra sâu.
+"""
+
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+GEN_PREFIX = "gen-"
+
+def _atomic_write_json(path: str, data: Dict) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+# sha1 của file, đọc theo block (không nạp cả file vào RAM)
+def file_checksum(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def describe_file(path: str) -> Dict:
+    return {"size": os.path.getsize(path), "sha1": file_checksum(path)}
+
+# Tạo thư mục generation mới (chưa publish) trong root
+def new_generation_dir(root: str) -> str:
+    ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    path = os.path.join(root, f"{GEN_PREFIX}{ts}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    return path
+
+# Thư mục generation CURRENT của root (None nếu chưa có / CURRENT trỏ tới thư mục không tồn tại)
+def current_dir(root: str) -> Optional[str]:
+    link = os.path.join(root, CURRENT_NAME)
+    try:
+        if os.path.islink(link):
+            name = os.readlink(link)
+        else:
+            with open(link, "r", encoding="utf-8") as f:
+                name = f.read().strip()
+    except (FileNotFoundError, OSError):
+        return None
+    path = os.path.join(root, os.path.basename(name))
+    return path if name and os.path.isdir(path) else None
+
+# Đổi CURRENT sang gen_dir (atomic). gen_dir phải nằm trong root.
+def flip_current(root: str, gen_dir: str) -> None:
+    name = os.path.basename(os.path.normpath(gen_dir))
+    link = os.path.join(root, CURRENT_NAME)
+    tmp = f"{link}.{os.getpid()}.tmp"
+    try:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(name, tmp)
+    except (OSError, NotImplementedError, AttributeError):
+        # không tạo được symlink (vd. Windows không có quyền) -> file text
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+    os.replace(tmp, link)
+
+# Copy-on-write: generation mới chứa các file `names` của src_dir (hard link, không được thì copy).
+# Sửa file trong generation mới luôn phải ghi file tạm + os.replace (không ghi đè inode dùng chung
+# với generation cũ), xong mới flip_current.
+def fork_generation(root: str, src_dir: str, names: Iterable[str]) -> str:
+    gen_dir = new_generation_dir(root)
+    for name in names:
+        src = os.path.join(src_dir, name)
+        if not os.path.isfile(src):
+            continue
+        dst = os.path.join(gen_dir, name)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    return gen_dir
+
+def write_manifest(gen_dir: str, manifest: Dict) -> None:
+    _atomic_write_json(os.path.join(gen_dir, MANIFEST_NAME), manifest)
+
+def read_manifest(gen_dir: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(gen_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+# Manifest mới cho gen_dir: mô tả (size + sha1) các file trong names, cộng thêm các field khác
+def build_manifest(gen_dir: str, names: Iterable[str], **fields) -> Dict:
+    manifest = {
+        "generation": os.path.basename(os.path.normpath(gen_dir)),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "files": {name: describe_file(os.path.join(gen_dir, name)) for name in names},
+    }
+    manifest.update(fields)
+    return manifest
+
+# Cập nhật manifest sau khi sửa vài file của generation vừa fork (vd. thêm 1 course):
+# tính lại size + sha1 của các file trong names, ghi đè các field truyền vào.
+def update_manifest(gen_dir: str, names: Iterable[str] = (), **fields) -> Optional[Dict]:
+    manifest = read_manifest(gen_dir)
+    if manifest is None:
+        return None
+    for name in names:
+        manifest["files"][name] = describe_file(os.path.join(gen_dir, name))
+    manifest.update(fields)
+    manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+    write_manifest(gen_dir, manifest)
+    return manifest
+
+# Các file trong manifest có đủ và đúng size không; checksums=True: băm lại và so sha1
+def verify_generation(gen_dir: str, manifest: Optional[Dict] = None, checksums: bool = False) -> bool:
+    manifest = manifest if manifest is not None else read_manifest(gen_dir)
+    if not manifest or not manifest.get("files"):
+        return False
+    for name, info in manifest["files"].items():
+        path = os.path.join(gen_dir, name)
+        try:
+            if os.path.getsize(path) != info.get("size"):
+                return False
+        except OSError:
+            return False
+        if checksums and file_checksum(path) != info.get("sha1"):
+            return False
+    return True
+
+# Các thư mục generation trong root, cũ -> mới (tên có timestamp nên sort theo tên)
+def list_generations(root: str) -> List[str]:
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        os.path.join(root, n) for n in names
+        if n.startswith(GEN_PREFIX) and os.path.isdir(os.path.join(root, n))
+    )
+
+# Xoá generation cũ, giữ lại `keep` bản mới nhất (luôn giữ CURRENT). Trả số thư mục đã xoá.
+# min_age (giây): chỉ xoá generation đã bị thay thế ít nhất min_age giây (tính theo mtime của
+# generation kế tiếp ~ lúc đổi CURRENT) -> tiến trình vừa resolve CURRENT cũ vẫn kịp mở file.
+def prune_generations(root: str, keep: int, min_age: float = 0.0) -> int:
+    current = current_dir(root)
+    gens = list_generations(root)
+    now = time.time()
+    removed = 0
+    for i, path in enumerate(gens[:max(0, len(gens) - max(1, int(keep)))]):
+        if current is not None and os.path.samefile(path, current):
+            continue
+        try:
+            retired_at = os.path.getmtime(gens[i + 1])
+        except OSError:
+            retired_at = now
+        if now - retired_at < min_age:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
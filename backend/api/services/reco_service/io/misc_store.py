@@ -1,7 +1,23 @@
 import os, json
+import numpy as np
+from scipy import sparse
 
 # Lưu JSON
 def save_json(path: str, obj) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+
+# Ghi 1 mảng .npy theo kiểu atomic (file tạm + os.replace): reader đang mmap file cũ vẫn đọc bản cũ
+def save_npy_atomic(path: str, arr: np.ndarray) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+# Ghi 1 ma trận sparse .npz theo kiểu atomic (file tạm + os.replace)
+def save_npz_atomic(path: str, M: sparse.spmatrix) -> None:
+    root, _ = os.path.splitext(path)
+    tmp = f"{root}.{os.getpid()}.tmp.npz"
+    sparse.save_npz(tmp, M)
+    os.replace(tmp, path)
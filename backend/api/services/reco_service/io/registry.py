@@ -0,0 +1,129 @@
+from __future__ import annotations
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+from api.services.reco_service.config import REGISTRY_CHECK_INTERVAL
+
+"""
+Registry artifacts trong tiến trình (process-wide) cho reco_service.
+
+- Mỗi nhóm artifacts ("cb": TF-IDF + course similarity, "cf": neighbors...) gắn với
+  một generation stamp, lưu ở file `<kind>_generation` trong artifact_dir.
+- Builder ghi xong artifacts -> gọi publish_generation(kind) để đổi stamp.
+- Khi đọc, nếu stamp trên đĩa khác stamp đang giữ trong RAM -> bỏ toàn bộ bundle cũ
+  và nạp lại (hoán đổi nguyên khối), các request đang dùng bundle cũ không bị ảnh hưởng.
+- Stamp chỉ được đọc lại từ đĩa tối đa 1 lần / REGISTRY_CHECK_INTERVAL giây.
+- Loader trả None (file chưa có / đọc dở) không được giữ cả generation: chỉ nhớ trong
+  REGISTRY_CHECK_INTERVAL giây rồi nạp lại.
+"""
+
+ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
+LEGACY_GENERATION = "legacy"  # artifacts cũ chưa có file stamp
+
+_lock = threading.RLock()
+# (artifact_dir, kind) -> (generation, {name: artifact})
+_bundles: Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]] = {}
+# (artifact_dir, kind) -> (generation, thời điểm đọc stamp gần nhất)
+_stamps: Dict[Tuple[str, str], Tuple[str, float]] = {}
+# (artifact_dir, kind, name) -> (generation, thời điểm loader trả None)
+_misses: Dict[Tuple[str, str, str], Tuple[str, float]] = {}
+
+def _key(kind: str, artifact_dir: str) -> Tuple[str, str]:
+    return (os.path.abspath(artifact_dir), kind)
+
+def _gen_path(kind: str, artifact_dir: str) -> str:
+    return os.path.join(artifact_dir, f"{kind}_generation")
+
+# Đọc generation stamp từ đĩa (không qua cache)
+def _read_generation_file(kind: str, artifact_dir: str) -> str:
+    try:
+        with open(_gen_path(kind, artifact_dir), "r", encoding="utf-8") as f:
+            return f.read().strip() or LEGACY_GENERATION
+    except FileNotFoundError:
+        return LEGACY_GENERATION
+
+# Generation hiện tại của nhóm artifacts (có cache theo REGISTRY_CHECK_INTERVAL)
+# fresh=True: luôn đọc lại stamp từ đĩa (dùng ở luồng ghi, cần thấy thay đổi của tiến trình khác)
+def current_generation(kind: str, artifact_dir: str = ARTIFACT_DIR, fresh: bool = False) -> str:
+    key = _key(kind, artifact_dir)
+    now = time.monotonic()
+    cached = _stamps.get(key)
+    if not fresh and cached is not None and (now - cached[1]) < REGISTRY_CHECK_INTERVAL:
+        return cached[0]
+    gen = _read_generation_file(kind, artifact_dir)
+    _stamps[key] = (gen, now)
+    return gen
+
+# Ghi generation mới (atomic: ghi file tạm rồi os.replace) và hoán đổi bundle trong tiến trình
+def publish_generation(kind: str, artifact_dir: str = ARTIFACT_DIR) -> str:
+    os.makedirs(artifact_dir, exist_ok=True)
+    ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    gen = f"{ts}-{uuid.uuid4().hex[:8]}"
+    path = _gen_path(kind, artifact_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(gen)
+    os.replace(tmp, path)
+
+    key = _key(kind, artifact_dir)
+    with _lock:
+        _stamps[key] = (gen, time.monotonic())
+        _bundles.pop(key, None)
+        for mkey in [m for m in _misses if m[:2] == key]:
+            _misses.pop(mkey, None)
+    return gen
+
+# Lấy 1 artifact theo tên từ bundle của generation hiện tại; nạp bằng loader nếu chưa có.
+# Lỗi từ loader không được cache (lần gọi sau sẽ thử nạp lại); None chỉ được nhớ REGISTRY_CHECK_INTERVAL giây.
+def get_artifact(
+    kind: str,
+    name: str,
+    loader: Callable[[], Any],
+    artifact_dir: str = ARTIFACT_DIR,
+    fresh: bool = False,
+) -> Any:
+    key = _key(kind, artifact_dir)
+    gen = current_generation(kind, artifact_dir, fresh=fresh)
+
+    bundle = _bundles.get(key)
+    if bundle is not None and bundle[0] == gen and name in bundle[1]:
+        return bundle[1][name]
+    mkey = key + (name,)
+    miss = _misses.get(mkey)
+    if miss is not None and miss[0] == gen and (time.monotonic() - miss[1]) < REGISTRY_CHECK_INTERVAL:
+        return None
+
+    with _lock:
+        bundle = _bundles.get(key)
+        if bundle is None or bundle[0] != gen:
+            # generation đổi -> thay bundle mới (không sửa dict cũ đang được đọc)
+            bundle = (gen, {})
+            _bundles[key] = bundle
+        if name not in bundle[1]:
+            value = loader()
+            if value is None:
+                _misses[mkey] = (gen, time.monotonic())
+                return None
+            _misses.pop(mkey, None)
+            bundle[1][name] = value
+        return bundle[1][name]
+
+# Bỏ artifacts đang giữ trong RAM (vd. sau khi ghi đè thủ công hoặc trong test)
+def clear_registry(kind: Optional[str] = None, artifact_dir: Optional[str] = None) -> None:
+    with _lock:
+        for key in list(_bundles.keys()):
+            if kind is not None and key[1] != kind:
+                continue
+            if artifact_dir is not None and key[0] != os.path.abspath(artifact_dir):
+                continue
+            _bundles.pop(key, None)
+            _stamps.pop(key, None)
+        for mkey in list(_misses.keys()):
+            if kind is not None and mkey[1] != kind:
+                continue
+            if artifact_dir is not None and mkey[0] != os.path.abspath(artifact_dir):
+                continue
+            _misses.pop(mkey, None)
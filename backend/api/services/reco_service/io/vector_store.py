@@ -1,39 +1,185 @@
 from __future__ import annotations
 import os, json
-from typing import Dict
+from typing import Dict, Optional, Tuple
 import joblib
+import numpy as np
 from scipy import sparse
+from api.services.reco_service.io.delta_store import (
+    append_row_delta, compact_row_delta, delta_path, load_npz_with_delta, load_row_delta, remove_row_delta
+)
+from api.services.reco_service.io.generations import (
+    MANIFEST_NAME, build_manifest, current_dir, flip_current, fork_generation, new_generation_dir,
+    prune_generations, read_manifest, update_manifest, verify_generation, write_manifest
+)
+from api.services.reco_service.config import ARTIFACT_KEEP_GENERATIONS, ARTIFACT_GENERATION_MIN_AGE
 
 """
-Lưu/tải artifacts TF-IDF: vectorizer (joblib), matrix (npz sparse), row_map (json).
+Lưu/tải artifacts TF-IDF: vectorizer (joblib), matrix (npz sparse + delta), row_map (json).
+
+Mỗi lần fit toàn bộ ghi vào 1 thư mục generation mới <artifact_dir>/tfidf/gen-*/ kèm manifest.json
+rồi đổi symlink <artifact_dir>/tfidf/CURRENT (io/generations.py) -> reader không bao giờ thấy
+matrix mới đi với row_map cũ. Cập nhật course (delta + row_map) và compact cũng không sửa
+generation CURRENT: fork sang generation mới (hard link file không đổi), ghi thay đổi + manifest
+rồi mới đổi CURRENT. Chưa có CURRENT (bố cục cũ) -> đọc thẳng trong artifact_dir; lần cập nhật
+đầu tiên tạo generation từ các file phẳng đó.
+
+Không thuộc generation: course_similarity_matrix.npz, course_embedding*.npy, course_ann_*.npy
+(phẳng trong artifact_dir). Ma trận similarity và file ANN được ghi atomic (file tạm + os.replace;
+similarity xoá delta cũ trước khi đổi ma trận gốc); course_embedding.npy khi vá chỉ ghi đè tại chỗ
+các hàng thay đổi (fit lại toàn bộ thì ghi atomic). Fit lại TF-IDF xoá chúng trước khi đổi CURRENT
+(X mới có thể cùng số hàng nhưng khác thứ tự course) rồi dựng lại; cập nhật course thì vá ngay sau khi
+publish. Reader chỉ dùng khi có file và số hàng khớp X, ngược lại chấm điểm trực tiếp trên X.
 """
 
+GENERATIONS_DIR = "tfidf"
+
 def _pjoin(*xs) -> str: return os.path.join(*xs)
 
-# Lưu artifacts TF-IDF vào thư mục artifact_dir
+def _root(artifact_dir: str) -> str:
+    return _pjoin(artifact_dir, GENERATIONS_DIR)
+
+# Thư mục chứa artifacts TF-IDF đang dùng: generation CURRENT, hoặc artifact_dir (bố cục cũ)
+def tfidf_dir(artifact_dir: str) -> str:
+    return current_dir(_root(artifact_dir)) or artifact_dir
+
+# shape / nnz của npz sparse, chỉ đọc shape + indptr (không nạp data)
+def _npz_stats(path: str) -> Dict:
+    with np.load(path, allow_pickle=False) as z:
+        return {"shape": [int(x) for x in z["shape"]], "nnz": int(z["indptr"][-1])}
+
+# Lưu artifacts TF-IDF vào generation mới rồi publish (đổi CURRENT). Trả manifest.
+# source_rows: số course trong DB lúc build; params: tham số build (ghi vào manifest)
 def save_artifacts(artifact_dir: str,
                    vectorizer,
                    matrix: "sparse.csr_matrix",
                    row_map: Dict[int, int],
                    vect_name: str = "tfidf_vectorizer.joblib",
                    matrix_name: str = "tfidf_matrix.npz",
-                   map_name: str = "course_row_map.json") -> None:
-    os.makedirs(artifact_dir, exist_ok=True)
-    joblib.dump(vectorizer, _pjoin(artifact_dir, vect_name))
-    sparse.save_npz(_pjoin(artifact_dir, matrix_name), matrix)
+                   map_name: str = "course_row_map.json",
+                   source_rows: Optional[int] = None,
+                   params: Optional[Dict] = None) -> Dict:
+    root = _root(artifact_dir)
+    os.makedirs(root, exist_ok=True)
+    gen_dir = new_generation_dir(root)
+    joblib.dump(vectorizer, _pjoin(gen_dir, vect_name))
+    sparse.save_npz(_pjoin(gen_dir, matrix_name), matrix)
+    _write_row_map(_pjoin(gen_dir, map_name), row_map)
+
+    manifest = build_manifest(
+        gen_dir, (vect_name, matrix_name, map_name),
+        matrix={"shape": [int(x) for x in matrix.shape], "nnz": int(matrix.nnz), "dtype": str(matrix.dtype)},
+        row_map={"n_courses": len(row_map)},
+        source={"course_count": int(source_rows if source_rows is not None else len(row_map))},
+        params=params or {},
+    )
+    write_manifest(gen_dir, manifest)
+    flip_current(root, gen_dir)  # publish: từ đây reader thấy bộ artifacts mới
+    prune_generations(root, ARTIFACT_KEEP_GENERATIONS, ARTIFACT_GENERATION_MIN_AGE)
+    _remove_legacy(artifact_dir, vect_name, matrix_name, map_name)
+    return manifest
+
+# Bỏ artifacts bố cục cũ (nằm phẳng trong artifact_dir) sau khi đã có generation
+def _remove_legacy(artifact_dir: str, *names: str) -> None:
+    for name in names:
+        path = _pjoin(artifact_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    remove_row_delta(_pjoin(artifact_dir, names[1]))
 
-    with open(_pjoin(artifact_dir, map_name), "w", encoding="utf-8") as f:
+def _write_row_map(path: str, row_map: Dict[int, int]) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump({str(k): int(v) for k, v in row_map.items()}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+# Generation mới (copy-on-write) từ thư mục TF-IDF đang dùng (generation CURRENT hoặc bố cục cũ)
+def _fork(artifact_dir: str, vect_name: str, matrix_name: str, map_name: str) -> str:
+    root = _root(artifact_dir)
+    os.makedirs(root, exist_ok=True)
+    names = (MANIFEST_NAME, vect_name, matrix_name, os.path.basename(delta_path(matrix_name)), map_name)
+    return fork_generation(root, tfidf_dir(artifact_dir), names)
+
+# Ghi manifest của generation đã fork rồi publish. changed: file bị sửa (tính lại size + sha1).
+def _publish_fork(artifact_dir: str, gen_dir: str, changed, names, **fields) -> None:
+    if read_manifest(gen_dir) is None:
+        # fork từ bố cục cũ -> manifest đầy đủ
+        if "row_map" not in fields:
+            with open(_pjoin(gen_dir, names[2]), "r", encoding="utf-8") as f:
+                fields["row_map"] = {"n_courses": len(json.load(f))}
+        write_manifest(gen_dir, build_manifest(gen_dir, names, **fields))
+    else:
+        update_manifest(gen_dir, changed, generation=os.path.basename(gen_dir), **fields)
+    root = _root(artifact_dir)
+    flip_current(root, gen_dir)
+    prune_generations(root, ARTIFACT_KEEP_GENERATIONS, ARTIFACT_GENERATION_MIN_AGE)
+    _remove_legacy(artifact_dir, *names)
+
+# Ghi đè/thêm một số hàng của ma trận TF-IDF qua delta segment (không ghi lại ma trận gốc),
+# kèm row_map mới nếu có course thêm vào. Cả hai vào cùng 1 generation mới -> 1 lần đổi CURRENT.
+# Trả (số hàng trong delta, nnz của delta)
+def save_course_rows(artifact_dir: str,
+                     rows: np.ndarray,
+                     patch: "sparse.csr_matrix",
+                     shape: Tuple[int, int],
+                     row_map: Optional[Dict[int, int]] = None,
+                     vect_name: str = "tfidf_vectorizer.joblib",
+                     matrix_name: str = "tfidf_matrix.npz",
+                     map_name: str = "course_row_map.json") -> Tuple[int, int]:
+    gen_dir = _fork(artifact_dir, vect_name, matrix_name, map_name)
+    n_delta, nnz_delta = append_row_delta(_pjoin(gen_dir, matrix_name), rows, patch, shape)
+    changed = []
+    fields = {"delta": {"rows": n_delta, "nnz": nnz_delta}}
+    if row_map is not None:
+        _write_row_map(_pjoin(gen_dir, map_name), row_map)
+        changed.append(map_name)
+        fields["row_map"] = {"n_courses": len(row_map)}
+    manifest = read_manifest(gen_dir) or {}
+    matrix = manifest.get("matrix") or _npz_stats(_pjoin(gen_dir, matrix_name))
+    fields["matrix"] = dict(matrix, shape=[int(x) for x in shape])
+    _publish_fork(artifact_dir, gen_dir, changed, (vect_name, matrix_name, map_name), **fields)
+    return n_delta, nnz_delta
+
+# Số hàng đang nằm trong delta của ma trận TF-IDF
+def matrix_delta_rows(artifact_dir: str, matrix_name: str = "tfidf_matrix.npz") -> int:
+    delta = load_row_delta(_pjoin(tfidf_dir(artifact_dir), matrix_name))
+    return 0 if delta is None else int(delta[0].size)
+
+# Gộp delta vào tfidf_matrix.npz trong generation mới (manifest ghi lại checksum / nnz của ma trận mới)
+def compact_matrix(artifact_dir: str,
+                   vect_name: str = "tfidf_vectorizer.joblib",
+                   matrix_name: str = "tfidf_matrix.npz",
+                   map_name: str = "course_row_map.json") -> bool:
+    if load_row_delta(_pjoin(tfidf_dir(artifact_dir), matrix_name)) is None:
+        return False
+    gen_dir = _fork(artifact_dir, vect_name, matrix_name, map_name)
+    path = _pjoin(gen_dir, matrix_name)
+    compact_row_delta(path)
+    matrix = dict((read_manifest(gen_dir) or {}).get("matrix", {}), **_npz_stats(path))
+    _publish_fork(artifact_dir, gen_dir, [matrix_name], (vect_name, matrix_name, map_name),
+                  matrix=matrix, delta=None)
+    return True
+
+# Manifest của generation CURRENT nếu các file còn đủ (size khớp; checksums=True: so cả sha1).
+# None nếu chưa có generation (bố cục cũ) hoặc artifacts thiếu / hỏng.
+def load_manifest(artifact_dir: str, checksums: bool = False) -> Optional[Dict]:
+    d = current_dir(_root(artifact_dir))
+    if d is None:
+        return None
+    manifest = read_manifest(d)
+    if manifest is None or not verify_generation(d, manifest, checksums=checksums):
+        return None
+    return manifest
 
-# Tải artifacts TF-IDF từ thư mục artifact_dir
+# Tải artifacts TF-IDF (vectorizer, matrix, row_map) từ cùng 1 generation
 def load_artifacts(artifact_dir: str,
                    vect_name: str = "tfidf_vectorizer.joblib",
                    matrix_name: str = "tfidf_matrix.npz",
                    map_name: str = "course_row_map.json"):
-    vectorizer = joblib.load(_pjoin(artifact_dir, vect_name))
-    matrix = sparse.load_npz(_pjoin(artifact_dir, matrix_name))
+    d = tfidf_dir(artifact_dir)
+    vectorizer = joblib.load(_pjoin(d, vect_name))
+    matrix = load_npz_with_delta(_pjoin(d, matrix_name))
 
-    with open(_pjoin(artifact_dir, map_name), "r", encoding="utf-8") as f:
+    with open(_pjoin(d, map_name), "r", encoding="utf-8") as f:
         row_map_raw = json.load(f)
 
     row_map = {int(k): int(v) for k, v in row_map_raw.items()}
@@ -2,18 +2,22 @@ import os
 import json
 from contextlib import contextmanager
 from django.db import connection
-from .cb.tfidf_builder import fit_tfidf_and_save, load_tfidf
+from .cb.tfidf_builder import fit_tfidf_and_save, load_tfidf_manifest
 from .cf.update import (
     rebuild_user_neighbors_full,
     rebuild_user_neighbors_streaming,
+    update_user_neighbors_incremental,
 )
-from .io.cf_store import load_user_neighbors_json
+from .cf.item_item import rebuild_item_item_matrix
+from .io.cf_store import load_user_neighbors_store, load_user_item_matrix
+from .config import CF_USE_BM25, CF_ENGINE
 
 ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
-MAP_PATH = os.path.join(ARTIFACT_DIR, "course_row_map.json")
 LOCK_PATH = os.path.join(ARTIFACT_DIR, "build.lock")
 
-CF_NEI_PATH = os.path.join(ARTIFACT_DIR, "cf_user_neighbors.json")
+CF_NEI_DIR = os.path.join(ARTIFACT_DIR, "cf_user_neighbors")  # generation CURRENT của neighbor store
+CF_NEI_FLAT_PATH = os.path.join(ARTIFACT_DIR, "cf_user_neighbors_uids.npy")  # bố cục phẳng cũ
+CF_NEI_LEGACY_PATH = os.path.join(ARTIFACT_DIR, "cf_user_neighbors.json")
 CF_LOCK_PATH = os.path.join(ARTIFACT_DIR, "cf_build.lock")
 CF_META_PATH = os.path.join(ARTIFACT_DIR, "cf_meta.json")  # lưu last_build_ts
 
@@ -29,19 +33,17 @@ def _user_count() -> int:
         cur.execute('SELECT COUNT(*) FROM "users"')
         return cur.fetchone()[0]
 
-def _artifact_ok() -> bool:
-    # 1) tồn tại file  2) load được  3) số hàng khớp số course hiện có
-    if not os.path.exists(MAP_PATH):
+def _artifact_ok(checksums: bool = False) -> bool:
+    # Chỉ đọc manifest của generation CURRENT (không nạp vectorizer / matrix):
+    # 1) đủ file, đúng size (checksums=True: đúng sha1)  2) ma trận có hàng  3) số course khớp DB
+    manifest = load_tfidf_manifest(checksums=checksums)
+    if manifest is None:
         return False
     try:
-        vec, X, row_map = load_tfidf()
-        if X.shape[0] <= 0:
+        if manifest["matrix"]["shape"][0] <= 0:
             return False
-        with open(MAP_PATH, "r", encoding="utf-8") as f:
-            m = json.load(f)
-        mapped = len(m)
-        return (mapped == _course_count())
-    except Exception:
+        return manifest["row_map"]["n_courses"] == _course_count()
+    except (KeyError, IndexError, TypeError):
         return False
     
 def _latest_interaction_ts() -> str | None:
@@ -62,15 +64,15 @@ def _latest_interaction_ts() -> str | None:
     return row[0].isoformat()
 
 def _cf_artifact_ok() -> bool:
-    if not os.path.exists(CF_NEI_PATH):
+    if not any(os.path.exists(p) for p in (CF_NEI_DIR, CF_NEI_FLAT_PATH, CF_NEI_LEGACY_PATH)):
         return False
     try:
-        # file tồn tại và load được, có ít nhất 1 user có neighbors
-        neighbors = load_user_neighbors_json(ARTIFACT_DIR)
-        if not isinstance(neighbors, dict):
+        # store nhị phân (hoặc JSON cũ -> migrate) load được, có ít nhất 1 user
+        store = load_user_neighbors_store(ARTIFACT_DIR)
+        if store is None:
             return False
         # không bắt buộc phải đủ mọi user, nhưng tối thiểu có nội dung
-        if len(neighbors) == 0:
+        if len(store) == 0:
             return False
         return True
     except Exception:
@@ -100,15 +102,15 @@ def file_lock(path: str):
             pass
         f.close()
 
-def ensure_tfidf_artifacts(force: bool = False) -> dict | None:
+def ensure_tfidf_artifacts(force: bool = False, verify_checksums: bool = False) -> dict | None:
     """
     Gọi ở startup. An toàn khi nhiều worker nhờ file-lock:
-    - Nếu artifacts hợp lệ: return None (không làm gì)
+    - Nếu artifacts hợp lệ (theo manifest; verify_checksums=True: băm lại file): return None
     - Nếu thiếu/hỏng hoặc force=True: fit và lưu
     - Tự động build ma trận course-course similarity
     """
     os.makedirs(ARTIFACT_DIR, exist_ok=True)
-    if not force and _artifact_ok():
+    if not force and _artifact_ok(checksums=verify_checksums):
         # Kiểm tra xem ma trận similarity có tồn tại không
         from api.services.reco_service.cb.similarity import (
             load_course_similarity_matrix,
@@ -126,7 +128,7 @@ def ensure_tfidf_artifacts(force: bool = False) -> dict | None:
     try:
         with file_lock(LOCK_PATH):
             # Double-check sau khi chiếm lock (tránh 2 tiến trình cùng build)
-            if not force and _artifact_ok():
+            if not force and _artifact_ok(checksums=verify_checksums):
                 return None
             info = fit_tfidf_and_save()
             return info
@@ -134,10 +136,17 @@ def ensure_tfidf_artifacts(force: bool = False) -> dict | None:
         # Có tiến trình khác đang build; bỏ qua
         return None
     
+# CF_ENGINE = "item": dựng lại S item-item từ R vừa lưu bởi bước CF user-user (không đọc lại DB)
+def _rebuild_item_item(use_bm25: bool) -> dict | None:
+    M = load_user_item_matrix(ARTIFACT_DIR)
+    if M is None:
+        return None
+    return rebuild_item_item_matrix(artifact_dir=ARTIFACT_DIR, R=M.R, item_ids=M.item_ids, use_bm25=use_bm25)
+
 def ensure_cf_artifacts(
     force: bool = False,
     mode: str = "full",          # "full" | "streaming"
-    use_bm25: bool = False,
+    use_bm25: bool = CF_USE_BM25,
     shrink_beta: float | None = 50.0,
     k_neighbors: int = 200,
     min_sim: float = 0.0,
@@ -167,6 +176,8 @@ def ensure_cf_artifacts(
                     k_neighbors=k_neighbors,
                     min_sim=min_sim,
                 )
+            if CF_ENGINE == "item":
+                stats["item_item"] = _rebuild_item_item(use_bm25)
             # cập nhật meta
             meta = {
                 "last_build_ts": _latest_interaction_ts(),
@@ -185,7 +196,7 @@ def ensure_cf_artifacts(
 
 def maybe_refresh_cf_artifacts_on_new_events(
     mode: str = "streaming",
-    use_bm25: bool = False,
+    use_bm25: bool = CF_USE_BM25,
     shrink_beta: float | None = 50.0,
     k_neighbors: int = 200,
     min_sim: float = 0.0,
@@ -194,6 +205,8 @@ def maybe_refresh_cf_artifacts_on_new_events(
     Dùng trong cron/command chạy mỗi 10' :
     - Nếu có sự kiện Enroll/Favorite mới (sau last_build_ts) -> rebuild CF.
       Mặc định dùng 'streaming' để nhẹ RAM.
+    - mode='incremental': chỉ tính lại neighbors của user bị ảnh hưởng bởi sự kiện mới
+      (tự rebuild streaming khi delta quá lớn, xem cf/update.update_user_neighbors_incremental).
     """
     os.makedirs(ARTIFACT_DIR, exist_ok=True)
     latest = _latest_interaction_ts()
@@ -226,7 +239,15 @@ def maybe_refresh_cf_artifacts_on_new_events(
             if not need:
                 return None
 
-            if mode == "streaming":
+            if mode == "incremental":
+                stats = update_user_neighbors_incremental(
+                    artifact_dir=ARTIFACT_DIR,
+                    use_bm25=use_bm25,
+                    shrink_beta=shrink_beta,
+                    k_neighbors=k_neighbors,
+                    min_sim=min_sim,
+                )
+            elif mode == "streaming":
                 stats = rebuild_user_neighbors_streaming(
                     artifact_dir=ARTIFACT_DIR,
                     use_bm25=use_bm25,
@@ -242,9 +263,11 @@ def maybe_refresh_cf_artifacts_on_new_events(
                     k_neighbors=k_neighbors,
                     min_sim=min_sim,
                 )
+            if CF_ENGINE == "item":
+                stats["item_item"] = _rebuild_item_item(use_bm25)
             meta = {
                 "last_build_ts": latest,
-                "mode": mode,
+                "mode": stats.get("mode", mode),
                 "k_neighbors": k_neighbors,
                 "use_bm25": use_bm25,
                 "shrink_beta": shrink_beta,
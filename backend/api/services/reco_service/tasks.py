@@ -1,12 +1,33 @@
 from celery import shared_task
-from services.reco_service.startup import maybe_refresh_cf_artifacts_on_new_events
+from api.services.reco_service.startup import maybe_refresh_cf_artifacts_on_new_events
 from api.services.reco_service.config import CF_K_NEIGHBORS, MIN_SIM_CF
 
 @shared_task
 def update_cf_neighbors_task():
     maybe_refresh_cf_artifacts_on_new_events(
-        mode="streaming",
+        mode="incremental",
         shrink_beta=50.0,
         k_neighbors=CF_K_NEIGHBORS,
         min_sim=MIN_SIM_CF
-    )
\ No newline at end of file
+    )
+
+# Áp các cập nhật course đang chờ (đã debounce) vào TF-IDF / course similarity theo lô.
+# Được hẹn bởi cb/update_queue.enqueue_course_update (signal lưu course), không chạy theo lịch.
+# ignore_result: không cần result backend khi hẹn task (apply_async chạy trong request lưu course).
+@shared_task(ignore_result=True)
+def apply_pending_course_updates_task():
+    from api.services.reco_service.cb.update_queue import process_pending_course_updates
+    return process_pending_course_updates()
+
+# Gộp delta segment của TF-IDF / course similarity vào ma trận gốc
+# (Celery beat, mỗi ngày lúc CB_DELTA_COMPACT_HOUR giờ UTC; giữ lock ghi chung với hàng đợi cập nhật)
+@shared_task
+def compact_cb_deltas_task():
+    from api.services.reco_service.cb.update_queue import compact_course_deltas
+    return compact_course_deltas()
+
+# Làm mới bảng xếp hạng course phổ biến (Celery beat, mỗi POPULARITY_REFRESH_MINUTES phút)
+@shared_task
+def refresh_popularity_task():
+    from api.services.reco_service.data_access.popularity import refresh_popularity
+    return refresh_popularity()
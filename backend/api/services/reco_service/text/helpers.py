@@ -2,7 +2,7 @@ from __future__ import annotations
 import io
 import os
 from functools import lru_cache
-from typing import Dict, Set, Tuple
+from typing import Any, Dict, Optional, Set, Tuple
 
 # Đổi lại nếu bạn để file ở nơi khác
 DEFAULT_ALIAS_1GRAM_PATH = "alias_map_1gram.txt"
@@ -25,8 +25,37 @@ def load_alias_map_1gram(path: str = DEFAULT_ALIAS_1GRAM_PATH) -> Dict[str, str]
         m[alias.strip().lower()] = canon.strip().lower()
     return m
 
+# Trie token cho phrase map: node = {token: node_con}, node kết thúc 1 phrase (>= 2 token)
+# giữ canonical ở key PHRASE_END -> so khớp phrase dài nhất trong 1 lượt duyệt, không dựng tuple.
+PHRASE_END = None
+
+def build_phrase_trie(phrase_map: Dict[Tuple[str, ...], str]) -> Dict[Any, Any]:
+    root: Dict[Any, Any] = {}
+    for tokens, canon in phrase_map.items():
+        if len(tokens) < 2:
+            continue  # phrase 1 token không được merge (xem _apply_phrase_map)
+        node = root
+        for tk in tokens:
+            node = node.setdefault(tk, {})
+        node[PHRASE_END] = canon
+    return root
+
+class PhraseMap(dict):
+    """
+    {tuple(tokens): canonical} kèm trie đã compile (thuộc tính `trie`), dựng 1 lần khi nạp.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.trie = build_phrase_trie(self)
+
+# Trie của phrase_map: dùng bản đã compile nếu có (PhraseMap), ngược lại dựng mới
+def phrase_trie(phrase_map: Dict[Tuple[str, ...], str]) -> Dict[Any, Any]:
+    trie: Optional[Dict[Any, Any]] = getattr(phrase_map, "trie", None)
+    return trie if trie is not None else build_phrase_trie(phrase_map)
+
 @lru_cache(maxsize=1)
-def load_phrase_map(path: str = DEFAULT_PHRASE_MAP_PATH) -> Dict[Tuple[str, ...], str]:
+def load_phrase_map(path: str = DEFAULT_PHRASE_MAP_PATH) -> PhraseMap:
     m: Dict[Tuple[str, ...], str] = {}
     for ln in _read_lines(path):
         if "\t" not in ln:
@@ -35,7 +64,7 @@ def load_phrase_map(path: str = DEFAULT_PHRASE_MAP_PATH) -> Dict[Tuple[str, ...]
         tokens = tuple(t for t in left.strip().lower().split(" ") if t)
         if tokens:
             m[tokens] = canon.strip().lower()
-    return m
+    return PhraseMap(m)
 
 @lru_cache(maxsize=1)
 def load_tech_whitelist(path: str = DEFAULT_TECH_WHITELIST_PATH) -> Set[str]:
@@ -0,0 +1,186 @@
+"""
+Benchmark tokenizer trên corpus khóa học:
+- test_phrase_matcher: vòng lặp tuple cũ vs trie (text/tokenizer._apply_phrase_map),
+  dữ liệu là token (đã lowercase) trước bước phrase merge.
+- test_tokenize_throughput: normalize cũ (alias / stopword / regex từng token) vs pipeline đã
+  compile (tokenizer._Pipeline) trên token đã tách sẵn, và docs/sec end-to-end
+  (vn_tokenize cũ vs vn_tokenize_many; phần lớn thời gian là word_tokenize của underthesea).
+
+Chạy test:
+    python manage.py shell -c "from api.services.reco_service.text.performance_test import test_phrase_matcher; test_phrase_matcher()"
+    python manage.py shell -c "from api.services.reco_service.text.performance_test import test_tokenize_throughput; test_tokenize_throughput()"
+"""
+import re
+import time
+from html import unescape
+from typing import List
+from underthesea import word_tokenize
+from api.services.reco_service.data_access.courses import fetch_courses_with_categories
+from api.services.reco_service.text.helpers import (
+    build_document_text, load_alias_map_1gram, load_phrase_map, load_tech_whitelist, load_stopwords
+)
+from api.services.reco_service.text.preprocess import strip_markup, CODE_PATTERN, TAG_PATTERN, WS_PATTERN
+from api.services.reco_service.text.tokenizer import _Pipeline, _apply_phrase_map, vn_tokenize_many
+
+# Cách cũ (trước khi dùng trie): mỗi vị trí dựng tuple cho mọi độ dài từ max_len về 2
+def _apply_phrase_map_loop(tokens: List[str], phrase_map: dict) -> List[str]:
+    if not phrase_map:
+        return tokens
+    out: List[str] = []
+    i, n = 0, len(tokens)
+    max_len = max((len(k) for k in phrase_map.keys()), default=1)
+    while i < n:
+        matched = False
+        for L in range(min(max_len, n - i), 1, -1):
+            tup = tuple(tokens[i:i+L])
+            if tup in phrase_map:
+                out.append(phrase_map[tup])
+                i += L
+                matched = True
+                break
+        if not matched:
+            out.append(tokens[i])
+            i += 1
+    return out
+
+# strip_markup cũ: luôn chạy unescape + 3 regex
+def _strip_markup_old(text: str) -> str:
+    if not text:
+        return ""
+    code_spans = {}
+    def _hold(m):
+        key = f"__CODESPAN_{len(code_spans)}__"
+        code_spans[key] = m.group(0)
+        return key
+    text = unescape(text)
+    text = CODE_PATTERN.sub(_hold, text)
+    text = TAG_PATTERN.sub(" ", text)
+    text = text.replace("\u00a0", " ")
+    text = WS_PATTERN.sub(" ", text).strip()
+    for k, v in code_spans.items():
+        text = text.replace(k, v)
+    return text
+
+# normalize cũ (trước pipeline compile): tra lại cấu hình, alias / stopword / chuẩn hoá từng token
+def _normalize_old(raw: List[str]) -> List[str]:
+    alias_map_1gram = load_alias_map_1gram()
+    phrase_map = load_phrase_map()
+    tech_whitelist = load_tech_whitelist()
+    stopwords = load_stopwords()
+    lowered: List[str] = []
+    for tk in raw:
+        if tk.startswith("`") and tk.endswith("`"):
+            lowered.append(tk.strip("`").lower())
+            continue
+        t = alias_map_1gram.get(tk.lower(), tk.lower())
+        if t in stopwords and t not in tech_whitelist:
+            continue
+        lowered.append(t)
+    merged = _apply_phrase_map_loop(lowered, phrase_map)
+    final: List[str] = []
+    for t in merged:
+        if not t or t.isspace():
+            continue
+        t = t.replace(" ", "_").replace(".", "_").replace("-", "_").replace("/", "_")
+        final.append(re.sub(r"_+", "_", t).strip("_"))
+    return [t for t in final if t and t[0].isalnum()]
+
+def _vn_tokenize_old(text: str) -> List[str]:
+    if not text:
+        return []
+    return _normalize_old(word_tokenize(_strip_markup_old(text), format="text").split())
+
+def _corpus_texts() -> List[str]:
+    return [build_document_text(r["title"], r["description"], r["categories"]) for r in fetch_courses_with_categories()]
+
+def test_tokenize_throughput(n_runs: int = 5):
+    """So sánh throughput normalize (token đã tách) và docs/sec end-to-end, cũ vs mới."""
+    print("=" * 70)
+    print("BENCHMARK: tokenize corpus (vn_tokenize cũ vs vn_tokenize_many)")
+    print("=" * 70)
+
+    texts = _corpus_texts()
+    if not texts:
+        print("❌ Không có khóa học nào.")
+        return
+    word_tokenize("khởi động model")  # nạp model CRF trước khi đo
+    raws = [word_tokenize(strip_markup(t), format="text").split() for t in texts]
+    n_tokens = sum(len(r) for r in raws)
+    print(f"\n📊 {len(texts)} văn bản, {n_tokens:,} token")
+
+    # 1) chỉ bước normalize, trên token đã tách sẵn (trung bình n_runs lần)
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        norm_old = [_normalize_old(r) for r in raws]
+    t_norm_old = (time.perf_counter() - start) / n_runs
+
+    pipeline = _Pipeline(load_alias_map_1gram(), load_phrase_map(), load_tech_whitelist(), load_stopwords())
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        norm_new = [pipeline.tokens(r) for r in raws]
+    t_norm_new = (time.perf_counter() - start) / n_runs
+
+    print(f"\n📈 Normalize (trung bình {n_runs} lần):")
+    print(f"   - Cũ      : {t_norm_old * 1000:.1f}ms ({n_tokens / t_norm_old / 1e6:.2f}M token/s)")
+    print(f"   - Pipeline: {t_norm_new * 1000:.1f}ms ({n_tokens / t_norm_new / 1e6:.2f}M token/s)")
+    print(f"   - Cải thiện: x{t_norm_old / max(t_norm_new, 1e-9):.1f}")
+    print(f"   - Kết quả giống nhau: {'✅' if norm_old == norm_new else '❌'}")
+
+    # 2) end-to-end (gồm word_tokenize của underthesea)
+    start = time.perf_counter()
+    old = [_vn_tokenize_old(t) for t in texts]
+    t_old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = vn_tokenize_many(texts)
+    t_new = time.perf_counter() - start
+
+    print(f"\n📈 End-to-end:")
+    print(f"   - vn_tokenize cũ  : {len(texts) / t_old:.1f} docs/s")
+    print(f"   - vn_tokenize_many: {len(texts) / t_new:.1f} docs/s")
+    print(f"   - Kết quả giống nhau: {'✅' if old == new else '❌'}")
+
+    print("\n" + "=" * 70)
+    print("✅ Test hoàn tất!")
+    print("=" * 70)
+
+def test_phrase_matcher(n_runs: int = 5):
+    """So sánh tốc độ và kết quả 2 cách merge phrase trên corpus khóa học."""
+    print("=" * 70)
+    print("MICRO-BENCHMARK: phrase matcher (tuple loop vs trie)")
+    print("=" * 70)
+
+    rows = fetch_courses_with_categories()
+    if not rows:
+        print("❌ Không có khóa học nào.")
+        return
+    docs = [
+        [t.lower() for t in word_tokenize(strip_markup(build_document_text(r["title"], r["description"], r["categories"])), format="text").split()]
+        for r in rows
+    ]
+    phrase_map = load_phrase_map()
+    n_tokens = sum(len(d) for d in docs)
+    print(f"\n📊 {len(docs)} văn bản, {n_tokens:,} token, {len(phrase_map)} phrase")
+
+    def _run(fn):
+        start = time.perf_counter()
+        for _ in range(n_runs):
+            out = [fn(d, phrase_map) for d in docs]
+        return (time.perf_counter() - start) / n_runs, out
+
+    t_loop, out_loop = _run(_apply_phrase_map_loop)
+    t_trie, out_trie = _run(_apply_phrase_map)
+
+    print(f"\n📈 Kết quả (trung bình {n_runs} lần):")
+    print(f"   - Tuple loop: {t_loop * 1000:.1f}ms ({n_tokens / t_loop / 1e6:.2f}M token/s)")
+    print(f"   - Trie      : {t_trie * 1000:.1f}ms ({n_tokens / t_trie / 1e6:.2f}M token/s)")
+    print(f"   - Cải thiện : x{t_loop / max(t_trie, 1e-9):.1f}")
+    print(f"   - Kết quả giống nhau: {'✅' if out_loop == out_trie else '❌'}")
+
+    print("\n" + "=" * 70)
+    print("✅ Test hoàn tất!")
+    print("=" * 70)
+
+if __name__ == "__main__":
+    test_phrase_matcher()
+    test_tokenize_throughput()
@@ -9,6 +9,9 @@ WS_PATTERN   = re.compile(r"\s+")
 def strip_markup(text: str) -> str:
     if not text:
         return ""
+    # không có entity / tag / code span -> chỉ cần gộp khoảng trắng (str.split() tách cả \u00a0)
+    if "&" not in text and "<" not in text and "`" not in text:
+        return " ".join(text.split())
     code_spans = {}
     def _hold(m):
         key = f"__CODESPAN_{len(code_spans)}__"
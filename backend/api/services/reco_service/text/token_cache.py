@@ -0,0 +1,134 @@
+from __future__ import annotations
+import os
+import json
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+from .tokenizer import vn_tokenize, vn_tokenize_many
+from .helpers import (
+    DEFAULT_ALIAS_1GRAM_PATH, DEFAULT_PHRASE_MAP_PATH, DEFAULT_TECH_WHITELIST_PATH, DEFAULT_STOPWORDS_PATH
+)
+from api.services.reco_service.config import TOKENIZE_N_JOBS, TOKENIZE_PARALLEL_MIN_DOCS
+
+"""
+Cache tokenize cho corpus TF-IDF (fit toàn bộ):
+- Key = sha1(văn bản course) — văn bản dựng từ (title, description, categories) nên đổi bất kỳ
+  field nào cũng đổi key.
+- Cache gắn với version cấu hình tokenizer (TOKENIZER_VERSION + nội dung alias / phrase map /
+  whitelist / stopwords + version underthesea): đổi cấu hình -> bỏ toàn bộ cache.
+- Lưu ở <artifact_dir>/token_cache.json (ghi file tạm + os.replace), chỉ giữ các course hiện có.
+- Miss được tokenize song song bằng process pool (TOKENIZE_N_JOBS); ít miss hoặc không tạo
+  được process con (vd. Celery worker daemon) -> tokenize tuần tự.
+"""
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.getenv("RECO_ARTIFACT_DIR", "api/var/reco")
+CACHE_NAME = "token_cache.json"
+# Tăng khi đổi logic trong tokenizer.py / preprocess.py (file từ điển đã được hash tự động)
+TOKENIZER_VERSION = 1
+
+@lru_cache(maxsize=1)
+def tokenizer_config_version() -> str:
+    h = hashlib.sha1(f"v{TOKENIZER_VERSION}".encode("utf-8"))
+    try:
+        from underthesea import __version__ as uts_version
+    except ImportError:
+        uts_version = "?"
+    h.update(str(uts_version).encode("utf-8"))
+    base = os.path.dirname(__file__)
+    for name in (DEFAULT_ALIAS_1GRAM_PATH, DEFAULT_PHRASE_MAP_PATH, DEFAULT_TECH_WHITELIST_PATH, DEFAULT_STOPWORDS_PATH):
+        with open(os.path.join(base, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def content_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+# Văn bản -> chuỗi token cách nhau bởi khoảng trắng (dạng doc đưa vào TfidfVectorizer)
+def tokenize_doc(text: str) -> str:
+    return " ".join(vn_tokenize(text))
+
+# Tokenize 1 lô văn bản (đơn vị công việc của process pool)
+def _tokenize_chunk(texts: List[str]) -> List[str]:
+    return [" ".join(toks) for toks in vn_tokenize_many(texts)]
+
+def _cache_path(artifact_dir: str) -> str:
+    return os.path.join(artifact_dir, CACHE_NAME)
+
+def _load_cache(artifact_dir: str) -> Dict[str, str]:
+    try:
+        with open(_cache_path(artifact_dir), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if data.get("version") != tokenizer_config_version():
+        return {}
+    return data.get("docs", {})
+
+def _save_cache(artifact_dir: str, docs: Dict[str, str]) -> None:
+    os.makedirs(artifact_dir, exist_ok=True)
+    path = _cache_path(artifact_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": tokenizer_config_version(), "docs": docs}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _tokenize_parallel(texts: List[str], n_jobs: int):
+    from concurrent.futures import ProcessPoolExecutor
+    size = max(1, -(-len(texts) // (n_jobs * 4)))  # ~4 lô / process
+    chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as ex:
+            return [doc for part in ex.map(_tokenize_chunk, chunks) for doc in part]
+    except (AssertionError, OSError, RuntimeError):
+        # daemonic process không được tạo process con
+        return None
+
+def tokenize_many(
+    texts: Sequence[str],
+    n_jobs: int = TOKENIZE_N_JOBS,
+    min_parallel: int = TOKENIZE_PARALLEL_MIN_DOCS,
+) -> List[str]:
+    """
+    Tokenize nhiều văn bản (không cache), song song nếu đủ nhiều.
+    """
+    texts = list(texts)
+    n_jobs = int(n_jobs or 1)
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    out = None
+    if n_jobs > 1 and len(texts) >= max(2, int(min_parallel)):
+        out = _tokenize_parallel(texts, n_jobs)
+    if out is None:
+        out = _tokenize_chunk(texts)
+    return out
+
+def tokenize_corpus(
+    texts: Sequence[str],
+    artifact_dir: str = ARTIFACT_DIR,
+    n_jobs: int = TOKENIZE_N_JOBS,
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Tokenize corpus qua cache trên đĩa: chỉ văn bản mới / đã đổi mới được tokenize lại.
+    Trả (docs theo đúng thứ tự texts, stats).
+    """
+    cache = _load_cache(artifact_dir)
+    keys = [content_key(t) for t in texts]
+    miss_keys: Dict[str, str] = {}
+    for k, t in zip(keys, texts):
+        if k not in cache and k not in miss_keys:
+            miss_keys[k] = t
+
+    if miss_keys:
+        tokenized = tokenize_many(list(miss_keys.values()), n_jobs=n_jobs)
+        cache.update(zip(miss_keys.keys(), tokenized))
+
+    docs = [cache[k] for k in keys]
+    # chỉ giữ các course hiện có (bỏ bản tokenize của nội dung cũ)
+    try:
+        _save_cache(artifact_dir, {k: cache[k] for k in keys})
+    except OSError as ex:
+        logger.warning(f"token cache save failed: {ex}")
+    return docs, {"docs": len(keys), "cache_hits": len(keys) - len(miss_keys), "tokenized": len(miss_keys)}
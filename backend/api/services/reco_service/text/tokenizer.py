@@ -1,42 +1,127 @@
 from __future__ import annotations
-from typing import List
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
 import re
 from underthesea import word_tokenize
 from .preprocess import strip_markup
-from .helpers import load_alias_map_1gram, load_phrase_map, load_tech_whitelist, load_stopwords
+from .helpers import load_alias_map_1gram, load_phrase_map, load_tech_whitelist, load_stopwords, phrase_trie, PHRASE_END
+
+_CANON_TABLE = str.maketrans({" ": "_", ".": "_", "-": "_", "/": "_"})
+_MULTI_UNDERSCORE = re.compile(r"_+")
+_FINAL_MEMO_MAX = 200_000 # số token tối đa giữ trong memo chuẩn hoá của mỗi pipeline
+_MISSING = object()
 
 # Chuyển các ký tự đặc biệt thành '_'
 def _canonical_token_safe(token: str) -> str:
-    t = token.replace(" ", "_").replace(".", "_").replace("-", "_").replace("/", "_")
-    t = re.sub(r"_+", "_", t).strip("_")
-    return t
-
-# Áp dụng alias 1-gram vào token
-def _apply_alias_1gram(token: str, alias_map: dict) -> str:
-    return alias_map.get(token, token)
+    t = token.translate(_CANON_TABLE)
+    if "__" in t:
+        t = _MULTI_UNDERSCORE.sub("_", t)
+    return t.strip("_")
 
 # Áp dụng phrase map (multi-word) vào danh sách token đã lowercase
+# Duyệt trie từ mỗi vị trí, giữ phrase dài nhất khớp được (greedy, trái -> phải)
 def _apply_phrase_map(tokens: List[str], phrase_map: dict) -> List[str]:
     if not phrase_map:
         return tokens
-    
+    return _merge_phrases(tokens, phrase_trie(phrase_map))
+
+def _merge_phrases(tokens: List[str], trie: Dict[Any, Any]) -> List[str]:
     out: List[str] = []
     i, n = 0, len(tokens)
-    max_len = max((len(k) for k in phrase_map.keys()), default=1)
     while i < n:
-        matched = False
-        for L in range(min(max_len, n - i), 1, -1):
-            tup = tuple(tokens[i:i+L])
-            if tup in phrase_map:
-                out.append(phrase_map[tup])
-                i += L
-                matched = True
+        node = trie.get(tokens[i])
+        best, best_end = None, i + 1
+        j = i + 1
+        while node is not None:
+            canon = node.get(PHRASE_END)
+            if canon is not None:
+                best, best_end = canon, j
+            if j >= n:
                 break
-        if not matched:
-            out.append(tokens[i])
-            i += 1
+            node = node.get(tokens[j])
+            j += 1
+        out.append(tokens[i] if best is None else best)
+        i = best_end
     return out
 
+# Token sau phrase merge -> token cuối (None = bỏ): chuẩn hoá an toàn, bỏ rỗng / ký tự đặc biệt
+def _finalize_token(t: str) -> Optional[str]:
+    if not t or t.isspace():
+        return None
+    safe = _canonical_token_safe(t)
+    return safe if safe and safe[0].isalnum() else None
+
+class _Pipeline:
+    """
+    Cấu hình normalize đã compile 1 lần:
+    - pre: {token lowercase: token sau alias 1-gram, hoặc None nếu là stopword (không thuộc whitelist)}
+      -> alias + lọc stopword = 1 lần tra dict / token
+    - trie: phrase map đã compile
+    - final: memo token sau phrase merge -> token cuối (translate table + strip), token lặp lại
+      giữa các văn bản không phải chuẩn hoá lại
+    """
+
+    def __init__(self, alias_map_1gram: dict, phrase_map: dict, tech_whitelist: set, stopwords: set):
+        drop = set(stopwords) - set(tech_whitelist)
+        self.pre: Dict[str, Optional[str]] = dict.fromkeys(drop)
+        for alias, canon in alias_map_1gram.items():
+            self.pre[alias] = None if canon in drop else canon
+        self.trie = phrase_trie(phrase_map) if phrase_map else None
+        self.final: Dict[str, Optional[str]] = {}
+
+    def tokens(self, raw: Iterable[str]) -> List[str]:
+        pre = self.pre
+        lowered: List[str] = []
+        for tk in raw:
+            # giữ code inline `...` nhưng vẫn lowercase để đồng nhất
+            if tk.startswith("`") and tk.endswith("`"):
+                lowered.append(tk.strip("`").lower())
+                continue
+            t = tk.lower()
+            t = pre.get(t, t)  # alias đơn, None = stopword
+            if t is not None:
+                lowered.append(t)
+
+        # phrase merge (alias đa từ: ví dụ ["asp",".net","core"] -> "asp.net core")
+        merged = _merge_phrases(lowered, self.trie) if self.trie else lowered
+
+        final = self.final
+        if len(final) > _FINAL_MEMO_MAX:
+            final.clear()
+        out: List[str] = []
+        for t in merged:
+            f = final.get(t, _MISSING)
+            if f is _MISSING:
+                f = final[t] = _finalize_token(t)
+            if f is not None:
+                out.append(f)
+
+        # (tuỳ chọn) ưu tiên whitelist: hiện tại ta chỉ giữ để tham khảo.
+        # Nếu muốn tăng "trọng số" whitelist, có thể nhân bản token whitelist (e.g., append thêm lần nữa).
+        # example:
+        # boosted = []
+        # for t in out:
+        #     boosted.append(t)
+        #     if t.replace("_", " ") in tech_whitelist:
+        #         boosted.append(t)   # nhân đôi tần suất
+        # return boosted
+        return out
+
+@lru_cache(maxsize=1)
+def _default_pipeline() -> _Pipeline:
+    return _Pipeline(load_alias_map_1gram(), load_phrase_map(), load_tech_whitelist(), load_stopwords())
+
+# Pipeline theo cấu hình truyền vào (tham số rỗng -> dùng cấu hình mặc định, như trước)
+def _pipeline_for(alias_map_1gram, phrase_map, tech_whitelist, stopwords) -> _Pipeline:
+    if not (alias_map_1gram or phrase_map or tech_whitelist or stopwords):
+        return _default_pipeline()
+    return _Pipeline(
+        alias_map_1gram or load_alias_map_1gram(),
+        phrase_map or load_phrase_map(),
+        tech_whitelist or load_tech_whitelist(),
+        stopwords or load_stopwords(),
+    )
+
 # Tokenizer với dash giữa từ sử dụng underthesea
 def vn_tokenize(text: str,
                 alias_map_1gram: dict | None = None,
@@ -45,53 +130,27 @@ def vn_tokenize(text: str,
                 stopwords: set | None = None) -> List[str]:
     if not text:
         return []
+    pipeline = _pipeline_for(alias_map_1gram, phrase_map, tech_whitelist, stopwords)
+    # strip markup -> word_tokenize (underthesea) -> normalize
+    return pipeline.tokens(word_tokenize(strip_markup(text), format="text").split())
 
-    # Nạp cấu hình nếu chưa truyền vào
-    alias_map_1gram = alias_map_1gram or load_alias_map_1gram()
-    phrase_map      = phrase_map      or load_phrase_map()
-    tech_whitelist  = tech_whitelist  or load_tech_whitelist()
-    stopwords       = stopwords       or load_stopwords()   
-
-    # Tiền xử lý: strip markup
-    text = strip_markup(text)
-
-    # tokenize với word_tokenize của underthesea
-    raw = word_tokenize(text, format="text").split()
-
-    # lowercase + alias 1-gram + bỏ stopword
-    lowered: List[str] = []
-    for tk in raw:
-        # giữ code inline `...` nhưng vẫn lowercase để đồng nhất
-        if tk.startswith("`") and tk.endswith("`"):
-            lowered.append(tk.strip("`").lower())
-            continue
-        t = tk.lower()
-        t = _apply_alias_1gram(t, alias_map_1gram)  # alias đơn
-        if t in stopwords and t not in tech_whitelist:
+# Tokenize nhiều văn bản với cùng 1 pipeline đã compile; văn bản trùng nhau chỉ tokenize 1 lần
+def vn_tokenize_many(texts: Iterable[str],
+                     alias_map_1gram: dict | None = None,
+                     phrase_map: dict | None = None,
+                     tech_whitelist: set | None = None,
+                     stopwords: set | None = None) -> List[List[str]]:
+    pipeline = _pipeline_for(alias_map_1gram, phrase_map, tech_whitelist, stopwords)
+    done: Dict[str, List[str]] = {}
+    out: List[List[str]] = []
+    for text in texts:
+        if not text:
+            out.append([])
             continue
-        lowered.append(t)
-
-    # phrase merge (alias đa từ: ví dụ ["asp",".net","core"] -> "asp.net core")
-    merged = _apply_phrase_map(lowered, phrase_map)
-
-    # chuẩn hoá token an toàn, lọc rỗng
-    final: List[str] = []
-    for t in merged:
-        if not t or t.isspace():
-            continue
-        safe = _canonical_token_safe(t)
-        final.append(safe)
-
-    # (tuỳ chọn) ưu tiên whitelist: hiện tại ta chỉ giữ để tham khảo.
-    # Nếu muốn tăng "trọng số" whitelist, có thể nhân bản token whitelist (e.g., append thêm lần nữa).
-    # example:
-    # boosted = []
-    # for t in final:
-    #     boosted.append(t)
-    #     if t.replace("_", " ") in tech_whitelist:
-    #         boosted.append(t)   # nhân đôi tần suất
-    # return boosted
-
-    # Loại bỏ ký tự đặc biệt
-    final = [t for t in final if t and t[0].isalnum()]
-    return final
+        toks = done.get(text)
+        if toks is None:
+            toks = done[text] = pipeline.tokens(word_tokenize(strip_markup(text), format="text").split())
+        else:
+            toks = list(toks)
+        out.append(toks)
+    return out
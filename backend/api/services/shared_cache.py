@@ -0,0 +1,154 @@
+from __future__ import annotations
+import math
+import time
+import uuid
+import random
+import logging
+from typing import Any, Callable, Optional, Tuple
+from django.core.cache import cache
+
+"""
+Cache dùng chung giữa các worker (Django cache -> Redis, xem CACHES trong settings)
+cho các payload tốn kém: kết quả gợi ý, chi tiết course, signed URL.
+
+- Single-flight: khi key hết hạn chỉ 1 tiến trình giữ lock (cache.add) và tính lại;
+  các tiến trình khác trả bản cũ (nếu còn) hoặc chờ ngắn rồi đọc lại, không tính trùng.
+- Probabilistic early refresh (XFetch): giá trị lưu kèm thời gian tính (delta) và thời điểm
+  hết hạn logic; mỗi lần đọc được chọn tính lại sớm với xác suất tăng dần khi gần hết hạn:
+      now - delta * beta * ln(rand) >= expires_at
+  -> key nóng được làm mới trước khi hết hạn, tránh dồn miss đúng thời điểm TTL.
+- Bản ghi vật lý sống thêm STALE_GRACE giây sau hạn logic để có bản cũ trả cho request
+  đến trong lúc tiến trình khác đang tính lại.
+- Version key (`<base_key>:ver`): tăng để huỷ mọi biến thể của 1 đối tượng mà không quét key.
+  Key sống VERSION_TTL giây kể từ lần tăng cuối (dài hơn TTL của mọi kết quả dùng version),
+  hết hạn thì đọc ra 0; tạo lại thì bắt đầu từ mốc thời gian (ms) -> không trùng version cũ.
+- Lỗi Redis -> coi như miss / tính trực tiếp, không làm hỏng request.
+"""
+
+logger = logging.getLogger(__name__)
+
+EARLY_REFRESH_BETA = 1.0  # >1: làm mới sớm hơn, 0: tắt early refresh
+LOCK_TIMEOUT = 30  # giây; lock tự hết hạn nếu tiến trình tính lại bị chết
+LOCK_WAIT = 2.0  # giây chờ tối đa khi miss mà tiến trình khác đang tính
+LOCK_POLL = 0.05
+STALE_GRACE = 60  # giây giữ bản cũ sau hạn logic
+VERSION_TTL = 24 * 3600  # giây; phải dài hơn TTL dài nhất của kết quả dùng version (+ STALE_GRACE)
+
+# Trạng thái trả về của get_or_compute
+HIT, STALE, WAIT, MISS, REFRESH = "hit", "stale", "wait", "miss", "refresh"
+
+def _get(key: str) -> Any:
+    try:
+        return cache.get(key)
+    except Exception as ex:
+        logger.warning(f"shared cache get failed key={key}: {ex}")
+        return None
+
+def _set(key: str, value: Any, ttl: Optional[int]) -> None:
+    try:
+        cache.set(key, value, ttl)
+    except Exception as ex:
+        logger.warning(f"shared cache set failed key={key}: {ex}")
+
+def _lock_key(key: str) -> str:
+    return f"{key}:lock"
+
+# Lấy lock single-flight; trả token nếu lấy được. Redis lỗi -> coi như lấy được (tính trực tiếp).
+def _acquire(key: str, timeout: int) -> Optional[str]:
+    token = uuid.uuid4().hex
+    try:
+        return token if cache.add(_lock_key(key), token, timeout) else None
+    except Exception as ex:
+        logger.warning(f"shared cache lock failed key={key}: {ex}")
+        return token
+
+def _release(key: str, token: str) -> None:
+    try:
+        if cache.get(_lock_key(key)) == token:
+            cache.delete(_lock_key(key))
+    except Exception as ex:
+        logger.warning(f"shared cache unlock failed key={key}: {ex}")
+
+# Bản ghi hợp lệ: (value, delta, expires_at)
+def _unpack(entry: Any) -> Optional[Tuple[Any, float, float]]:
+    if isinstance(entry, tuple) and len(entry) == 3:
+        return entry
+    return None
+
+def _should_refresh(delta: float, expires_at: float, beta: float, now: float) -> bool:
+    if now >= expires_at:
+        return True
+    if beta <= 0 or delta <= 0:
+        return False
+    return now - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+def _compute_and_store(key: str, compute: Callable[[], Any], ttl: int, token: Optional[str]) -> Any:
+    try:
+        start = time.time()
+        value = compute()
+        end = time.time()
+        _set(key, (value, end - start, end + ttl), ttl + STALE_GRACE)
+        return value
+    finally:
+        if token is not None:
+            _release(key, token)
+
+# Ghi sẵn giá trị đã tính ngoài get_or_compute (vd. job làm mới định kỳ); delta = thời gian tính ước lượng
+# cho early refresh
+def put(key: str, value: Any, ttl: int, delta: float = 0.0) -> None:
+    _set(key, (value, float(delta), time.time() + ttl), ttl + STALE_GRACE)
+
+# Đọc key qua cache dùng chung; hết hạn / được chọn refresh sớm -> chỉ 1 tiến trình gọi compute().
+# Trả (value, trạng thái: HIT | STALE | WAIT | MISS | REFRESH).
+def get_or_compute(
+    key: str,
+    compute: Callable[[], Any],
+    ttl: int,
+    beta: float = EARLY_REFRESH_BETA,
+    lock_timeout: int = LOCK_TIMEOUT,
+    wait: float = LOCK_WAIT,
+) -> Tuple[Any, str]:
+    entry = _unpack(_get(key))
+    if entry is not None:
+        value, delta, expires_at = entry
+        if not _should_refresh(delta, expires_at, beta, time.time()):
+            return value, HIT
+        token = _acquire(key, lock_timeout)
+        if token is None:
+            return value, STALE  # tiến trình khác đang tính lại
+        return _compute_and_store(key, compute, ttl, token), REFRESH
+
+    token = _acquire(key, lock_timeout)
+    if token is not None:
+        return _compute_and_store(key, compute, ttl, token), MISS
+
+    # tiến trình khác đang tính -> chờ kết quả của nó
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        entry = _unpack(_get(key))
+        if entry is not None:
+            return entry[0], WAIT
+    # quá thời gian chờ -> tự tính (không ghi đè lock của tiến trình kia)
+    return _compute_and_store(key, compute, ttl, None), MISS
+
+# ---------------- version key ----------------
+def version_key(base_key: str) -> str:
+    return f"{base_key}:ver"
+
+def get_version(base_key: str) -> int:
+    v = _get(version_key(base_key))
+    return int(v) if v else 0
+
+# Tăng version -> mọi key dựng từ base_key + version cũ không còn được đọc
+def bump_version(base_key: str) -> None:
+    vkey = version_key(base_key)
+    try:
+        cache.incr(vkey)
+        cache.touch(vkey, VERSION_TTL)
+    except ValueError:
+        # chưa có / đã hết hạn -> tạo từ mốc thời gian: kết quả của version trước khi hết hạn
+        # (có thể còn trong cache) không bị đọc nhầm nếu counter đếm lại từ đầu
+        _set(vkey, int(time.time() * 1000), VERSION_TTL)
+    except Exception as ex:
+        logger.warning(f"shared cache invalidate failed key={base_key}: {ex}")
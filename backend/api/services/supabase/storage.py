@@ -1,4 +1,8 @@
 from .client import supabase
+from api.services.shared_cache import get_or_compute
+
+SIGNED_URL_EXPIRES = 60 * 60 * 4  # 4 giờ
+SIGNED_URL_CACHE_TTL = 60 * 60 * 3  # cache ngắn hơn hạn URL để client luôn nhận URL còn hiệu lực
 
 def upload_file(bucket: str, path: str, file_data, content_type: str = "application/octet-stream") -> dict:
     try:
@@ -23,7 +27,13 @@ def get_file_url(bucket: str, path: str, is_public: bool = False):
     if is_public:
         return storage.get_public_url(path)
 
-    return storage.create_signed_url(path, 60 * 60 * 4).get("signedURL")  # 4 giờ
+    # signed URL dùng chung giữa các worker: mỗi file chỉ gọi Supabase 1 lần / SIGNED_URL_CACHE_TTL
+    url, _ = get_or_compute(
+        f"storage:signed:{bucket}:{path}",
+        lambda: storage.create_signed_url(path, SIGNED_URL_EXPIRES).get("signedURL"),
+        SIGNED_URL_CACHE_TTL,
+    )
+    return url
 
 def delete_file(bucket: str, path: str):
     return supabase.storage.from_(bucket).remove([path])
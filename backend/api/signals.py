@@ -5,31 +5,61 @@ import json
 from django.db import transaction
 from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from api.models import CourseContent
-from api.services.reco_service.cb.tfidf_builder import transform_single_course
-from api.services.reco_service.io.cache import cache_invalidate, key_similar
+from api.models import CourseContent, Course, Chapter, Lesson, Enrollment, Favorite
+from api.services.reco_service.cb.update_queue import apply_course_updates_now, enqueue_course_update
+from api.services.reco_service.data_access.courses import refresh_visibility_index
+from api.services.reco_service.data_access.popularity import record_popularity_event
+from api.services.reco_service.io.cache import invalidate_home
+from api.utils import invalidate_course_detail, invalidate_course_detail_for_content
 
 logger = logging.getLogger(__name__)
 
+# Cập nhật TF-IDF / similarity qua hàng đợi Celery (debounce theo course), request trả về ngay.
+# Redis / broker lỗi -> cập nhật trực tiếp như cũ.
 def _schedule_tfidf_update(course_content_id: int):
     def _do():
         try:
-            transform_single_course(course_content_id)
-            cache_invalidate(key_similar(course_content_id))  # cache similar theo course
+            enqueue_course_update(course_content_id)
+            return
+        except Exception as ex:
+            logger.warning(f"TF-IDF update queue unavailable for course_content_id={course_content_id}: {ex}")
+        try:
+            apply_course_updates_now([course_content_id])
             logger.info(f"TF-IDF updated for course_content_id={course_content_id}")
         except Exception as ex:
             logger.exception(f"TF-IDF update failed for course_content_id={course_content_id}: {ex}")
     transaction.on_commit(_do)
 
+# Huỷ payload chi tiết course đã cache (Redis) sau khi commit
+def _schedule_course_detail_invalidation(course_id=None, course_content_id=None):
+    def _do():
+        try:
+            if course_id is not None:
+                invalidate_course_detail(course_id)
+            if course_content_id is not None:
+                invalidate_course_detail_for_content(course_content_id)
+        except Exception as ex:
+            logger.exception(f"Course detail cache invalidation failed: {ex}")
+    transaction.on_commit(_do)
+
 @receiver(post_save, sender=CourseContent)
 def coursecontent_post_save(sender, instance: CourseContent, created, **kwargs):
     # Khi tạo mới hoặc cập nhật nội dung, rebuild vector 1 dòng
     _schedule_tfidf_update(instance.id)
+    _schedule_course_detail_invalidation(course_content_id=instance.id)
 
 @receiver(m2m_changed, sender=CourseContent.categories.through)
 def coursecontent_categories_changed(sender, instance: CourseContent, action, **kwargs):
     if action in {"post_add", "post_remove", "post_clear"}:
         _schedule_tfidf_update(instance.id)
+        _schedule_course_detail_invalidation(course_content_id=instance.id)
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Chapter)
+@receiver(post_delete, sender=Lesson)
+def course_structure_changed(sender, instance, **kwargs):
+    _schedule_course_detail_invalidation(course_content_id=instance.course_content_id)
 
 @receiver(post_delete, sender=CourseContent)
 def coursecontent_post_delete(sender, instance: CourseContent, **kwargs):
@@ -39,4 +69,57 @@ def coursecontent_post_delete(sender, instance: CourseContent, **kwargs):
       luôn lọc bằng is_visible/ẩn ở tầng trả về; về sau chạy rebuild toàn bộ.
     - Nếu bạn có cờ is_visible: set is_visible=False trước, signals ở trên sẽ cập nhật TF-IDF của nội dung ẩn (ít thay đổi).
     """
-    logger.info(f"CourseContent deleted id={instance.id} (consider full CB rebuild later)")
\ No newline at end of file
+    logger.info(f"CourseContent deleted id={instance.id} (consider full CB rebuild later)")
+
+def _schedule_visibility_refresh():
+    def _do():
+        try:
+            refresh_visibility_index()
+        except Exception as ex:
+            logger.exception(f"Visibility index refresh failed: {ex}")
+    transaction.on_commit(_do)
+
+@receiver(post_save, sender=Course)
+def course_post_save(sender, instance: Course, created, **kwargs):
+    # is_visible / course mới -> làm mới visibility index của reco
+    _schedule_visibility_refresh()
+    _schedule_course_detail_invalidation(course_id=instance.id)
+
+@receiver(post_delete, sender=Course)
+def course_post_delete(sender, instance: Course, **kwargs):
+    _schedule_visibility_refresh()
+    _schedule_course_detail_invalidation(course_id=instance.id)
+
+def _schedule_popularity_event(course_id: int, ev_type: str):
+    def _do():
+        try:
+            record_popularity_event(course_id, ev_type)
+        except Exception as ex:
+            logger.exception(f"Popularity update failed for course_id={course_id}: {ex}")
+    transaction.on_commit(_do)
+
+# Huỷ cache gợi ý Home của đúng user vừa có tương tác
+def _schedule_home_invalidation(student_id):
+    def _do():
+        try:
+            invalidate_home(str(student_id))
+        except Exception as ex:
+            logger.exception(f"Home cache invalidation failed for user={student_id}: {ex}")
+    transaction.on_commit(_do)
+
+@receiver(post_save, sender=Enrollment)
+def enrollment_post_save(sender, instance: Enrollment, created, **kwargs):
+    _schedule_home_invalidation(instance.student_id)
+    if created:
+        _schedule_popularity_event(instance.course_id, "enroll")
+
+@receiver(post_save, sender=Favorite)
+def favorite_post_save(sender, instance: Favorite, created, **kwargs):
+    _schedule_home_invalidation(instance.student_id)
+    if created:
+        _schedule_popularity_event(instance.course_id, "favorite")
+
+@receiver(post_delete, sender=Enrollment)
+@receiver(post_delete, sender=Favorite)
+def interaction_post_delete(sender, instance, **kwargs):
+    _schedule_home_invalidation(instance.student_id)
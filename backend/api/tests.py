@@ -1,3 +1,185 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from api.celery import app as celery_app
+from api.services.reco_service.cb import update_queue
+from api.services.reco_service.cf.streaming import topk_neighbor_rows_from_R
+from api.services.reco_service.cf.update import affected_user_rows
+from api.services.reco_service.io import delta_store
+from api.services.reco_service.io.cf_store import patch_user_neighbors_csr, save_user_neighbors_csr
+from api.services.reco_service.tasks import apply_pending_course_updates_task, compact_cb_deltas_task
 
-# Create your tests here.
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# Hàng đợi cập nhật TF-IDF (cb/update_queue.py): chạy enqueue_course_update thật,
+# broker in-memory thay cho Redis; result backend theo settings (CELERY_RESULT_BACKEND) -
+# apply_async phải chạy được kể cả khi result backend không kết nối được.
+@override_settings(CACHES=LOCMEM_CACHE)
+class CourseUpdateQueueTests(SimpleTestCase):
+    def setUp(self):
+        self._conf = {k: celery_app.conf[k] for k in ("broker_url", "result_backend", "task_always_eager")}
+        celery_app.conf.update(
+            broker_url="memory://",
+            result_backend=getattr(settings, "CELERY_RESULT_BACKEND", None) or "redis://localhost:6379/0",
+            task_always_eager=False,
+        )
+        cache.clear()
+
+    def tearDown(self):
+        celery_app.conf.update(self._conf)
+        cache.clear()
+
+    def test_task_does_not_need_result_backend(self):
+        self.assertTrue(apply_pending_course_updates_task.ignore_result)
+
+    def test_enqueue_merges_and_schedules_once(self):
+        with mock.patch.object(
+            apply_pending_course_updates_task, "apply_async", wraps=apply_pending_course_updates_task.apply_async
+        ) as apply_async:
+            for cid in (1, 1, 2, 1):
+                update_queue.enqueue_course_update(cid)
+        self.assertEqual(set(update_queue.pending_course_updates()), {1, 2})
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertTrue(cache.get(update_queue.SCHEDULED_KEY))
+
+    def test_schedule_failure_leaves_no_pending_entry(self):
+        update_queue.enqueue_course_update(1)
+        cache.delete(update_queue.SCHEDULED_KEY)
+        with mock.patch.object(apply_pending_course_updates_task, "apply_async", side_effect=OSError("broker down")):
+            with self.assertRaises(OSError):
+                update_queue.enqueue_course_update(2)
+        self.assertEqual(set(update_queue.pending_course_updates()), {1})
+        self.assertIsNone(cache.get(update_queue.SCHEDULED_KEY))
+
+    def test_compact_is_scheduled(self):
+        tasks = {entry["task"] for entry in settings.CELERY_BEAT_SCHEDULE.values()}
+        self.assertIn(compact_cb_deltas_task.name, tasks)
+
+    def test_compact_skips_while_consumer_writes(self):
+        with mock.patch("api.services.reco_service.cb.tfidf_builder.compact_tfidf_delta") as compact:
+            with update_queue.cb_writer_lock() as acquired:
+                self.assertTrue(acquired)
+                self.assertEqual(update_queue.compact_course_deltas(), {"status": "busy"})
+            compact.assert_not_called()
+            with mock.patch(
+                "api.services.reco_service.cb.similarity.compact_course_similarity_delta", return_value=False
+            ):
+                self.assertEqual(update_queue.compact_course_deltas()["status"], "ok")
+            compact.assert_called_once()
+
+
+def _random_csr(rng, shape, density=0.3):
+    dense = rng.random(shape) * (rng.random(shape) < density)
+    return sparse.csr_matrix(dense)
+
+# Delta segment (io/delta_store.py): so với thay hàng trên ma trận dense
+class DeltaStoreTests(SimpleTestCase):
+    def test_replace_csr_rows_matches_dense(self):
+        rng = np.random.default_rng(0)
+        base = _random_csr(rng, (6, 5))
+        rows = np.array([4, 1, 7])  # hàng 7 nằm ngoài base -> mở rộng
+        patch = _random_csr(rng, (3, 6))
+        expected = np.zeros((8, 6))
+        expected[:6, :5] = base.toarray()
+        expected[rows] = patch.toarray()
+        out = delta_store.replace_csr_rows(base, rows, patch)
+        self.assertEqual(out.shape, (8, 6))
+        np.testing.assert_allclose(out.toarray(), expected)
+
+    def test_append_row_delta_matches_dense(self):
+        rng = np.random.default_rng(1)
+        base = _random_csr(rng, (6, 5))
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "m.npz")
+            sparse.save_npz(path, base)
+            expected = np.zeros((7, 5))
+            expected[:6] = base.toarray()
+            for rows in (np.array([0, 3]), np.array([3, 6])):
+                patch = _random_csr(rng, (rows.size, 5))
+                expected[rows] = patch.toarray()
+                n_rows, _nnz = delta_store.append_row_delta(path, rows, patch, (7, 5))
+            self.assertEqual(n_rows, 3)
+            np.testing.assert_allclose(delta_store.load_npz_with_delta(path).toarray(), expected)
+            self.assertTrue(delta_store.compact_row_delta(path))
+            self.assertFalse(os.path.exists(delta_store.delta_path(path)))
+            np.testing.assert_allclose(sparse.load_npz(path).toarray(), expected)
+
+# Cập nhật incremental CF: so với tính lại toàn bộ trên ma trận dense
+class IncrementalNeighborTests(SimpleTestCase):
+    def test_affected_user_rows_matches_dense(self):
+        rng = np.random.default_rng(2)
+        R = _random_csr(rng, (12, 8), density=0.2)
+        B = R.toarray() > 0
+        changed, touched = np.array([0, 5]), np.array([2])
+        for item_idf in (False, True):
+            ch = set(changed.tolist())
+            if item_idf:
+                ch |= set(np.flatnonzero(B[:, touched].any(axis=1)).tolist())
+            items = B[sorted(ch)].any(axis=0)
+            expected = ch | set(np.flatnonzero(B[:, items].any(axis=1)).tolist())
+            out = affected_user_rows(R, changed, touched, item_idf=item_idf)
+            self.assertEqual(out.tolist(), sorted(expected))
+
+    def _dense_topk(self, R, rows, k, min_sim, shrink_beta):
+        D = R.toarray()
+        norms = np.linalg.norm(D, axis=1)
+        X = np.divide(D, norms[:, None], out=np.zeros_like(D), where=norms[:, None] > 0)
+        S = X @ X.T
+        B = (D > 0).astype(np.float64)
+        C = B @ B.T
+        S = S * (C / (C + shrink_beta))
+        np.fill_diagonal(S, 0.0)
+        out = np.zeros((len(rows), D.shape[0]))
+        for i, r in enumerate(rows):
+            cand = np.flatnonzero(S[r] > min_sim)
+            top = cand[np.argsort(-S[r, cand])][:k]
+            out[i, top] = S[r, top]
+        return out
+
+    def test_topk_neighbor_rows_matches_dense(self):
+        rng = np.random.default_rng(3)
+        R = _random_csr(rng, (15, 10))
+        rows = np.array([0, 7, 14, 3])
+        for k, min_sim, block in ((3, 0.0, 2), (20, 0.05, 16)):
+            out = topk_neighbor_rows_from_R(R, rows, k=k, min_sim=min_sim, shrink_beta=5.0, block_size=block)
+            np.testing.assert_allclose(out.toarray(), self._dense_topk(R, rows, k, min_sim, 5.0), rtol=1e-5, atol=1e-6)
+
+    def test_patch_user_neighbors_matches_dense(self):
+        rng = np.random.default_rng(4)
+        ids = ["u0", "u1", "u2", "u3", "u4"]
+        N_old = _random_csr(rng, (5, 5), density=0.5)
+        N_old.setdiag(0)
+        N_old.eliminate_zeros()
+        # user_ids mới: "u2" bị xoá, thêm "u5"; thứ tự hàng khác store cũ
+        user_ids = ["u4", "u0", None, "u1", "u3", "u5"]
+        rows = np.array([1, 5])
+        N_rows = _random_csr(rng, (2, 6), density=0.5)
+
+        old = {u: dict(zip([ids[c] for c in N_old[i].indices], N_old[i].data)) for i, u in enumerate(ids)}
+        expected = {}
+        for r, u in enumerate(user_ids):
+            if u is None:
+                continue
+            if r in rows.tolist():
+                row = N_rows[rows.tolist().index(r)]
+                neigh = {user_ids[c]: v for c, v in zip(row.indices, row.data) if user_ids[c] is not None}
+            else:
+                neigh = {v: s for v, s in old.get(u, {}).items() if v in user_ids}
+            expected[u] = neigh
+
+        with tempfile.TemporaryDirectory() as d:
+            store = save_user_neighbors_csr(d, ids, N_old)
+            patched = patch_user_neighbors_csr(d, store, user_ids, rows, N_rows).to_dict()
+        self.assertEqual(set(patched), set(expected))
+        for u, neigh in expected.items():
+            got = dict(patched[u])
+            self.assertEqual(set(got), set(neigh), u)
+            for v, s in neigh.items():
+                self.assertAlmostEqual(got[v], s, places=5)
+            sims = [s for _, s in patched[u]]
+            self.assertEqual(sims, sorted(sims, reverse=True))
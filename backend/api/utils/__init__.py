@@ -4,5 +4,9 @@ from .course_util import (
     get_course_content_lessons,
     add_file_url_for,
     get_course_progress,
-    get_progress_map_bulk
+    get_progress_map_bulk,
+    COURSE_DETAIL_CACHE_TTL,
+    course_detail_cache_key,
+    invalidate_course_detail,
+    invalidate_course_detail_for_content
 )
\ No newline at end of file
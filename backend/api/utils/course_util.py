@@ -3,7 +3,8 @@ import uuid
 from django.conf import settings
 from api.exceptions.custom_exceptions import FileUploadException
 from api.services.supabase.storage import upload_file, delete_file, get_file_url
-from api.models import CourseContent, Lesson, LessonCompletion
+from api.services.shared_cache import get_version, bump_version
+from api.models import Course, CourseContent, Lesson, LessonCompletion
 from api.serializers import ChapterSerializer, SimpleLessonSerializer
 
 logger = logging.getLogger(__name__)
@@ -50,6 +51,24 @@ def delete_course_content(course_content_id):
         )
         course_content.delete()
 
+# Cache payload chi tiết course (Redis, có version để huỷ khi course / chapter / lesson đổi).
+# num_students / num_favorites có thể trễ tối đa COURSE_DETAIL_CACHE_TTL giây.
+COURSE_DETAIL_CACHE_TTL = 300
+
+def key_course_detail(course_id):
+    return f"course:detail:{course_id}"
+
+def course_detail_cache_key(course_id):
+    base_key = key_course_detail(course_id)
+    return f"{base_key}:v{get_version(base_key)}"
+
+def invalidate_course_detail(course_id):
+    bump_version(key_course_detail(course_id))
+
+def invalidate_course_detail_for_content(course_content_id):
+    for course_id in Course.objects.filter(course_content_id=course_content_id).values_list("id", flat=True):
+        invalidate_course_detail(course_id)
+
 def get_course_content_lessons(course_content):
     chapters = course_content.chapters.all()
     chapters_data = []
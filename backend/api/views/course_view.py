@@ -21,12 +21,15 @@ from api.serializers import (
 from api.permissions import IsTeacher, IsCourseOwner, IsAdmin   
 from api.middlewares.authentication import SupabaseJWTAuthentication
 from api.services.supabase.storage import delete_file
+from api.services.shared_cache import get_or_compute
 from api.utils import (
     get_course_content,
     delete_course_content,
     get_course_content_lessons,
     add_file_url_for,
-    get_progress_map_bulk
+    get_progress_map_bulk,
+    COURSE_DETAIL_CACHE_TTL,
+    course_detail_cache_key
 )
 
 logger = logging.getLogger(__name__)
@@ -268,6 +271,21 @@ class CourseRetrieveAPIView(generics.RetrieveAPIView):
 
     def retrieve(self, request, *args, **kwargs):
         logger.info(f"Retrieving course with ID: {kwargs.get('id')}")
+        # Payload dùng chung giữa các worker; hết hạn -> chỉ 1 request dựng lại
+        course_data, _ = get_or_compute(
+            course_detail_cache_key(kwargs.get('id')),
+            self._course_payload,
+            COURSE_DETAIL_CACHE_TTL,
+        )
+
+        logger.info("Course retrieved successfully")
+        return Response({
+            'success': True,
+            'message': 'Course retrieved successfully',
+            'course': course_data
+        }, status=status.HTTP_200_OK)
+
+    def _course_payload(self):
         try:
             instance = self.get_object()
         except Http404 as e:
@@ -283,13 +301,7 @@ class CourseRetrieveAPIView(generics.RetrieveAPIView):
         course_data['course_content'] = course_content_data
         course_data['num_students'] = instance.num_students
         course_data['num_favorites'] = instance.num_favorites
-
-        logger.info("Course retrieved successfully")
-        return Response({
-            'success': True,
-            'message': 'Course retrieved successfully',
-            'course': course_data
-        }, status=status.HTTP_200_OK)
+        return course_data
     
 
 # Course API to retrieve a course detail
@@ -15,7 +15,8 @@ from api.services.reco_service.cb.similarity import top_k_similar_from_course
 from api.services.reco_service.hybrid.service import hybrid_recommend_home
 from api.services.reco_service.data_access.courses import fetch_popular_course_ids
 from api.utils.course_util import get_progress_map_bulk
-from api.services.reco_service.config import ALPHA_HOME, CACHE_TTL
+from api.services.reco_service.io.cache import cached_result, key_similar
+from api.services.reco_service.config import ALPHA_HOME, CACHE_TTL, TTL_SIMILAR
 
 logger = logging.getLogger(__name__)
 
@@ -66,12 +67,23 @@ class SimilarCourseListAPIView(generics.ListAPIView):
         if not Course.objects.filter(id=course_id).exists():
             raise NotFound(f"Course with id={course_id} not found.")
         
-        k = request.query_params.get("k", 12)
+        try:
+            k = int(request.query_params.get("k", 12))
+        except (TypeError, ValueError):
+            k = 12
         base_exclude = {int(course_id)}  # luôn loại chính nó
         exclude_ids = self._get_exclude_ids_for_user(request.user, base_exclude)
 
         logger.info(f"Fetching content-based similar courses for {course_id}, k={k}")
-        similar = top_k_similar_from_course(course_id=int(course_id), k=k, exclude_ids=exclude_ids)
+        # Cache 2 tầng theo course + k + tập exclude + generation "cb"
+        similar = cached_result(
+            "similar",
+            key_similar(int(course_id)),
+            {"k": k, "exclude": sorted(exclude_ids)},
+            lambda: top_k_similar_from_course(course_id=int(course_id), k=k, exclude_ids=exclude_ids),
+            TTL_SIMILAR,
+            generations=("cb",),
+        )
         if not similar:
             return Response({
                 "success": True,
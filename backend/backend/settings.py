@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 from decouple import config
+from celery.schedules import crontab
+from api.services.reco_service.config import CB_DELTA_COMPACT_HOUR, POPULARITY_REFRESH_MINUTES
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,6 +49,16 @@ SECRET_KEY = config("SECRET_KEY")
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 CELERY_RESULT_BACKEND = "redis://localhost:6379/1"  # nếu dùng Redis làm backend
 
+# Cache dùng chung giữa các worker (gợi ý, chi tiết course, signed URL) -> Redis db 2
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": config("REDIS_CACHE_URL", default="redis://localhost:6379/2"),
+        "KEY_PREFIX": "xpervia",
+        "TIMEOUT": 300,
+    }
+}
+
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config("DEBUG", default=False, cast=bool)
@@ -120,7 +132,19 @@ DATABASES = {
 
 # Cron job settings
 CELERY_BROKER_URL = "redis://localhost:6379/0"  # hoặc RabbitMQ
-CELERY_RESULT_BACKEND = "django-db"  # hoặc Redis
+CELERY_RESULT_BACKEND = CELERY_BROKER_URL  # Redis ("django-db" cần django_celery_results, không có trong requirements)
+CELERY_BEAT_SCHEDULE = {
+    # Bảng xếp hạng course phổ biến cho guest / fallback (reco_service.data_access.popularity)
+    "reco-refresh-popularity": {
+        "task": "api.services.reco_service.tasks.refresh_popularity_task",
+        "schedule": POPULARITY_REFRESH_MINUTES * 60,  # giây
+    },
+    # Gộp delta TF-IDF / course similarity vào ma trận gốc (reco_service.cb.update_queue.compact_course_deltas)
+    "reco-compact-cb-deltas": {
+        "task": "api.services.reco_service.tasks.compact_cb_deltas_task",
+        "schedule": crontab(hour=CB_DELTA_COMPACT_HOUR, minute=0),
+    },
+}
 
 # AUTH_USER_MODEL = 'api.User'
 